@@ -2,9 +2,9 @@
 
 from cuuats.snt.lts.lts_postgis import Lts
 from cuuats.snt.lts.model.Segment import Segment
-from cuuats.snt.lts.model.Approach import Approach
-from cuuats.snt.lts import config as c
 
+# placeholder kept out of the package exports until ALTS criteria are
+# defined, MultiBatch rejects the alts mode in the meantime
 class Alts(Lts):
     def __init__(self, segment):
         if type(segment) is Segment:
@@ -15,8 +15,6 @@ class Alts(Lts):
     def _calcualate_functional_class(self):
         pass
 
-    def calculate_alts(self):
-
 
 if __name__ == '__main__':
     alts = Alts(segment = Segment())
@@ -0,0 +1,280 @@
+## spatial index grouping approaches and sidewalks by segment
+import numpy as np
+from cuuats.snt.lts.model.ApproachStore import ApproachStore
+from cuuats.snt.lts.model.SidewalkStore import SidewalkStore
+from cuuats.snt.lts import instrument
+
+
+def bearings(starts, ends):
+    """
+    this function return the bearing of lines in degrees, counterclockwise
+    from the x axis
+    :param starts: (n, 2) array of first points
+    :param ends: (n, 2) array of last points
+    :return: ndarray of float64 from -180 to 180
+    """
+    delta = np.asarray(ends, dtype=np.float64) - \
+        np.asarray(starts, dtype=np.float64)
+    return np.degrees(np.arctan2(delta[:, 1], delta[:, 0]))
+
+
+def line_difference(a, b):
+    """
+    this function return the angle between lines of bearings a and b
+    regardless of their direction
+    :return: ndarray of degrees from 0 to 90
+    """
+    difference = np.abs(np.asarray(a) - np.asarray(b)) % 180
+    return np.minimum(difference, 180 - difference)
+
+
+def group(rows, size):
+    """
+    this function groups features by the segment they were matched to,
+    unmatched features are left out
+    :param rows: segment row of every feature, -1 for none
+    :param size: number of segments
+    :return: tuple of (CSR offsets with one more entry than segments,
+        ndarray of feature index in segment order)
+    """
+    rows = np.asarray(rows)
+    matched = np.flatnonzero(rows >= 0)
+    order = matched[np.argsort(rows[matched], kind='stable')]
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows[matched], minlength=size), out=offsets[1:])
+    return offsets, order
+
+
+class SegmentIndex(object):
+    """
+    uniform grid over the straight pieces of segment lines, every piece is
+    listed under each cell its bounding box touches and the cells are
+    sorted by key, so a bulk query looks up the cells around every feature
+    with one binary search and measures its distance to the pieces found
+    there in one vectorized pass, the cells are at least as large as the
+    match distance so a feature looks up at most three by three cells
+    """
+    def __init__(self, starts, ends, owners=None, cell_size=None):
+        """
+        :param starts: (n, 2) array of the first point of every piece
+        :param ends: (n, 2) array of the last point of every piece
+        :param owners: segment row of every piece, each piece its own segment
+            by default
+        :param cell_size: smallest side of the grid cells, the median
+            length of the pieces that are not points by default
+        """
+        self.starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+        self.ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+        count = len(self.starts)
+        self.owners = np.arange(count) if owners is None else \
+            np.asarray(owners, dtype=np.int64)
+        self.size = int(self.owners.max()) + 1 if count else 0
+        self.bearings = bearings(self.starts, self.ends)
+
+        self.low = np.minimum(self.starts, self.ends)
+        self.high = np.maximum(self.starts, self.ends)
+        if cell_size is None:
+            lengths = np.hypot(*(self.ends - self.starts).T)
+            lengths = lengths[lengths > 0]
+            cell_size = np.median(lengths) if len(lengths) else 1.0
+        self.cell_size = max(float(cell_size), 1e-9)
+        self.origin = self.low.min(axis=0) if count else np.zeros(2)
+        # grids by cell size, built for the match distances queried
+        self._grids = {}
+
+    @classmethod
+    def from_polylines(cls, polylines, cell_size=None):
+        """
+        this function builds an index from one polyline per segment
+        :param polylines: list of (k, 2) arrays of vertices in segment order
+        :param cell_size: side of the grid cells
+        :return: SegmentIndex
+        """
+        starts = []
+        ends = []
+        owners = []
+        for row, line in enumerate(polylines):
+            line = np.asarray(line, dtype=np.float64).reshape(-1, 2)
+            if len(line) == 1:
+                line = np.vstack([line, line])
+            starts.append(line[:-1])
+            ends.append(line[1:])
+            owners.append(np.full(len(line) - 1, row, dtype=np.int64))
+        if not starts:
+            return cls(np.zeros((0, 2)), np.zeros((0, 2)), cell_size=cell_size)
+        index = cls(np.concatenate(starts), np.concatenate(ends),
+                    np.concatenate(owners), cell_size)
+        index.size = len(polylines)
+        return index
+
+    def _cells(self, points, cell_size):
+        return np.floor((points - self.origin) / cell_size).astype(np.int64)
+
+    def _grid(self, cell_size):
+        """
+        this function return the sorted cell keys and the piece listed under
+        every key of the grid of cell_size
+        """
+        grid = self._grids.get(cell_size)
+        if grid is None:
+            first = self._cells(self.low, cell_size)
+            pieces, keys = self._expand(
+                first, self._cells(self.high, cell_size) - first + 1)
+            order = np.argsort(keys, kind='stable')
+            grid = self._grids[cell_size] = (keys[order], pieces[order])
+        return grid
+
+    def _keys(self, x, y):
+        # cell coordinates are offset into 32 bits on either axis
+        return (x + (1 << 31)) << 32 | (y + (1 << 31))
+
+    def _expand(self, first, span):
+        """
+        this function return the keys of the cells of every box of cells
+        first to first + span - 1 and the box each key belongs to
+        """
+        counts = span[:, 0] * span[:, 1]
+        boxes = np.repeat(np.arange(len(first)), counts)
+        step = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                   counts)
+        width = span[boxes, 0]
+        return boxes, self._keys(first[boxes, 0] + step % width,
+                                 first[boxes, 1] + step // width)
+
+    def _candidates(self, points, distance):
+        """
+        this function return the (point, piece) pairs of the pieces listed
+        in the cells within distance of every point
+        """
+        cell_size = max(self.cell_size, float(distance))
+        grid_keys, grid_pieces = self._grid(cell_size)
+        first = self._cells(points - distance, cell_size)
+        span = self._cells(points + distance, cell_size) - first + 1
+        owner, keys = self._expand(first, span)
+        low = np.searchsorted(grid_keys, keys, side='left')
+        counts = np.searchsorted(grid_keys, keys, side='right') - low
+        owner = np.repeat(owner, counts)
+        step = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                   counts)
+        return owner, grid_pieces[np.repeat(low, counts) + step]
+
+    def distances(self, points, pieces):
+        """
+        this function return the distance from points to pieces
+        :param points: (n, 2) array of points
+        :param pieces: piece index of every point
+        :return: ndarray of float64
+        """
+        a = self.starts[pieces]
+        ab = self.ends[pieces] - a
+        ap = points - a
+        length = (ab * ab).sum(axis=1)
+        t = np.clip((ap * ab).sum(axis=1) / np.where(length > 0, length, 1),
+                    0, 1)
+        return np.hypot(*(ap - t[:, None] * ab).T)
+
+    @instrument.stage('assembly.match')
+    def match(self, points, distance, bearings=None, tolerance=None):
+        """
+        this function matches every point to the segment of the nearest
+        piece within distance, and when bearings are given whose line is
+        within tolerance degrees of the bearing, ties go to the lowest row
+        :param points: (n, 2) array of feature locations
+        :param distance: largest distance from a feature to its segment
+        :param bearings: bearing of every feature in degrees, e.g. of the
+            sidewalk line or the direction of travel of an approach
+        :param tolerance: largest angle between a feature and its segment
+        :return: tuple of (ndarray of segment row, -1 for unmatched points,
+            ndarray of distance, inf for unmatched points)
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        rows = np.full(len(points), -1, dtype=np.int64)
+        found = np.full(len(points), np.inf)
+        if not len(points) or not len(self.starts):
+            return rows, found
+        owner, pieces = self._candidates(points, distance)
+        gap = self.distances(points[owner], pieces)
+        keep = gap <= distance
+        if bearings is not None and tolerance is not None:
+            keep &= line_difference(np.asarray(bearings)[owner],
+                                    self.bearings[pieces]) <= tolerance
+        owner = owner[keep]
+        gap = gap[keep]
+        segment = self.owners[pieces[keep]]
+        order = np.lexsort((segment, gap, owner))
+        first = order[np.r_[True, owner[order][1:] != owner[order][:-1]]] \
+            if len(order) else order
+        rows[owner[first]] = segment[first]
+        found[owner[first]] = gap[first]
+        return rows, found
+
+    def match_lines(self, starts, ends, distance, tolerance=None):
+        """
+        this function matches lines, e.g. sidewalks, by their midpoint and
+        bearing
+        :param starts: (n, 2) array of first points
+        :param ends: (n, 2) array of last points
+        :param distance: largest distance from a midpoint to its segment
+        :param tolerance: largest angle between a line and its segment
+        :return: tuple of (ndarray of segment row, ndarray of distance)
+        """
+        starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+        return self.match((starts + ends) / 2, distance,
+                          bearings(starts, ends), tolerance)
+
+    def approaches(self, points, columns, distance, bearings=None,
+                   tolerance=None):
+        """
+        this function return the approaches grouped by segment
+        :param points: (n, 2) array of approach locations
+        :param columns: dictionary of ApproachStore keyword argument to
+            array with one value per approach
+        :param distance: largest distance from an approach to its segment
+        :param bearings: direction of travel of every approach in degrees
+        :param tolerance: largest angle between an approach and its segment
+        :return: ApproachStore with one group per segment
+        """
+        rows = self.match(points, distance, bearings, tolerance)[0]
+        return _store(ApproachStore, rows, self.size, columns)
+
+    def sidewalks(self, starts, ends, columns, distance, tolerance=None):
+        """
+        this function return the sidewalks grouped by segment
+        :param starts: (n, 2) array of the first point of every sidewalk
+        :param ends: (n, 2) array of the last point of every sidewalk
+        :param columns: dictionary of SidewalkStore keyword argument to
+            array with one value per sidewalk
+        :param distance: largest distance from a sidewalk to its segment
+        :param tolerance: largest angle between a sidewalk and its segment
+        :return: SidewalkStore with one group per segment
+        """
+        rows = self.match_lines(starts, ends, distance, tolerance)[0]
+        return _store(SidewalkStore, rows, self.size, columns)
+
+    def lists(self, rows, features):
+        """
+        this function groups feature objects by segment, e.g. the Approach
+        lists of Blts(segment, approaches)
+        :param rows: segment row of every feature, as returned by match
+        :param features: list of features
+        :return: list of lists of features, one list per segment
+        """
+        offsets, order = group(rows, self.size)
+        return [[features[i] for i in order[offsets[s]:offsets[s + 1]]]
+                for s in range(self.size)]
+
+
+def _store(store, rows, size, columns):
+    offsets, order = group(rows, size)
+    taken = {}
+    for name, values in columns.items():
+        if values is None:
+            taken[name] = None
+            continue
+        if not isinstance(values, np.ndarray):
+            array = np.empty(len(values), dtype=object)
+            array[:] = list(values)
+            values = array
+        taken[name] = values[order]
+    return store(offsets, **taken)
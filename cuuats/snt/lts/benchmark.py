@@ -0,0 +1,357 @@
+## throughput and memory benchmark for the LTS scorers
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from cuuats.snt.lts.synthetic import SyntheticNetwork
+from cuuats.snt.lts import instrument
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ENGINES = ('blts', 'plts', 'blts_batch', 'plts_batch', 'blts_parallel',
+           'plts_parallel', 'blts_cube', 'plts_cube')
+
+
+def peak_rss():
+    """
+    this function return the peak resident set size of the process and its
+    finished children in bytes, None where the platform does not report it
+    :return: int or None
+    """
+    if resource is None:
+        return None
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+
+
+class Stages(object):
+    """
+    accumulates the time spent in each named stage
+    """
+    def __init__(self):
+        self.seconds = {}
+
+    def run(self, name, function, *args, **kwargs):
+        began = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.seconds[name] = self.seconds.get(name, 0.0) + \
+            time.perf_counter() - began
+        return result
+
+
+def _score_blts(network, stages, limit):
+    from cuuats.snt.lts.blts_postgis import Blts
+
+    segments, approaches, sidewalks = stages.run(
+        'objects', network.objects, limit)
+
+    def score():
+        for segment, segment_approaches in zip(segments, approaches):
+            try:
+                Blts(segment, segment_approaches).calculate_blts()
+            except (AssertionError, TypeError, ValueError):
+                pass
+    stages.run('score', score)
+    return len(segments)
+
+
+def _score_plts(network, stages, limit):
+    from cuuats.snt.lts.plts_postgis import Plts
+
+    segments, approaches, sidewalks = stages.run(
+        'objects', network.objects, limit)
+
+    def score():
+        for segment, segment_sidewalks, segment_approaches in zip(
+                segments, sidewalks, approaches):
+            try:
+                Plts(segment, segment_sidewalks,
+                     segment_approaches).calculate_plts()
+            except (AssertionError, TypeError, ValueError):
+                pass
+    stages.run('score', score)
+    return len(segments)
+
+
+def _score_blts_batch(network, stages, limit):
+    from cuuats.snt.lts.blts_batch import BltsBatch
+
+    approaches = stages.run('store', network.approach_store)
+    batch = stages.run('store', BltsBatch, approaches=approaches,
+                       **network.blts_columns())
+    stages.run('segment', batch.calculate_segment_score)
+    stages.run('turn_lanes', batch._calculate_turn_lanes)
+    stages.run('crossings', batch._calculate_crossings)
+    stages.run('aggregate', batch._aggregate_score,
+               batch.right_turn_lane_score, batch.left_turn_lane_score,
+               batch.crossing_without_median_score,
+               batch.crossing_with_median_score, batch.segment_score,
+               method="MAX")
+    return network.size
+
+
+def _score_plts_batch(network, stages, limit):
+    from cuuats.snt.lts.plts_batch import PltsBatch
+
+    sidewalks = stages.run('store', network.sidewalk_store)
+    approaches = stages.run('store', network.approach_store)
+    batch = stages.run('store', PltsBatch, sidewalks=sidewalks,
+                       approaches=approaches, **network.plts_columns())
+    stages.run('sidewalks', batch._calculate_sidewalk_scores)
+    stages.run('crossings', batch._calculate_crossing_scores)
+    stages.run('aggregate', batch._aggregate_score,
+               batch.condition_score, batch.physical_buffer_score,
+               batch.buffer_width_score, batch.landuse_score, method="MAX")
+    return network.size
+
+
+def _score_blts_cube(network, stages, limit):
+    from cuuats.snt.lts.blts_batch import BltsBatch
+    from cuuats.snt.lts.cube import BltsCube, get_cube
+
+    cube = stages.run('compile', get_cube, BltsCube, 10000)
+    approaches = stages.run('store', network.approach_store)
+    batch = stages.run('store', BltsBatch, approaches=approaches,
+                       **network.blts_columns())
+    stages.run('score', cube.calculate_blts, batch)
+    return network.size
+
+
+def _score_plts_cube(network, stages, limit):
+    from cuuats.snt.lts.plts_batch import PltsBatch
+    from cuuats.snt.lts.cube import PltsCube, get_cube
+
+    cube = stages.run('compile', get_cube, PltsCube)
+    sidewalks = stages.run('store', network.sidewalk_store)
+    approaches = stages.run('store', network.approach_store)
+    batch = stages.run('store', PltsBatch, sidewalks=sidewalks,
+                       approaches=approaches, **network.plts_columns())
+    stages.run('score', cube.calculate_plts, batch)
+    return network.size
+
+
+def _parallel(mode):
+    def score(network, stages, limit, workers=None):
+        from cuuats.snt.lts.parallel import ParallelScorer
+
+        approaches = stages.run('store', network.approach_store)
+        sidewalks = None
+        if mode == 'plts':
+            sidewalks = stages.run('store', network.sidewalk_store)
+            columns = network.plts_columns()
+        else:
+            columns = network.blts_columns()
+        scorer = ParallelScorer(mode, workers=workers)
+        stages.run('score', scorer.score, network.segment_ids, columns,
+                   approaches, sidewalks)
+        return network.size
+    return score
+
+
+_SCORERS = {
+    'blts': _score_blts,
+    'plts': _score_plts,
+    'blts_batch': _score_blts_batch,
+    'plts_batch': _score_plts_batch,
+    'blts_parallel': _parallel('blts'),
+    'plts_parallel': _parallel('plts'),
+    'blts_cube': _score_blts_cube,
+    'plts_cube': _score_plts_cube,
+}
+
+
+def run_case(engine, size, seed=0, chunk_size=1000000, scalar_limit=100000,
+             workers=None, profile=False):
+    """
+    this function generates a synthetic network of size segments in chunks
+    and scores it with one engine, the scalar engines stop after
+    scalar_limit segments
+    :param engine: one of ENGINES
+    :param size: number of segments
+    :param seed: random seed of the network
+    :param chunk_size: number of segments generated and scored at once
+    :param scalar_limit: maximum number of segments scored by blts and plts
+    :param workers: number of processes of the parallel engines
+    :param profile: True to add the instrumentation summary to the results
+    :return: dictionary of results
+    """
+    score = _SCORERS[engine]
+    profiler = instrument.enable() if profile else None
+    kwargs = {'workers': workers} if engine.endswith('_parallel') else {}
+    limit = scalar_limit if engine in ('blts', 'plts') else size
+    stages = Stages()
+    scored = 0
+    for offset in range(0, min(size, limit), chunk_size):
+        chunk = min(chunk_size, size - offset, limit - offset)
+        network = stages.run('generate', SyntheticNetwork, chunk, seed,
+                             offset)
+        scored += score(network, stages, chunk, **kwargs)
+        del network
+    if profiler is not None:
+        instrument.disable()
+
+    seconds = sum(v for k, v in stages.seconds.items() if k != 'generate')
+    rss = peak_rss()
+    result = {
+        'engine': engine,
+        'size': size,
+        'segments': scored,
+        'seconds': seconds,
+        'segments_per_second': scored / seconds if seconds else None,
+        'peak_rss_mb': rss / 2.0 ** 20 if rss is not None else None,
+        'stages': stages.seconds,
+    }
+    if profiler is not None:
+        result['profile'] = profiler.summary()
+        result['report'] = profiler.report()
+    return result
+
+
+def _run_child(connection, args, kwargs):
+    try:
+        connection.send((run_case(*args, **kwargs), None))
+    except Exception as e:
+        connection.send((None, '%s: %s' % (type(e).__name__, e)))
+    connection.close()
+
+
+def run_isolated(engine, size, **kwargs):
+    """
+    this function runs a case in a new process so that its peak memory is
+    not mixed with the other cases
+    :return: dictionary of results
+    """
+    parent, child = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=_run_child, args=(child, (engine, size), kwargs))
+    process.start()
+    child.close()
+    result, error = parent.recv()
+    process.join()
+    if error is not None:
+        raise RuntimeError('%s %d failed: %s' % (engine, size, error))
+    return result
+
+
+def environment():
+    """
+    this function return the commit and platform the benchmark ran on
+    :return: dictionary
+    """
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': numpy_version,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(previous, current, threshold=0.1):
+    """
+    this function compares two benchmark results case by case
+    :param previous: results loaded from a previous run
+    :param current: results of this run
+    :param threshold: relative slow down reported as a regression
+    :return: tuple of (list of text lines, list of regressed cases)
+    """
+    before = dict(((r['engine'], r['size']), r) for r in previous['results'])
+    lines = []
+    regressions = []
+    for result in current['results']:
+        key = (result['engine'], result['size'])
+        old = before.get(key)
+        if old is None or not old['segments_per_second'] or \
+                not result['segments_per_second']:
+            continue
+        ratio = result['segments_per_second'] / old['segments_per_second']
+        line = '%-14s %10d %12.0f -> %12.0f segments/s (%+.1f%%)' % (
+            key[0], key[1], old['segments_per_second'],
+            result['segments_per_second'], (ratio - 1) * 100)
+        if old.get('peak_rss_mb') and result.get('peak_rss_mb'):
+            line += '  %.0f -> %.0f MB' % (old['peak_rss_mb'],
+                                          result['peak_rss_mb'])
+        if ratio < 1 - threshold:
+            line += '  REGRESSION'
+            regressions.append(key)
+        lines.append(line)
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='benchmark the LTS scorers on a synthetic network')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--engines', nargs='+', choices=ENGINES,
+                        default=['blts', 'plts', 'blts_batch', 'plts_batch'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=1000000)
+    parser.add_argument('--scalar-limit', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--profile', action='store_true',
+                        help='print the instrumentation report of each case')
+    parser.add_argument('--no-isolate', action='store_true',
+                        help='run every case in this process')
+    parser.add_argument('--output', help='write the results to a JSON file')
+    parser.add_argument('--compare', help='JSON file of a previous run')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    run = run_case if args.no_isolate else run_isolated
+    results = []
+    for size in args.sizes:
+        for engine in args.engines:
+            result = run(engine, size, seed=args.seed,
+                         chunk_size=args.chunk_size,
+                         scalar_limit=args.scalar_limit,
+                         workers=args.workers, profile=args.profile)
+            results.append(result)
+            rss = result['peak_rss_mb']
+            print('%-14s %10d %12.0f segments/s %8s MB  %s' % (
+                engine, size, result['segments_per_second'] or 0,
+                '%.0f' % rss if rss is not None else '-',
+                ' '.join('%s=%.3fs' % i for i in
+                         sorted(result['stages'].items()))))
+            if args.profile:
+                print(result.pop('report'))
+            sys.stdout.flush()
+
+    output = {'environment': environment(), 'seed': args.seed,
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            lines, regressions = compare(json.load(f), output,
+                                         args.threshold)
+        print('\n'.join(lines))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
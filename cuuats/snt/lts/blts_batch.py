@@ -0,0 +1,257 @@
+## vectorized blts class
+import numpy as np
+from cuuats.snt.lts.lts_batch import LtsBatch, segment_max
+from cuuats.snt.lts import blts_postgis as b
+from cuuats.snt.lts.model.ApproachStore import ApproachStore
+from cuuats.snt.lts.tables import TABLES as c
+from cuuats.snt.lts import instrument
+
+
+class BltsBatch(LtsBatch):
+    """
+    scores columns of segments at once, each column is an ndarray, a masked
+    array or a sequence with None for null values, results match Blts
+    """
+    def __init__(self, aadt, lanes_per_direction, bicycle_facility_width,
+                 parking_lane_width, posted_speed=None, functional_class=None,
+                 approaches=None, turn_criteria=10000):
+        LtsBatch.__init__(self, len(aadt))
+        aadt, aadt_null = self._add_column('segment.aadt', aadt)
+        # Segment stores a missing aadt as 0
+        aadt[aadt_null] = 0
+        aadt_null[:] = False
+        self._add_column('segment.lanes_per_direction', lanes_per_direction)
+        self._add_column('segment.bicycle_facility_width',
+                         bicycle_facility_width)
+        self._add_column('segment.parking_lane_width', parking_lane_width)
+        if posted_speed is None:
+            posted_speed = np.ma.masked_all(self.size)
+        self._add_column('segment.posted_speed', posted_speed)
+        if functional_class is None:
+            functional_class = np.ma.masked_all(self.size)
+        self._add_column('segment.functional_class', functional_class)
+
+        if approaches is None:
+            approaches = ApproachStore(np.zeros(self.size + 1), [])
+        self._set_approaches(approaches, self._join(approaches),
+                             turn_criteria)
+
+    @classmethod
+    def from_shared(cls, batch, approaches, approach_columns,
+                    turn_criteria=10000):
+        """
+        this function builds a batch on the converted segment columns of
+        another batch and approach columns already joined to them, e.g. to
+        score the segments of a PltsBatch without converting them again
+        :param batch: LtsBatch with the segment columns of BltsBatch
+        :param approaches: ApproachStore grouped by segment
+        :param approach_columns: columns of batch._join(approaches)
+        :param turn_criteria: aadt above which turn lanes are scored
+        :return: BltsBatch
+        """
+        self = cls._from_columns(batch)
+        self._set_approaches(approaches, approach_columns, turn_criteria)
+        return self
+
+    def _set_approaches(self, approaches, approach_columns, turn_criteria):
+        self.approaches = approaches
+        self.approach_columns = approach_columns
+
+        self.turn_criteria = turn_criteria
+        self.calculate_turn = self.columns['segment.aadt'][0] > turn_criteria
+        self.bike_lane_with_adj_parking_score = None
+        self.bike_lane_without_adj_parking_score = None
+        self.mix_traffic_score = None
+        self.segment_score = None
+        self.right_turn_lane_score = None
+        self.left_turn_lane_score = None
+        self.crossing_with_median_score = None
+        self.crossing_without_median_score = None
+        self.blts_score = None
+
+    @classmethod
+    def from_objects(cls, segments, approach_lists=None, turn_criteria=10000):
+        """
+        this function builds a batch from Segment objects and, optionally, a
+        list of Approach lists with one list per segment
+        :param segments: list of Segment
+        :param approach_lists: list of lists of Approach
+        :param turn_criteria: aadt above which turn lanes are scored
+        :return: BltsBatch
+        """
+        def column(name):
+            values = np.empty(len(segments), dtype=object)
+            values[:] = [getattr(s, name) for s in segments]
+            return values
+
+        approaches = None
+        if approach_lists is not None:
+            approaches = ApproachStore.from_approaches(approach_lists)
+        return cls(column('aadt'),
+                   column('lanes_per_direction'),
+                   column('bicycle_facility_width'),
+                   column('parking_lane_width'),
+                   column('posted_speed'),
+                   column('functional_class'),
+                   approaches=approaches,
+                   turn_criteria=turn_criteria)
+
+    def _one_lane(self):
+        lanes, null = self.columns['segment.lanes_per_direction']
+        return null | (lanes == 1)
+
+    @instrument.stage('blts_batch.bike_lane_with_adj_parking')
+    def _calculate_bikelane_with_adj_parking(self):
+        has_width = ~self.columns['segment.bicycle_facility_width'][1] & \
+            ~self.columns['segment.parking_lane_width'][1]
+        one_lane = self._one_lane()
+        score = np.where(
+            one_lane,
+            self._calculate_score(
+                c.BL_ADJ_PK_TABLE_ONE_LANE,
+                b.BL_ADJ_PK_CRITERIA_ONE_LANE,
+                has_width & one_lane),
+            self._calculate_score(
+                c.BL_ADJ_PK_TABLE_TWO_LANES,
+                b.BL_ADJ_PK_CRITERIA_TWO_LANES,
+                has_width & ~one_lane))
+
+        self.bike_lane_with_adj_parking_score = score
+        return(score)
+
+    @instrument.stage('blts_batch.bike_lane_without_adj_parking')
+    def _calculate_bikelane_without_adj_parking(self):
+        has_width = ~self.columns['segment.bicycle_facility_width'][1]
+        one_lane = self._one_lane()
+        score = np.where(
+            one_lane,
+            self._calculate_score(
+                c.BL_NO_ADJ_PK_TABLE_ONE_LANE,
+                b.BL_NO_ADJ_PK_CRITERIA_ONE_LANE,
+                has_width & one_lane),
+            self._calculate_score(
+                c.BL_NO_ADJ_PK_TABLE_TWO_LANES,
+                b.BL_NO_ADJ_PK_CRITERIA_TWO_LANES,
+                has_width & ~one_lane))
+
+        self.bike_lane_without_adj_parking_score = score
+        return(score)
+
+    @instrument.stage('blts_batch.mix_traffic')
+    def _calculate_mix_traffic(self):
+        score = self._calculate_score(
+            c.MIXED_TRAF_TABLE,
+            b.MIXED_TRAF_CRITERIA)
+
+        self.mix_traffic_score = score
+        return(score)
+
+    def _approach_score(self, scores, criteria, where):
+        return self._calculate_score(scores, criteria, where,
+            self.approach_columns, self.approaches.offsets)
+
+    @instrument.stage('blts_batch.turn_lanes')
+    def _calculate_turn_lanes(self):
+        """
+        this function calculates the right and left turn lane score of every
+        approach and reduces them to the maximum of each segment
+        :param self: self
+        :return: tuple of ndarray score
+        """
+        approaches = self.approaches
+        scored = self.calculate_turn[approaches.segment_index] & \
+            ~self.approach_columns['approach.lane_configuration'][1] & \
+            ~self.approach_columns['segment.functional_class'][1]
+
+        right = self._approach_score(
+            c.RTL_CRIT_TABLE,
+            b.RTL_CRITERIA,
+            scored & (approaches.feature('has_right') |
+                      approaches.feature('has_shared_right')))
+
+        dual = approaches.feature('has_left') | \
+            approaches.feature('has_dual_left')
+        # dual and shared left turn lanes are validated but, as in Blts,
+        # do not count towards the left turn lane score
+        self._approach_score(
+            c.LTL_DUAL_SHARED_TABLE,
+            b.LTL_DUAL_SHARED_CRITERIA,
+            scored & dual)
+        left = self._approach_score(
+            c.LTL_CRIT_TABLE,
+            b.LTL_CRITERIA,
+            scored & ~dual)
+
+        self.right_turn_lane_score = segment_max(right, approaches.offsets)
+        self.left_turn_lane_score = segment_max(left, approaches.offsets)
+        return(self.right_turn_lane_score, self.left_turn_lane_score)
+
+    @instrument.stage('blts_batch.crossings')
+    def _calculate_crossings(self):
+        """
+        this function calculates the crossing score of every approach, with
+        median for unsignalized approaches with a median and without median
+        otherwise, and reduces them to the maximum of each segment
+        :param self: self
+        :return: tuple of ndarray score
+        """
+        approaches = self.approaches
+        scored = ~self.approach_columns['approach.lane_configuration'][1]
+        median = approaches.median_present & ~approaches.is_signalized()
+
+        with_median = self._approach_score(
+            c.CROSSING_HAS_MED_TABLE,
+            b.CROSSING_HAS_MED_CRITERIA,
+            scored & median)
+        without_median = self._approach_score(
+            c.CROSSING_NO_MED_TABLE,
+            b.CROSSING_NO_MED_CRITERIA,
+            scored & ~median)
+
+        self.crossing_with_median_score = segment_max(
+            with_median, approaches.offsets)
+        self.crossing_without_median_score = segment_max(
+            without_median, approaches.offsets)
+        return(self.crossing_with_median_score,
+               self.crossing_without_median_score)
+
+    @instrument.stage('blts_batch.calculate')
+    def calculate_blts(self):
+        """
+        this function calculates the segment score and the approach scores of
+        every segment in one vectorized pass and aggregates them with MAX
+        :param self: self
+        :return: ndarray score
+        """
+        self.calculate_segment_score()
+        self._calculate_turn_lanes()
+        self._calculate_crossings()
+        self.blts_score = self._aggregate_score(
+            self.right_turn_lane_score,
+            self.left_turn_lane_score,
+            self.crossing_without_median_score,
+            self.crossing_with_median_score,
+            self.segment_score,
+            method = "MAX"
+        )
+        return(self.blts_score)
+
+    @instrument.stage('blts_batch.segment_score')
+    def calculate_segment_score(self):
+        """
+        this function calculates the bike lane and mix traffic scores of every
+        segment and aggregates them with MIN, rows flagged in self.invalid
+        raise an error in Blts and score 0 here
+        :param self: self
+        :return: ndarray score
+        """
+        self._calculate_bikelane_with_adj_parking()
+        self._calculate_bikelane_without_adj_parking()
+        self._calculate_mix_traffic()
+        self.segment_score = self._aggregate_score(
+            self.bike_lane_with_adj_parking_score,
+            self.bike_lane_without_adj_parking_score,
+            self.mix_traffic_score,
+            method = "MIN"
+        )
+        return(self.segment_score)
@@ -2,11 +2,109 @@
 from cuuats.snt.lts.lts_postgis import Lts
 from cuuats.snt.lts.model.Segment import Segment
 from cuuats.snt.lts.model.Approach import Approach
-from cuuats.snt.lts import config as c
+from cuuats.snt.lts.tables import TABLES as c
+from cuuats.snt.lts import instrument
+from cuuats.snt.lts.criteria import ANY, Bins, Predicates, CriteriaTable, \
+    dependencies, name_tables
+
+AADT_CRITERIA = Bins('segment.aadt',
+    [('<=', 1000), ('<=', 3000), ('<=', 30000), ANY])
+
+BL_ADJ_PK_CRITERIA_ONE_LANE = CriteriaTable(
+    AADT_CRITERIA,
+    Bins(('segment.bicycle_facility_width', 'segment.parking_lane_width'),
+        [('>=', 15), ('>', 13), ANY]))
+
+BL_ADJ_PK_CRITERIA_TWO_LANES = CriteriaTable(
+    AADT_CRITERIA,
+    Bins(('segment.bicycle_facility_width', 'segment.parking_lane_width'),
+        [('>=', 15), ANY]))
+
+BL_NO_ADJ_PK_CRITERIA_ONE_LANE = CriteriaTable(
+    Bins('segment.aadt', [('<=', 3000), ('<=', 30000), ANY]),
+    Bins('segment.bicycle_facility_width', [('>=', 7), ('>=', 5.5), ANY]))
+
+BL_NO_ADJ_PK_CRITERIA_TWO_LANES = CriteriaTable(
+    Bins('segment.aadt', [('<=', 3000), ('<=', 30000), ANY]),
+    Bins('segment.bicycle_facility_width', [('>=', 7), ANY]))
+
+MIXED_TRAF_CRITERIA = CriteriaTable(
+    Bins('segment.aadt', [('<=', 1000), ('<=', 3000), ANY]),
+    Bins('segment.lanes_per_direction',
+        [('in', (0, None)), ('==', 1), ('==', 2), ('>=', 3)]))
+
+RTL_CRITERIA = CriteriaTable(
+    Predicates([
+        [('approach.has_right', '==', True),
+         ('approach.right_turn_lane_length', '<=', 150),
+         ('approach.bike_lane_approach', '==', 'Straight')],
+        [('approach.has_right', '==', True),
+         ('approach.right_turn_lane_length', '>', 150),
+         ('approach.bike_lane_approach', '==', 'Straight')],
+        [('approach.has_right', '==', True),
+         ('approach.bike_lane_approach', '==', 'Left')],
+        ANY]))
+
+SPEED_CRITERIA = Bins('segment.posted_speed',
+    [('<=', 25), ('==', 30), ('>=', 35)])
+
+LTL_DUAL_SHARED_CRITERIA = CriteriaTable(SPEED_CRITERIA)
+
+LTL_CRITERIA = CriteriaTable(
+    SPEED_CRITERIA,
+    Bins('approach.lanes_crossed', [('==', 0), ('==', 1), ('>=', 2)]))
+
+CROSSING_SPEED_CRITERIA = Bins('segment.posted_speed',
+    [('<=', 25), ('==', 30), ('==', 35), ANY])
+
+CROSSING_NO_MED_CRITERIA = CriteriaTable(
+    CROSSING_SPEED_CRITERIA,
+    Bins('approach.total_lanes', [('<=', 3), ('<=', 5), ANY]))
+
+CROSSING_HAS_MED_CRITERIA = CriteriaTable(
+    CROSSING_SPEED_CRITERIA,
+    Bins('approach.max_lane', [('<=', 2), ('==', 3), ANY]))
+
+name_tables(globals(), 'blts.')
+
+TURN_SCORES = ('right_turn_lane_score', 'left_turn_lane_score')
+
+CROSSING_SCORES = ('crossing_with_median_score',
+                   'crossing_without_median_score')
+
+SEGMENT_SCORES = ('bike_lane_with_adj_parking_score',
+                  'bike_lane_without_adj_parking_score',
+                  'mix_traffic_score')
+
+# criteria and attributes read by each sub-score
+DEPENDENCIES = dependencies({
+    'bike_lane_with_adj_parking_score': [
+        BL_ADJ_PK_CRITERIA_ONE_LANE, BL_ADJ_PK_CRITERIA_TWO_LANES,
+        'segment.lanes_per_direction'],
+    'bike_lane_without_adj_parking_score': [
+        BL_NO_ADJ_PK_CRITERIA_ONE_LANE, BL_NO_ADJ_PK_CRITERIA_TWO_LANES,
+        'segment.lanes_per_direction'],
+    'mix_traffic_score': [MIXED_TRAF_CRITERIA],
+    'right_turn_lane_score': [
+        RTL_CRITERIA, 'approach.lane_configuration', 'approach.lane_code',
+        'segment.functional_class', 'segment.aadt'],
+    'left_turn_lane_score': [
+        LTL_CRITERIA, LTL_DUAL_SHARED_CRITERIA, 'approach.lane_configuration',
+        'approach.lane_code', 'segment.functional_class', 'segment.aadt'],
+    'crossing_with_median_score': [
+        CROSSING_HAS_MED_CRITERIA, CROSSING_NO_MED_CRITERIA,
+        'approach.lane_configuration', 'approach.median_present',
+        'approach.control_type'],
+    'crossing_without_median_score': [
+        CROSSING_HAS_MED_CRITERIA, CROSSING_NO_MED_CRITERIA,
+        'approach.lane_configuration', 'approach.median_present',
+        'approach.control_type'],
+})
+
 
 class Blts(Lts):
     def __init__(self, segment, approaches, turn_criteria = 10000):
-        if type(segment) is Segment:
+        if isinstance(segment, Segment):
             self.segment = segment
         else:
             raise TypeError('segment is not a Segment object')
@@ -15,11 +113,12 @@ class Blts(Lts):
         self.approaches = []
         if approaches is not None:
             for a in approaches:
-                if type(a) is Approach:
+                if isinstance(a, Approach):
                     self.approaches.append(a)
                 else:
                     raise TypeError('approach is not an Approach object')
 
+        self.turn_criteria = turn_criteria
         self.calculate_turn = self._check_turn_criteria(turn_criteria)
         self.crossing_without_median_score = 0
         self.crossing_with_median_score = 0
@@ -29,6 +128,7 @@ class Blts(Lts):
         self.left_turn_lane_score = 0
         self.mix_traffic_score = 0
         self.blts_score = 0
+        self._approach_scores = None
 
     def _check_turn_criteria(self, turn_criteria):
         if self.segment is None:
@@ -43,6 +143,7 @@ class Blts(Lts):
             value = 0
         return(value)
 
+    @instrument.stage('blts.bike_lane_with_adj_parking')
     def _calculate_bikelane_with_adj_parking(self):
         score = 0
         if self.segment.bicycle_facility_width is not None and \
@@ -50,26 +151,16 @@ class Blts(Lts):
             if self.segment.lanes_per_direction is 1 or self.segment.lanes_per_direction is None:
                 score = self._calculate_score(
                     c.BL_ADJ_PK_TABLE_ONE_LANE,
-                    ['self.segment.aadt <= 1000',
-                     'self.segment.aadt <= 3000',
-                     'self.segment.aadt <= 30000',
-                     'True'],
-                    ['self.segment.bicycle_facility_width + self.segment.parking_lane_width >= 15',
-                     'self.segment.bicycle_facility_width + self.segment.parking_lane_width > 13',
-                     'True'])
+                    BL_ADJ_PK_CRITERIA_ONE_LANE)
             else:
                 score = self._calculate_score(
                     c.BL_ADJ_PK_TABLE_TWO_LANES,
-                    ['self.segment.aadt <= 1000',
-                     'self.segment.aadt <= 3000',
-                     'self.segment.aadt <= 30000',
-                     'True'],
-                    ['self.segment.bicycle_facility_width + self.segment.parking_lane_width >= 15',
-                     'True'])
+                    BL_ADJ_PK_CRITERIA_TWO_LANES)
 
         self.bike_lane_with_adj_parking_score = score
         return(score)
 
+    @instrument.stage('blts.bike_lane_without_adj_parking')
     def _calculate_bikelane_without_adj_parking(self):
         """
         This functions calculates the score of bike lanes without adjacent
@@ -82,24 +173,16 @@ class Blts(Lts):
             if self.segment.lanes_per_direction is 1 or self.segment.lanes_per_direction is None:
                 score = self._calculate_score(
                     c.BL_NO_ADJ_PK_TABLE_ONE_LANE,
-                    ['self.segment.aadt <= 3000',
-                     'self.segment.aadt <= 30000',
-                     'True'],
-                    ['self.segment.bicycle_facility_width >= 7',
-                     'self.segment.bicycle_facility_width >= 5.5',
-                     'True'])
+                    BL_NO_ADJ_PK_CRITERIA_ONE_LANE)
             else:
                 score = self._calculate_score(
                     c.BL_NO_ADJ_PK_TABLE_TWO_LANES,
-                    ['self.segment.aadt <= 3000',
-                     'self.segment.aadt <= 30000',
-                     'True'],
-                    ['self.segment.bicycle_facility_width >= 7',
-                     'True'])
+                    BL_NO_ADJ_PK_CRITERIA_TWO_LANES)
 
         self.bike_lane_without_adj_parking_score = score
         return(score)
 
+    @instrument.stage('blts.mix_traffic')
     def _calculate_mix_traffic(self):
         """
         this function calculate the mix traffic scores based on the specify
@@ -110,42 +193,26 @@ class Blts(Lts):
         score = 0
         score = self._calculate_score(
             c.MIXED_TRAF_TABLE,
-            ['self.segment.aadt <= 1000',
-             'self.segment.aadt <= 3000',
-             'True'],
-            ['self.segment.lanes_per_direction in (0, None)',
-             'self.segment.lanes_per_direction == 1',
-             'self.segment.lanes_per_direction == 2',
-             'self.segment.lanes_per_direction >= 3'])
+            MIXED_TRAF_CRITERIA)
 
         self.mix_traffic_score = score
         return(score)
 
+    @instrument.stage('blts.right_turn_lane')
     def _calculate_right_turn_lane(self):
         score = 0
         if self.approach.lane_configuration is None or \
             self.segment.functional_class is None:
             return score
 
-        if "R" in self.approach.lane_configuration or \
-           "Q" in self.approach.lane_configuration:
+        if self.approach.has_right_turn_lane():
             score = self._calculate_score(
                     c.RTL_CRIT_TABLE,
-                    ['"R" in self.approach.lane_configuration and \
-                     self.approach.right_turn_lane_length <= 150 and \
-                     self.approach.bike_lane_approach is "Straight"',
-
-                     '"R" in self.approach.lane_configuration and \
-                     self.approach.right_turn_lane_length > 150 and \
-                     self.approach.bike_lane_approach is "Straight"',
-
-                     '"R" in self.approach.lane_configuration and \
-                     self.approach.bike_lane_approach is "Left"',
-
-                     'True'])
+                    RTL_CRITERIA)
             self.right_turn_lane_score = max(self.right_turn_lane_score, score)
         return(score)
 
+    @instrument.stage('blts.left_turn_lane')
     def _calculate_left_turn_lane(self):
         """
         this function calculate the left turn lane score based on the criteria
@@ -155,44 +222,31 @@ class Blts(Lts):
         score = 0
         if self.approach.lane_configuration is None or self.segment.functional_class is None:
             return score
-        if "K" in self.approach.lane_configuration or "L" in self.approach.lane_configuration:
+        if self.approach.has_left_turn_lane():
             score = self._calculate_score(
                 c.LTL_DUAL_SHARED_TABLE,
-                ['self.segment.posted_speed <= 25',
-                 'self.segment.posted_speed == 30',
-                 'self.segment.posted_speed >= 35'])
+                LTL_DUAL_SHARED_CRITERIA)
         else:
             score = self._calculate_score(
                 c.LTL_CRIT_TABLE,
-                ['self.segment.posted_speed <= 25',
-                 'self.segment.posted_speed == 30',
-                 'self.segment.posted_speed >= 35'],
-
-                ['self.approach.lanes_crossed == 0',
-                 'self.approach.lanes_crossed == 1',
-                 'self.approach.lanes_crossed >= 2'])
+                LTL_CRITERIA)
 
             self.left_turn_lane_score = max(self.left_turn_lane_score, score)
         return(score)
 
+    @instrument.stage('blts.crossing_without_median')
     def _calculate_crossing_without_median(self):
         score = 0
         if self.approach.lane_configuration is None:
             return score
         score = self._calculate_score(
             c.CROSSING_NO_MED_TABLE,
-            ['self.segment.posted_speed <= 25',
-             'self.segment.posted_speed == 30',
-             'self.segment.posted_speed == 35',
-             'True'],
-
-            ['self.approach.total_lanes <= 3',
-             'self.approach.total_lanes <= 5',
-             'True'])
+            CROSSING_NO_MED_CRITERIA)
 
         self.crossing_without_median_score = max(self.crossing_without_median_score, score)
         return(score)
 
+    @instrument.stage('blts.crossing_with_median')
     def _calculate_crossing_with_median(self):
         score = 0
         if self.approach.lane_configuration is None:
@@ -200,40 +254,61 @@ class Blts(Lts):
 
         score = self._calculate_score(
             c.CROSSING_HAS_MED_TABLE,
-            ['self.segment.posted_speed <= 25',
-             'self.segment.posted_speed == 30',
-             'self.segment.posted_speed == 35',
-             'True'],
-
-            ['self.approach.max_lane <= 2',
-             'self.approach.max_lane == 3',
-             'True'])
+            CROSSING_HAS_MED_CRITERIA)
 
         self.crossing_with_median_score = max(self.crossing_with_median_score, score)
         return(score)
 
-    def calculate_blts(self):
-        self._calculate_bikelane_with_adj_parking()
-        self._calculate_bikelane_without_adj_parking()
-        self._calculate_mix_traffic()
+    @instrument.stage('blts.segment_score')
+    def _calculate_segment_score(self):
         self.segment_score = self._aggregate_score(
             self.bike_lane_with_adj_parking_score,
             self.bike_lane_without_adj_parking_score,
             self.mix_traffic_score,
             method = "MIN"
         )
+        return(self.segment_score)
 
-        for approach in self.approaches:
-            self.approach = approach
+    @instrument.stage('blts.approach')
+    def _score_approach(self, approach, names, previous):
+        """
+        this function calculates the turn lane and crossing scores of one
+        approach, scores not in names are kept from previous
+        :param self: self
+        :param approach: Approach
+        :param names: names of the scores to calculate
+        :param previous: dictionary of the previous scores of the approach
+        :return: dictionary of score name to int score
+        """
+        scores = dict(previous)
+        self.approach = approach
+        if names.intersection(TURN_SCORES):
+            self.right_turn_lane_score = 0
+            self.left_turn_lane_score = 0
             if self.calculate_turn:
                 self._calculate_right_turn_lane()
                 self._calculate_left_turn_lane()
+            scores['right_turn_lane_score'] = self.right_turn_lane_score
+            scores['left_turn_lane_score'] = self.left_turn_lane_score
 
+        if names.intersection(CROSSING_SCORES):
+            self.crossing_with_median_score = 0
+            self.crossing_without_median_score = 0
             if self.approach.median_present and not self.approach.is_signalized():
                 self._calculate_crossing_with_median()
             else:
                 self._calculate_crossing_without_median()
-
+            scores['crossing_with_median_score'] = \
+                self.crossing_with_median_score
+            scores['crossing_without_median_score'] = \
+                self.crossing_without_median_score
+        return(scores)
+
+    @instrument.stage('blts.aggregate')
+    def _aggregate_blts(self):
+        for name in TURN_SCORES + CROSSING_SCORES:
+            setattr(self, name, max([s[name] for s in self._approach_scores]
+                                    + [0]))
         self.blts_score = self._aggregate_score(
             self.right_turn_lane_score,
             self.left_turn_lane_score,
@@ -242,8 +317,58 @@ class Blts(Lts):
             self.segment_score,
             method = "MAX"
         )
+        self._versions = [self.segment.version] + \
+            [a.version for a in self.approaches]
         return(self.blts_score)
 
+    @instrument.stage('blts.calculate')
+    def calculate_blts(self):
+        self._calculate_bikelane_with_adj_parking()
+        self._calculate_bikelane_without_adj_parking()
+        self._calculate_mix_traffic()
+        self._calculate_segment_score()
+
+        names = set(TURN_SCORES + CROSSING_SCORES)
+        empty = dict((name, 0) for name in names)
+        self._approach_scores = [self._score_approach(a, names, empty)
+                                 for a in self.approaches]
+        return(self._aggregate_blts())
+
+    @instrument.stage('blts.update')
+    def update_blts(self):
+        """
+        this function recalculates only the sub-scores that read attributes
+        of the segment or the approaches changed since the last calculation,
+        approaches added or removed need a full calculate_blts
+        :param self: self
+        :return: int score
+        """
+        if self._approach_scores is None:
+            return(self.calculate_blts())
+
+        segment_names = self._changed_scores(
+            self.segment, 'segment.', self._versions[0], DEPENDENCIES)
+        if 'segment.aadt' in self._changed_paths(
+                self.segment, 'segment.', self._versions[0]):
+            self.calculate_turn = self._check_turn_criteria(self.turn_criteria)
+
+        if 'bike_lane_with_adj_parking_score' in segment_names:
+            self._calculate_bikelane_with_adj_parking()
+        if 'bike_lane_without_adj_parking_score' in segment_names:
+            self._calculate_bikelane_without_adj_parking()
+        if 'mix_traffic_score' in segment_names:
+            self._calculate_mix_traffic()
+        if segment_names.intersection(SEGMENT_SCORES):
+            self._calculate_segment_score()
+
+        for i, approach in enumerate(self.approaches):
+            names = segment_names | self._changed_scores(
+                approach, 'approach.', self._versions[i + 1], DEPENDENCIES)
+            if names.intersection(TURN_SCORES + CROSSING_SCORES):
+                self._approach_scores[i] = self._score_approach(
+                    approach, names, self._approach_scores[i])
+        return(self._aggregate_blts())
+
 
 if __name__ == '__main__':
     segment = Segment(bicycle_facility_width = 6,
@@ -265,4 +390,3 @@ if __name__ == '__main__':
                 turn_criteria = 10000)
     blts.calculate_blts()
     print('blts score: ' + str(blts.segment_score))
-    import pdb; pdb.set_trace()
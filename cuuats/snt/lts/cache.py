@@ -0,0 +1,284 @@
+## persistent score cache for LTS
+import hashlib
+import json
+import sqlite3
+from decimal import Decimal
+from operator import attrgetter
+from cuuats.snt.lts.tables import TABLES as c
+from cuuats.snt.lts import lts_postgis, blts_postgis, plts_postgis, criteria
+from cuuats.snt.lts.blts_postgis import Blts
+from cuuats.snt.lts.plts_postgis import Plts
+from cuuats.snt.lts.model import Segment, Approach, Sidewalk, LaneCodec
+
+BLTS_SCORES = blts_postgis.SEGMENT_SCORES + ('segment_score',) + \
+    blts_postgis.TURN_SCORES + blts_postgis.CROSSING_SCORES + ('blts_score',)
+
+PLTS_SCORES = plts_postgis.SIDEWALK_SCORES + plts_postgis.CROSSING_SCORES + \
+    ('plts_score',)
+
+# errors raised by the scorers that are cached and raised again on a hit
+ERRORS = {
+    'AssertionError': AssertionError,
+    'TypeError': TypeError,
+    'ValueError': ValueError,
+}
+
+# modules whose code decides the scores
+_SCORING_MODULES = (lts_postgis, blts_postgis, plts_postgis, criteria,
+                    Segment, Approach, Sidewalk, LaneCodec)
+
+
+def _describe(value):
+    if isinstance(value, criteria.CriteriaTable):
+        return ('CriteriaTable', [_describe(v) for v in value.criteria])
+    if isinstance(value, criteria.Criterion):
+        return (type(value).__name__, getattr(value, 'value', None),
+                value.conditions)
+    return value
+
+
+def tables_version():
+    """
+    this function return a hash of the config tables and the criteria
+    tables, any change gives a new version
+    :return: str
+    """
+    digest = hashlib.sha256()
+    for name, scores in c.items():
+        digest.update(repr((name, scores)).encode())
+    for module in (blts_postgis, plts_postgis):
+        for name in sorted(vars(module)):
+            value = getattr(module, name)
+            if isinstance(value, (criteria.CriteriaTable,
+                                  criteria.Criterion)):
+                digest.update(repr((name, _describe(value))).encode())
+    return digest.hexdigest()[:16]
+
+
+def criteria_version():
+    """
+    this function return a hash of the config tables, the criteria tables
+    and the code of the scoring modules, any change gives a new version
+    :return: str
+    """
+    digest = hashlib.sha256(tables_version().encode())
+    for module in _SCORING_MODULES:
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+_GETTERS = {}
+
+
+def _fields(obj):
+    """
+    this function return the fields of a record, the derived fields are
+    included since they can be assigned and are read by the scorers
+    """
+    get = _GETTERS.get(type(obj))
+    if get is None:
+        cls = type(obj)
+        get = _GETTERS[cls] = attrgetter(*[name for name, kind in cls.FIELDS])
+    return get(obj)
+
+
+def _plain(value):
+    """
+    this function return a JSON value for the numpy scalars and decimals
+    read from the database or from arrays
+    """
+    if isinstance(value, Decimal):
+        return float(value)
+    item = getattr(value, 'item', None)
+    if item is not None:
+        return item()
+    raise TypeError('%s is not JSON serializable' % type(value).__name__)
+
+
+class ScoreCache(object):
+    """
+    SQLite cache of Blts and Plts scores keyed by a hash of the segment, its
+    approaches and sidewalks and the criteria version, entries of another
+    criteria version are dropped when the cache is opened and the least
+    recently used entries are evicted above max_entries
+    """
+    def __init__(self, path, max_entries=5000000, version=None,
+                 flush_size=10000):
+        """
+        :param path: SQLite file, ':memory:' for a temporary cache
+        :param max_entries: number of entries kept by evict
+        :param version: criteria version, criteria_version() by default
+        :param flush_size: number of pending writes or of hits since the
+            last flush that triggers a flush
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.version = version if version is not None else criteria_version()
+        self.flush_size = flush_size
+        self.hits = 0
+        self.misses = 0
+        self._pending = {}
+        self._used = []
+        self.connection = sqlite3.connect(path)
+        self._setup()
+
+    def _setup(self):
+        db = self.connection
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('CREATE TABLE IF NOT EXISTS meta '
+                   '(name TEXT PRIMARY KEY, value TEXT)')
+        db.execute('CREATE TABLE IF NOT EXISTS scores '
+                   '(key BLOB PRIMARY KEY, value TEXT, used INTEGER)')
+        db.execute('CREATE INDEX IF NOT EXISTS scores_used ON scores (used)')
+        row = db.execute(
+            "SELECT value FROM meta WHERE name = 'version'").fetchone()
+        if row is None or row[0] != self.version:
+            db.execute('DELETE FROM scores')
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                       (self.version,))
+        row = db.execute(
+            "SELECT value FROM meta WHERE name = 'run'").fetchone()
+        self.run = int(row[0]) + 1 if row is not None else 1
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('run', ?)",
+                   (str(self.run),))
+        db.commit()
+
+    def key(self, mode, segment, *groups, **options):
+        """
+        this function return the content hash of a scoring input
+        :param mode: 'blts' or 'plts'
+        :param segment: Segment
+        :param groups: lists of Approach or Sidewalk
+        :param options: scorer options, e.g. turn_criteria
+        :return: bytes
+        """
+        content = [self.version, mode, sorted(options.items()),
+                   _fields(segment)]
+        for group in groups:
+            content.append([_fields(obj) for obj in group or []])
+        return hashlib.blake2b(json.dumps(content, default=_plain).encode(),
+                               digest_size=16).digest()
+
+    def get(self, key):
+        """
+        this function return the cached value of a key
+        :param key: bytes from key()
+        :return: dictionary of score name to int score or an error
+            dictionary, None when the key is not cached
+        """
+        value = self._pending.get(key)
+        if value is None:
+            row = self.connection.execute(
+                'SELECT value FROM scores WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value = json.loads(row[0])
+            self._used.append(key)
+            if len(self._used) >= self.flush_size:
+                self.flush()
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._pending[key] = value
+        if len(self._pending) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """
+        this function writes the pending entries and the use of the entries
+        read since the last flush
+        """
+        db = self.connection
+        db.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?, ?)',
+                       ((k, json.dumps(v), self.run)
+                        for k, v in self._pending.items()))
+        db.executemany('UPDATE scores SET used = ? WHERE key = ?',
+                       ((self.run, k) for k in self._used))
+        db.commit()
+        self._pending = {}
+        self._used = []
+
+    def evict(self):
+        """
+        this function deletes the least recently used entries above
+        max_entries
+        :return: int number of deleted entries
+        """
+        self.flush()
+        db = self.connection
+        count = db.execute('SELECT count(*) FROM scores').fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return 0
+        db.execute('DELETE FROM scores WHERE key IN '
+                   '(SELECT key FROM scores ORDER BY used LIMIT ?)',
+                   (excess,))
+        db.commit()
+        return excess
+
+    def __len__(self):
+        self.flush()
+        return self.connection.execute(
+            'SELECT count(*) FROM scores').fetchone()[0]
+
+    def close(self):
+        self.evict()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _score(self, key, calculate, names):
+        value = self.get(key)
+        if value is None:
+            try:
+                scorer = calculate()
+            except tuple(ERRORS.values()) as e:
+                value = {'error': type(e).__name__, 'message': str(e)}
+            else:
+                value = dict((name, getattr(scorer, name)) for name in names)
+            self.put(key, value)
+        if 'error' in value:
+            raise ERRORS[value['error']](value['message'])
+        return value
+
+    def score_blts(self, segment, approaches, turn_criteria=10000):
+        """
+        this function return the Blts scores of a segment from the cache,
+        scoring it on a miss, errors raised by Blts are cached as well
+        :param segment: Segment
+        :param approaches: list of Approach
+        :param turn_criteria: aadt above which turn lanes are scored
+        :return: dictionary of score name to int score
+        """
+        def calculate():
+            blts = Blts(segment, approaches, turn_criteria)
+            blts.calculate_blts()
+            return blts
+        return self._score(
+            self.key('blts', segment, approaches, turn_criteria=turn_criteria),
+            calculate, BLTS_SCORES)
+
+    def score_plts(self, segment, sidewalks, approaches):
+        """
+        this function return the Plts scores of a segment from the cache,
+        scoring it on a miss, errors raised by Plts are cached as well
+        :param segment: Segment
+        :param sidewalks: list of Sidewalk
+        :param approaches: list of Approach
+        :return: dictionary of score name to int score
+        """
+        def calculate():
+            plts = Plts(segment, sidewalks, approaches)
+            plts.calculate_plts()
+            return plts
+        return self._score(self.key('plts', segment, sidewalks, approaches),
+                           calculate, PLTS_SCORES)
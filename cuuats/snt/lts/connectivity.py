@@ -0,0 +1,280 @@
+## low-stress connectivity of scored segments
+import numpy as np
+from cuuats.snt.lts import instrument
+
+# stress levels a segment can be scored, components are kept for each
+THRESHOLDS = (1, 2, 3, 4)
+
+
+def _roots(parent):
+    """
+    this function return the root of every node of a union-find forest by
+    pointer jumping
+    """
+    while True:
+        grand = parent[parent]
+        if (grand == parent).all():
+            return grand
+        parent = grand
+
+
+def connected_components(size, u, v, parent=None):
+    """
+    this function return the root of the component of every node of a graph,
+    edges hook the larger root under the smaller one until no edge joins two
+    roots, so the root of a component is its smallest node
+    :param size: number of nodes
+    :param u: ndarray of the first node of every edge
+    :param v: ndarray of the second node of every edge
+    :param parent: roots of components already joined, e.g. those of the
+        edges of a lower threshold, every node by itself by default
+    :return: ndarray of root node
+    """
+    parent = np.arange(size) if parent is None else _roots(parent)
+    u = np.asarray(u)
+    v = np.asarray(v)
+    while len(u):
+        pu = parent[u]
+        pv = parent[v]
+        joins = pu != pv
+        if not joins.any():
+            break
+        u = u[joins]
+        v = v[joins]
+        np.minimum.at(parent, np.maximum(pu[joins], pv[joins]),
+                      np.minimum(pu[joins], pv[joins]))
+        parent = _roots(parent)
+    return parent
+
+
+class LowStressNetwork(object):
+    """
+    segments joining intersections with one union-find forest per stress
+    threshold, a segment belongs to the network of a threshold when it is
+    scored and its score is at most the threshold, lowering a score joins
+    components in near constant time and raising one searches from both of its
+    intersections until the searches meet or the smaller side runs out
+    """
+    def __init__(self, segment_ids, from_nodes, to_nodes, scores,
+                 invalid=None, intersections=None, thresholds=THRESHOLDS):
+        """
+        :param segment_ids: id of every segment
+        :param from_nodes: id of the intersection at one end of every segment
+        :param to_nodes: id of the intersection at the other end
+        :param scores: LTS score of every segment, 0 for unscored segments
+        :param invalid: boolean mask of segments that could not be scored
+        :param intersections: Intersection objects, so that intersections
+            without segments are islands of their own
+        :param thresholds: stress thresholds
+        """
+        node_ids = [np.asarray(from_nodes), np.asarray(to_nodes)]
+        if intersections is not None:
+            node_ids.append(np.array([i.intersection_id
+                                      for i in intersections],
+                                     dtype=node_ids[0].dtype))
+        self.node_ids, inverse = np.unique(np.concatenate(node_ids),
+                                           return_inverse=True)
+        size = len(segment_ids)
+        self.u = inverse[:size]
+        self.v = inverse[size:2 * size]
+
+        self.segment_ids = np.asarray(segment_ids)
+        self._sorter = np.argsort(self.segment_ids, kind='stable')
+        self.stress = np.array(scores, dtype=np.int8)
+        if invalid is not None:
+            self.stress[np.asarray(invalid, dtype=bool)] = 0
+
+        # segments of every node in CSR order
+        ends = np.concatenate([self.u, self.v])
+        order = np.argsort(ends, kind='stable')
+        self._incident = np.concatenate([np.arange(size),
+                                         np.arange(size)])[order]
+        self._offsets = np.zeros(len(self.node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ends, minlength=len(self.node_ids)),
+                  out=self._offsets[1:])
+
+        self.thresholds = tuple(sorted(thresholds))
+        self.parent = {}
+        self.size = {}
+        self._build()
+
+    def _low(self, stress, threshold):
+        return (stress > 0) & (stress <= threshold)
+
+    @instrument.stage('connectivity.build')
+    def _build(self):
+        parent = None
+        previous = np.zeros(len(self.stress), dtype=bool)
+        for threshold in self.thresholds:
+            low = self._low(self.stress, threshold)
+            # the components of a lower threshold are joined further
+            added = low & ~previous
+            parent = connected_components(
+                len(self.node_ids), self.u[added], self.v[added], parent)
+            self.parent[threshold] = parent.copy()
+            self.size[threshold] = np.bincount(
+                parent, minlength=len(self.node_ids))
+            previous = low
+
+    def _find(self, threshold, node):
+        parent = self.parent[threshold]
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    def _union(self, threshold, a, b):
+        a = self._find(threshold, a)
+        b = self._find(threshold, b)
+        if a == b:
+            return
+        size = self.size[threshold]
+        if size[a] < size[b]:
+            a, b = b, a
+        self.parent[threshold][b] = a
+        size[a] += size[b]
+
+    def _search(self, threshold, a, b):
+        """
+        this function searches the network of a threshold from both
+        intersections at once, expanding the smaller side, and stops when
+        the searches meet or one of them runs out
+        :return: nodes of the side that ran out and a node of the other
+            side, None when a and b are still connected
+        """
+        visited = [{a}, {b}]
+        frontier = [[a], [b]]
+        while frontier[0] and frontier[1]:
+            i = 0 if len(visited[0]) <= len(visited[1]) else 1
+            reached = []
+            for node in frontier[i]:
+                for segment in self._incident[
+                        self._offsets[node]:self._offsets[node + 1]]:
+                    stress = self.stress[segment]
+                    if stress <= 0 or stress > threshold:
+                        continue
+                    other = self.v[segment] if self.u[segment] == node \
+                        else self.u[segment]
+                    if other in visited[1 - i]:
+                        return None
+                    if other not in visited[i]:
+                        visited[i].add(other)
+                        reached.append(other)
+            frontier[i] = reached
+        i = 0 if not frontier[0] else 1
+        return np.fromiter(visited[i], dtype=np.int64), (b, a)[i]
+
+    def _split(self, threshold, segment):
+        """
+        this function splits the component of a segment that left the
+        network of a threshold when its intersections are no longer joined
+        """
+        if self.u[segment] == self.v[segment] or \
+                self._find(threshold, self.u[segment]) != \
+                self._find(threshold, self.v[segment]):
+            return
+        found = self._search(threshold, self.u[segment], self.v[segment])
+        if found is None:
+            return
+        side, other = found
+        # every node points at the root so that moving the side does not
+        # cut the paths of the nodes left behind
+        parent = _roots(self.parent[threshold])
+        self.parent[threshold] = parent
+        size = self.size[threshold]
+        root = parent[other]
+        if root in side:
+            rest = parent == root
+            rest[side] = False
+            parent[rest] = other
+            size[other] = size[root] - len(side)
+            parent[side] = root
+            size[root] = len(side)
+        else:
+            parent[side] = side[0]
+            size[side[0]] = len(side)
+            size[root] -= len(side)
+
+    def _rows(self, segment_ids):
+        segment_ids = np.asarray(segment_ids)
+        position = np.searchsorted(self.segment_ids, segment_ids,
+                                   sorter=self._sorter)
+        rows = self._sorter[np.minimum(position, len(self._sorter) - 1)]
+        if (self.segment_ids[rows] != segment_ids).any():
+            raise KeyError('unknown segment id')
+        return rows
+
+    @instrument.stage('connectivity.update')
+    def update(self, segment_ids, scores, invalid=None):
+        """
+        this function changes the scores of segments and updates the
+        components of every threshold
+        :param segment_ids: ids of the rescored segments
+        :param scores: new scores, 0 for unscored segments
+        :param invalid: boolean mask of segments that could not be scored
+        """
+        rows = self._rows(np.atleast_1d(segment_ids))
+        stress = np.array(np.atleast_1d(scores), dtype=np.int8)
+        if invalid is not None:
+            stress[np.atleast_1d(np.asarray(invalid, dtype=bool))] = 0
+        # segments are changed one at a time, so that a segment leaving the
+        # network splits a component into at most two
+        for row, score in zip(rows, stress):
+            old = self.stress[row]
+            self.stress[row] = score
+            for threshold in self.thresholds:
+                was = 0 < old <= threshold
+                now = 0 < score <= threshold
+                if was and not now:
+                    self._split(threshold, row)
+                elif now and not was:
+                    self._union(threshold, self.u[row], self.v[row])
+
+    def components(self, threshold):
+        """
+        this function return the component of every intersection
+        :param threshold: stress threshold
+        :return: ndarray of the intersection id naming each component
+        """
+        parent = _roots(self.parent[threshold])
+        self.parent[threshold] = parent
+        return self.node_ids[parent]
+
+    def segment_components(self, threshold):
+        """
+        this function return the component of every segment
+        :param threshold: stress threshold
+        :return: masked ndarray of the intersection id naming each
+            component, masked for segments above the threshold or unscored
+        """
+        components = self.components(threshold)[self.u]
+        return np.ma.array(components,
+                           mask=~self._low(self.stress, threshold))
+
+    def connected(self, a, b, threshold):
+        """
+        this function tells whether two intersections are joined by segments
+        of at most the threshold
+        :param a: intersection id
+        :param b: intersection id
+        :param threshold: stress threshold
+        :return: bool
+        """
+        a, b = np.searchsorted(self.node_ids, [a, b])
+        return bool(self._find(threshold, a) == self._find(threshold, b))
+
+    def islands(self, threshold):
+        """
+        this function return the components of a threshold from the largest
+        :param threshold: stress threshold
+        :return: tuple of (intersection id naming each component, number of
+            intersections, number of segments)
+        """
+        parent = _roots(self.parent[threshold])
+        self.parent[threshold] = parent
+        roots, nodes = np.unique(parent, return_counts=True)
+        low = self._low(self.stress, threshold)
+        segments = np.bincount(parent[self.u[low]],
+                               minlength=len(self.node_ids))[roots]
+        order = np.lexsort((nodes, segments))[::-1]
+        return self.node_ids[roots[order]], nodes[order], segments[order]
@@ -0,0 +1,309 @@
+## precompiled criteria tables for LTS
+from bisect import bisect_left
+from operator import attrgetter
+
+
+class _Any(object):
+    """
+    sentinel for the catch-all condition (the 'True' entry of a criteria list)
+    """
+    def __repr__(self):
+        return 'ANY'
+
+ANY = _Any()
+
+_COMPARE = {
+    '<': lambda x, y: x < y,
+    '<=': lambda x, y: x <= y,
+    '==': lambda x, y: x == y,
+    '>=': lambda x, y: x >= y,
+    '>': lambda x, y: x > y,
+    'in': lambda x, y: x in y,
+    'contains': lambda x, y: y in x,
+}
+
+
+def _make_getter(value):
+    """
+    this function takes a value specification and return a function that reads
+    the value from an lts object
+    :param value: dotted attribute path or tuple of paths to be summed
+    :return: function
+    """
+    if isinstance(value, str):
+        return attrgetter(value)
+    getters = [attrgetter(v) for v in value]
+
+    def get_sum(obj):
+        return sum(getter(obj) for getter in getters)
+    return get_sum
+
+
+class Criterion(object):
+    """
+    base class of a criteria axis, one axis of a criteria table
+    """
+    def __init__(self, conditions):
+        self.conditions = list(conditions)
+
+    def __len__(self):
+        return len(self.conditions)
+
+    def values(self):
+        """
+        this function return the value paths the criterion reads
+        :return: set of str
+        """
+        return set([self.value] if isinstance(self.value, str)
+                   else self.value)
+
+    def index(self, obj):
+        raise NotImplementedError
+
+
+class Bins(Criterion):
+    """
+    numeric thresholds, compiled into a bisect lookup over the elementary
+    intervals created by the threshold values
+    """
+    def __init__(self, value, conditions):
+        """
+        :param value: dotted attribute path or tuple of paths to be summed
+        :param conditions: list of (operator, operand) tuples or ANY
+        """
+        Criterion.__init__(self, conditions)
+        self.value = value
+        self._get = _make_getter(value)
+        self._compile()
+
+    def _match(self, x):
+        for index, condition in enumerate(self.conditions):
+            if condition is ANY:
+                return index
+            op, operand = condition
+            if _COMPARE[op](x, operand):
+                return index
+        return None
+
+    def _match_none(self):
+        for index, condition in enumerate(self.conditions):
+            if condition is ANY:
+                return index, None
+            op, operand = condition
+            if op in ('in', '=='):
+                if _COMPARE[op](None, operand):
+                    return index, None
+            else:
+                return None, TypeError(
+                    "'%s' not supported between 'NoneType' and '%s'"
+                    % (op, type(operand).__name__))
+        return None, None
+
+    def _compile(self):
+        points = set()
+        for condition in self.conditions:
+            if condition is ANY:
+                continue
+            op, operand = condition
+            if op == 'in':
+                points.update(o for o in operand if o is not None)
+            else:
+                points.add(operand)
+        self.points = sorted(points)
+
+        # even regions are the open intervals, odd regions the points
+        regions = []
+        for i in range(len(self.points) * 2 + 1):
+            if i % 2:
+                regions.append(self._match(self.points[i // 2]))
+            elif not self.points:
+                regions.append(self._match(0))
+            elif i == 0:
+                regions.append(self._match(self.points[0] - 1))
+            elif i == len(self.points) * 2:
+                regions.append(self._match(self.points[-1] + 1))
+            else:
+                low = self.points[i // 2 - 1]
+                high = self.points[i // 2]
+                regions.append(self._match((low + high) / 2.0))
+        self.regions = regions
+        self.none_index, self.none_error = self._match_none()
+
+    def region(self, x):
+        """
+        this function takes a value and return the elementary region it falls in
+        :param x: numeric value
+        :return: int region
+        """
+        i = bisect_left(self.points, x)
+        if i < len(self.points) and self.points[i] == x:
+            return i * 2 + 1
+        return i * 2
+
+    def index(self, obj):
+        x = self._get(obj)
+        if x is None:
+            if self.none_error is not None:
+                raise self.none_error
+            return self.none_index
+        return self.regions[self.region(x)]
+
+
+class Members(Criterion):
+    """
+    equality sets, compiled into a dictionary lookup
+    """
+    def __init__(self, value, conditions):
+        """
+        :param value: dotted attribute path or tuple of paths to be summed
+        :param conditions: list of values, tuples of values, or ANY
+        """
+        Criterion.__init__(self, conditions)
+        self.value = value
+        self._get = _make_getter(value)
+        self.lookup = {}
+        self.default = None
+        for index, condition in enumerate(self.conditions):
+            if condition is ANY:
+                self.default = index
+                break
+            members = condition if isinstance(condition, tuple) \
+                else (condition,)
+            for member in members:
+                self.lookup.setdefault(member, index)
+
+    def index(self, obj):
+        return self.lookup.get(self._get(obj), self.default)
+
+
+class Predicates(Criterion):
+    """
+    conjunctions of clauses over several values, evaluated in order
+    """
+    def __init__(self, conditions):
+        """
+        :param conditions: list of clause lists or ANY, each clause is a tuple
+            of (value, operator, operand)
+        """
+        Criterion.__init__(self, conditions)
+        self._compiled = []
+        for condition in self.conditions:
+            if condition is ANY:
+                self._compiled.append(())
+            else:
+                self._compiled.append(tuple(
+                    (_make_getter(value), _COMPARE[op], operand)
+                    for value, op, operand in condition))
+
+    def values(self):
+        values = set()
+        for condition in self.conditions:
+            if condition is not ANY:
+                values.update(value for value, op, operand in condition)
+        return values
+
+    def index(self, obj):
+        for index, clauses in enumerate(self._compiled):
+            for get, compare, operand in clauses:
+                if not compare(get(obj), operand):
+                    break
+            else:
+                return index
+        return None
+
+
+class CriteriaTable(object):
+    """
+    ordered criteria axes, one per dimension of a score table
+    """
+    def __init__(self, *criteria, **kwargs):
+        """
+        :param criteria: criteria axes
+        :param kwargs: optional name, used by the instrumentation reports
+        """
+        self.criteria = criteria
+        self.name = kwargs.get('name')
+
+    def __len__(self):
+        return len(self.criteria)
+
+    def values(self):
+        """
+        this function return the value paths the criteria read
+        :return: set of str
+        """
+        values = set()
+        for criterion in self.criteria:
+            values.update(criterion.values())
+        return values
+
+    def indices(self, obj):
+        """
+        this function return the row index selected on each axis
+        :param obj: lts object the criteria are evaluated against
+        :return: tuple of int or None
+        """
+        return tuple(criterion.index(obj) for criterion in self.criteria)
+
+    def lookup(self, scores, obj):
+        """
+        this function takes the scores and return the score selected by the
+        criteria
+        :param scores: nested list of scores
+        :param obj: lts object the criteria are evaluated against
+        :return: int score
+        """
+        score = scores
+        for criterion in self.criteria:
+            assert len(score) == len(criterion)
+            index = criterion.index(obj)
+            if index is not None:
+                score = score[index]
+        assert isinstance(score, int)
+        return score
+
+    def resolve(self, scores, obj):
+        """
+        this function return the score selected by the criteria together with
+        the cell, the row index selected on each axis
+        :param scores: nested list of scores
+        :param obj: lts object the criteria are evaluated against
+        :return: tuple of (int score, tuple of int or None)
+        """
+        cell = self.indices(obj)
+        score = scores
+        for criterion, index in zip(self.criteria, cell):
+            assert len(score) == len(criterion)
+            if index is not None:
+                score = score[index]
+        assert isinstance(score, int)
+        return score, cell
+
+
+def name_tables(namespace, prefix=''):
+    """
+    this function names the unnamed criteria tables of a module after their
+    variable, e.g. name_tables(globals(), 'blts.')
+    :param namespace: dictionary of variables
+    :param prefix: prefix of the names
+    """
+    for name, value in namespace.items():
+        if isinstance(value, CriteriaTable) and value.name is None:
+            value.name = prefix + name
+
+
+def dependencies(score_inputs):
+    """
+    this function inverts a map of score name to the criteria tables and
+    value paths the score reads into a map of value path to score names
+    :param score_inputs: dictionary of score name to list of CriteriaTable
+        or value path
+    :return: dictionary of value path to set of score names
+    """
+    result = {}
+    for score, inputs in score_inputs.items():
+        for i in inputs:
+            values = i.values() if isinstance(i, CriteriaTable) else [i]
+            for value in values:
+                result.setdefault(value, set()).add(score)
+    return result
@@ -0,0 +1,608 @@
+## precomputed score cubes for LTS
+from bisect import bisect_left
+import numpy as np
+from cuuats.snt.lts.criteria import ANY, Bins, Members, Predicates
+from cuuats.snt.lts.lts_batch import _get_column, segment_max
+from cuuats.snt.lts.blts_batch import BltsBatch
+from cuuats.snt.lts.plts_batch import PltsBatch
+from cuuats.snt.lts.model.ApproachStore import ApproachStore
+from cuuats.snt.lts.model.SidewalkStore import SidewalkStore
+from cuuats.snt.lts.model.LaneCodec import LANES, LaneFeatures, \
+    parse_lane_configuration
+from cuuats.snt.lts import blts_postgis as b
+from cuuats.snt.lts import plts_postgis as p
+from cuuats.snt.lts import instrument
+from cuuats.snt.lts.cache import tables_version
+
+# flag added to a cube cell whose rows cannot be scored, scores stay below it
+INVALID = 64
+SCORE = INVALID - 1
+
+# lane configurations the lane classes are seeded with, opposing lanes, left
+# turn, through and right turn
+SEED_CONFIGURATIONS = [o + l + t + r
+                       for o in ('X', 'XX', 'XXX')
+                       for l in ('', 'L', 'K', 'LL')
+                       for t in ('T', 'TT', 'TTT')
+                       for r in ('', 'R', 'Q')]
+
+_NUMBER = (int, float)
+
+
+def points(path, *values):
+    """
+    this function return an axis specification of numeric thresholds
+    :param path: value path, e.g. 'segment.aadt'
+    :param values: thresholds, none for an axis that only tells null apart
+    :return: tuple
+    """
+    return ('points', path, values)
+
+
+def members(path, *values):
+    """
+    this function return an axis specification of equality members
+    :param path: value path, e.g. 'approach.control_type'
+    :param values: members
+    :return: tuple
+    """
+    return ('members', path, values)
+
+
+def criteria_specs(tables):
+    """
+    this function return the axis specifications of the values read by
+    criteria tables, the thresholds of Bins and the numeric clauses of
+    Predicates become points, Members and the other clauses members
+    :param tables: list of CriteriaTable
+    :return: list of specifications
+    """
+    specs = []
+    for table in tables:
+        for criterion in table.criteria:
+            conditions = [x for x in criterion.conditions if x is not ANY]
+            if isinstance(criterion, Bins):
+                values = []
+                for op, operand in conditions:
+                    if op == 'in':
+                        values.extend(o for o in operand if o is not None)
+                    else:
+                        values.append(operand)
+                specs.append(points(criterion.value, *values))
+            elif isinstance(criterion, Members):
+                values = []
+                for x in conditions:
+                    values.extend(x if isinstance(x, tuple) else (x,))
+                specs.append(members(criterion.value, *values))
+            elif isinstance(criterion, Predicates):
+                for condition in conditions:
+                    for value, op, operand in condition:
+                        if isinstance(operand, _NUMBER) and \
+                            not isinstance(operand, bool):
+                            specs.append(points(value, operand))
+                        else:
+                            specs.append(members(value, operand))
+    return specs
+
+
+class BinAxis(object):
+    """
+    axis over the elementary regions of numeric thresholds, as in Bins the
+    even regions are the open intervals and the odd regions the thresholds,
+    the last code is null
+    """
+    def __init__(self, path, values):
+        self.path = path
+        self.points = sorted(set(float(v) for v in values))
+        self.size = len(self.points) * 2 + 2
+
+    def representatives(self):
+        """
+        this function return one value of every code, None for null
+        :return: list
+        """
+        pts = self.points
+        if not pts:
+            return [0, None]
+        values = [pts[0] - 1]
+        for low, high in zip(pts, pts[1:]):
+            values.extend([low, (low + high) / 2.0])
+        values.extend([pts[-1], pts[-1] + 1, None])
+        return values
+
+    def code(self, value):
+        if value is None:
+            return self.size - 1
+        i = bisect_left(self.points, value)
+        if i < len(self.points) and self.points[i] == value:
+            return i * 2 + 1
+        return i * 2
+
+    def codes(self, columns):
+        data, null = _get_column(columns, self.path)
+        pts = np.asarray(self.points)
+        if len(pts):
+            i = np.searchsorted(pts, data, side='left')
+            exact = (i < len(pts)) & (pts[np.minimum(i, len(pts) - 1)] == data)
+            code = i * 2 + exact
+        else:
+            code = np.zeros(len(data), dtype=np.intp)
+        code[null] = self.size - 1
+        return code
+
+
+class MemberAxis(object):
+    """
+    axis over equality members, the last two codes are the other values and
+    null
+    """
+    def __init__(self, path, values):
+        self.path = path
+        self.members = []
+        for value in values:
+            if value not in self.members:
+                self.members.append(value)
+        self.size = len(self.members) + 2
+        self._codes = dict((m, i) for i, m in enumerate(self.members))
+
+    def representatives(self):
+        if self.members and all(isinstance(m, bool) for m in self.members):
+            # the other value of a flag is the opposite flag
+            other = not self.members[0]
+        else:
+            other = '?'
+            while other in self.members:
+                other += '?'
+        return self.members + [other, None]
+
+    def code(self, value):
+        if value is None:
+            return self.size - 1
+        return self._codes.get(value, self.size - 2)
+
+    def codes(self, columns):
+        data, null = _get_column(columns, self.path)
+        code = np.full(len(data), self.size - 2, dtype=np.intp)
+        # the first member that matches wins, members are few so comparing
+        # is faster than sorting object columns
+        for i in range(len(self.members) - 1, -1, -1):
+            code[data == self.members[i]] = i
+        code[null] = self.size - 1
+        return code
+
+
+class LaneAxis(object):
+    """
+    axis over lane classes, the lane configurations that agree on the code of
+    every lane feature axis and on being missing, codes are looked up from
+    the LANES codes and grow as new classes are met
+    """
+    path = 'approach.lane_configuration'
+
+    def __init__(self, axes):
+        """
+        :param axes: dictionary of LaneFeatures field to BinAxis or MemberAxis
+        """
+        self.axes = [(LaneFeatures._fields.index(name), axis)
+                     for name, axis in sorted(axes.items())]
+        self.classes = {}
+        self.configurations = []
+        self._lanes = np.zeros(0, dtype=np.intp)
+        for configuration in [None] + SEED_CONFIGURATIONS:
+            self._class(configuration,
+                        parse_lane_configuration(configuration))
+
+    @property
+    def size(self):
+        return len(self.configurations)
+
+    def _class(self, configuration, features):
+        key = (configuration is None,) + tuple(
+            axis.code(features[i]) for i, axis in self.axes)
+        index = self.classes.get(key)
+        if index is None:
+            index = self.classes[key] = len(self.configurations)
+            self.configurations.append(configuration)
+        return index
+
+    def update(self):
+        """
+        this function assigns a class to the LANES codes interned since the
+        last update
+        :return: True when new classes were added
+        """
+        size = self.size
+        known = len(self._lanes)
+        if known < len(LANES):
+            lanes = [self._class(LANES.configurations[code],
+                                 LANES.features[code])
+                     for code in range(known, len(LANES))]
+            self._lanes = np.concatenate(
+                [self._lanes, np.array(lanes, dtype=np.intp)])
+        return self.size > size
+
+    def representatives(self):
+        return list(self.configurations)
+
+    def codes(self, lane_code):
+        return self._lanes[lane_code]
+
+
+class CubePart(object):
+    """
+    dense cube of the scores of one independent stage of a scorer, indexed
+    by the code of every axis, rows of a group (approach or sidewalk) score
+    one cell per row
+    """
+    def __init__(self, name, group, specs, aliases=None):
+        """
+        :param name: stage name
+        :param group: None for segment rows, 'approach' or 'sidewalk'
+        :param specs: axis specifications from points, members and
+            criteria_specs
+        :param aliases: dictionary of derived value path to the path it is
+            computed from, e.g. total_lanes_crossed to approach.total_lanes
+        """
+        self.name = name
+        self.group = group
+        aliases = aliases or {}
+        merged = {}
+        for kind, path, values in specs:
+            path = aliases.get(path, path)
+            if not isinstance(path, str):
+                for component in path:
+                    merged.setdefault(component, ('points', set()))
+            merged.setdefault(path, (kind, set()))
+            if merged[path][0] != kind:
+                raise ValueError('%s is both compared to thresholds and '
+                                 'to members' % (path,))
+            merged[path][1].update(values)
+
+        lanes = {}
+        self.axes = []
+        for path in sorted(merged, key=str):
+            kind, values = merged[path]
+            axis = (BinAxis if kind == 'points' else MemberAxis)(
+                path, sorted(values, key=repr))
+            name = path.split('.', 1)[1] if isinstance(path, str) else None
+            if path == LaneAxis.path:
+                continue
+            if isinstance(path, str) and path.startswith('approach.') and \
+                name in LaneFeatures._fields:
+                lanes[name] = axis
+            else:
+                self.axes.append(axis)
+        self.lanes = None
+        if lanes or LaneAxis.path in merged:
+            self.lanes = LaneAxis(lanes)
+            self.lanes.update()
+            self.axes.append(self.lanes)
+        self.cube = None
+
+    @property
+    def shape(self):
+        return tuple(axis.size for axis in self.axes)
+
+    def columns(self):
+        """
+        this function return the value columns of every cell in C order, the
+        last component of a summed value is set to give the sum
+        :return: tuple of (number of cells, dictionary of value path to
+            object ndarray)
+        """
+        shape = self.shape
+        grid = np.indices(shape).reshape(len(shape), -1)
+        columns = {}
+        for axis, index in zip(self.axes, grid):
+            values = np.empty(axis.size, dtype=object)
+            values[:] = axis.representatives()
+            columns[axis.path] = values[index]
+        for path in [a.path for a in self.axes if not isinstance(a.path, str)]:
+            total = columns.pop(path)
+            rest = [columns[component] for component in path[:-1]]
+            last = columns[path[-1]].copy()
+            for i, value in enumerate(total):
+                others = [column[i] for column in rest]
+                if value is None or None in others:
+                    last[i] = None
+                else:
+                    last[i] = value - sum(others)
+            columns[path[-1]] = last
+        return grid.shape[1], columns
+
+    def compile(self, evaluate):
+        """
+        this function fills the cube by scoring one row per cell
+        :param evaluate: function taking the number of rows and the columns
+            and returning (score, invalid) ndarrays
+        """
+        size, columns = self.columns()
+        score, invalid = evaluate(size, columns)
+        cube = np.asarray(score, dtype=np.int8) | \
+            np.where(invalid, INVALID, 0).astype(np.int8)
+        self.cube = cube.reshape(self.shape)
+
+    def codes(self, columns, lane_code=None):
+        """
+        this function return the code of every row on every axis
+        :param columns: dictionary of value path to (data, null)
+        :param lane_code: LANES codes of the rows for the lane axis
+        :return: list of ndarray, one per axis
+        """
+        return [axis.codes(lane_code) if axis is self.lanes else
+                axis.codes(columns) for axis in self.axes]
+
+    def lookup(self, columns, lane_code=None):
+        """
+        this function return the cell of every row
+        :param columns: dictionary of value path to (data, null)
+        :param lane_code: LANES codes of the rows for the lane axis
+        :return: ndarray of int8, the score with INVALID added where the
+            row cannot be scored
+        """
+        return self.cube[tuple(self.codes(columns, lane_code))]
+
+
+def _empty(size):
+    return np.full(size, None, dtype=object)
+
+
+def _split(columns):
+    """
+    this function splits compile columns into keyword arguments of the
+    segment, approach and sidewalk constructors
+    """
+    kwargs = {'segment': {}, 'approach': {}, 'sidewalk': {}}
+    for path, values in columns.items():
+        group, name = path.split('.', 1)
+        kwargs[group][name] = values
+    return kwargs
+
+
+def _rows(size, present):
+    """
+    this function return the offsets and number of rows of a grouped store
+    with one row per segment if present and none otherwise
+    """
+    if present:
+        return np.arange(size + 1), size
+    return np.zeros(size + 1), 0
+
+
+class ScoreCube(object):
+    """
+    base class of the precomputed scorers, every part is compiled from the
+    batch scorer on one representative row per cell so that the cube gives
+    the batch scores, scoring is a binning step and one lookup per part
+    """
+    def __init__(self, parts):
+        self.version = tables_version()
+        self.parts = dict((part.name, part) for part in parts)
+        for part in parts:
+            self._compile(part)
+
+    def _compile(self, part):
+        part.compile(lambda size, columns: self._evaluate(
+            part, size, _split(columns)))
+
+    def nbytes(self):
+        return sum(part.cube.nbytes for part in self.parts.values())
+
+    def part(self, name):
+        """
+        this function return a part, compiled again first when lane
+        configurations of a new lane class were interned
+        :param name: part name
+        :return: CubePart
+        """
+        part = self.parts[name]
+        if part.lanes is not None and part.lanes.update():
+            self._compile(part)
+        return part
+
+    def source(self, batch, group):
+        """
+        this function return the columns a part of a group is looked up from
+        :param batch: BltsBatch or PltsBatch
+        :param group: None, 'approach' or 'sidewalk'
+        :return: tuple of (columns, LANES codes or None)
+        """
+        if group is None:
+            return batch.columns, None
+        if group == 'approach':
+            return batch.approach_columns, batch.approaches.lane_code
+        return batch.sidewalk_columns, None
+
+    def cells(self, batch):
+        """
+        this function return the cells of every part for the rows of a batch
+        :param batch: BltsBatch or PltsBatch
+        :return: dictionary of part name to ndarray of int8
+        """
+        cells = {}
+        for name in self.parts:
+            part = self.part(name)
+            columns, lane_code = self.source(batch, part.group)
+            cells[name] = part.lookup(columns, lane_code)
+        return cells
+
+
+def _grouped(cells, offsets):
+    """
+    this function reduces the cells of grouped rows to the maximum score and
+    the invalid flag of each segment, along the last axis
+    """
+    score = segment_max(cells & SCORE, offsets)
+    invalid = segment_max(cells >= INVALID, offsets)
+    return score, invalid
+
+
+class BltsCube(ScoreCube):
+    """
+    precomputed BltsBatch, the segment, turn lane and crossing stages are
+    independent, so each has its own cube and the blts score is their maximum
+    """
+    def __init__(self, turn_criteria=10000):
+        self.turn_criteria = turn_criteria
+        ScoreCube.__init__(self, [
+            CubePart('segment', None, criteria_specs([
+                b.BL_ADJ_PK_CRITERIA_ONE_LANE, b.BL_ADJ_PK_CRITERIA_TWO_LANES,
+                b.BL_NO_ADJ_PK_CRITERIA_ONE_LANE,
+                b.BL_NO_ADJ_PK_CRITERIA_TWO_LANES, b.MIXED_TRAF_CRITERIA]) + [
+                points('segment.bicycle_facility_width'),
+                points('segment.parking_lane_width'),
+                points('segment.lanes_per_direction', 1)]),
+            CubePart('turn_lanes', 'approach', criteria_specs([
+                b.RTL_CRITERIA, b.LTL_CRITERIA,
+                b.LTL_DUAL_SHARED_CRITERIA]) + [
+                points('segment.aadt', turn_criteria),
+                points('segment.functional_class'),
+                points('approach.lane_configuration'),
+                members('approach.has_shared_right', True),
+                members('approach.has_left', True),
+                members('approach.has_dual_left', True)]),
+            CubePart('crossings', 'approach', criteria_specs([
+                b.CROSSING_NO_MED_CRITERIA, b.CROSSING_HAS_MED_CRITERIA]) + [
+                points('approach.lane_configuration'),
+                members('approach.median_present', True),
+                members('approach.control_type', 'signalized')]),
+        ])
+
+    def _evaluate(self, part, size, kwargs):
+        segment = dict((name, _empty(size)) for name in (
+            'aadt', 'lanes_per_direction', 'bicycle_facility_width',
+            'parking_lane_width', 'posted_speed', 'functional_class'))
+        segment.update(kwargs['segment'])
+        offsets, rows = _rows(size, part.group == 'approach')
+        approach = kwargs['approach']
+        approach.setdefault('lane_configuration', _empty(rows))
+        batch = BltsBatch(
+            approaches=ApproachStore(offsets, **approach),
+            turn_criteria=self.turn_criteria, **segment)
+        if part.name == 'segment':
+            score = batch.calculate_segment_score()
+        elif part.name == 'turn_lanes':
+            score = np.maximum(*batch._calculate_turn_lanes())
+        else:
+            score = np.maximum(*batch._calculate_crossings())
+        return score, batch.invalid
+
+    def combine(self, cells, batch):
+        """
+        this function aggregates the cells of the parts into the blts score,
+        the cells may have leading axes, e.g. one per scenario
+        :param cells: dictionary of part name to cells
+        :param batch: BltsBatch the cells were looked up from
+        :return: tuple of (score, invalid) ndarrays
+        """
+        segment = cells['segment']
+        turn = cells['turn_lanes']
+        crossing = cells['crossings']
+        approach_score, approach_invalid = _grouped(
+            np.maximum(turn & SCORE, crossing & SCORE) |
+            ((turn | crossing) & INVALID), batch.approaches.offsets)
+        score = np.maximum(segment & SCORE, approach_score)
+        return score, (segment >= INVALID) | approach_invalid
+
+    @instrument.stage('blts_cube.calculate')
+    def calculate_blts(self, batch):
+        """
+        this function scores a BltsBatch from the cubes instead of the
+        criteria tables, the batch is only used for its columns and its
+        invalid rows are flagged as calculate_blts would
+        :param batch: BltsBatch built with the same turn_criteria
+        :return: ndarray score
+        """
+        cells = self.cells(batch)
+        batch.segment_score = cells['segment'] & SCORE
+        batch.blts_score, invalid = self.combine(cells, batch)
+        batch.invalid |= invalid
+        return(batch.blts_score)
+
+
+class PltsCube(ScoreCube):
+    """
+    precomputed PltsBatch, the plts score is the maximum of the sidewalk
+    cube, the crossing cube only decides which rows are invalid
+    """
+    def __init__(self):
+        ScoreCube.__init__(self, [
+            CubePart('sidewalks', 'sidewalk', criteria_specs([
+                p.SW_COND_CRITERIA, p.BUFFER_TYPE_CRITERIA,
+                p.BUFFER_WIDTH_CRITERIA])),
+            CubePart('crossings', 'approach', criteria_specs([
+                p.COLLECTOR_CROSSING_CRITERIA,
+                p.ARTERIAL_CROSSING_CRITERIA_TWO_LANES,
+                p.ARTERIAL_CROSSING_CRITERIA_THREE_LANES]) + [
+                points('segment.functional_class', 4),
+                points('approach.lane_configuration'),
+                points('total_lanes_crossed', 2),
+                members('segment.marked_center_lane', 'No')],
+                aliases={'total_lanes_crossed': 'approach.total_lanes'}),
+        ])
+
+    def _evaluate(self, part, size, kwargs):
+        segment = dict((name, _empty(size)) for name in (
+            'posted_speed', 'total_lanes', 'aadt', 'functional_class',
+            'marked_center_lane'))
+        segment.update(kwargs['segment'])
+        sidewalk_offsets, rows = _rows(size, part.group == 'sidewalk')
+        sidewalk = kwargs['sidewalk']
+        sidewalk.setdefault('sidewalk_width', _empty(rows))
+        approach_offsets, rows = _rows(size, part.group == 'approach')
+        approach = kwargs['approach']
+        approach.setdefault('lane_configuration', _empty(rows))
+        batch = PltsBatch(
+            sidewalks=SidewalkStore(sidewalk_offsets, **sidewalk),
+            approaches=ApproachStore(approach_offsets, **approach),
+            **segment)
+        if part.name == 'sidewalks':
+            score = np.maximum.reduce(batch._calculate_sidewalk_scores())
+        else:
+            score = np.maximum(*batch._calculate_crossing_scores())
+        return score, batch.invalid
+
+    def combine(self, cells, batch):
+        """
+        this function aggregates the cells of the parts into the plts score,
+        the cells may have leading axes, e.g. one per scenario
+        :param cells: dictionary of part name to cells
+        :param batch: PltsBatch the cells were looked up from
+        :return: tuple of (score, invalid) ndarrays
+        """
+        score, sidewalk_invalid = _grouped(cells['sidewalks'],
+                                           batch.sidewalks.offsets)
+        crossing_score, crossing_invalid = _grouped(
+            cells['crossings'], batch.approaches.offsets)
+        return score, sidewalk_invalid | crossing_invalid | (score == 0)
+
+    @instrument.stage('plts_cube.calculate')
+    def calculate_plts(self, batch):
+        """
+        this function scores a PltsBatch from the cubes instead of the
+        criteria tables, segments without sidewalks are flagged invalid as in
+        calculate_plts
+        :param batch: PltsBatch
+        :return: ndarray score
+        """
+        batch.plts_score, invalid = self.combine(self.cells(batch), batch)
+        batch.invalid |= invalid
+        return(batch.plts_score)
+
+
+_CUBES = {}
+
+
+def get_cube(cls, *args):
+    """
+    this function return the compiled cube of a class and arguments, the
+    cube is compiled again when the config or criteria tables changed
+    :param cls: BltsCube or PltsCube
+    :param args: arguments of the class, e.g. turn_criteria
+    :return: ScoreCube
+    """
+    key = (cls,) + args
+    cube = _CUBES.get(key)
+    if cube is None or cube.version != tables_version():
+        cube = _CUBES[key] = cls(*args)
+    return cube
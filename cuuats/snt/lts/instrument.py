@@ -0,0 +1,229 @@
+## instrumentation hooks for LTS scoring
+import time
+from collections import Counter
+
+# hooked methods as (class, attribute, function, wrapper factory), the
+# wrappers are only installed while a Profiler is enabled so that disabled
+# instrumentation costs nothing
+_HOOKS = []
+
+# the enabled Profiler or None
+active = None
+
+
+class _Hook(object):
+    """
+    method decorator that registers the method and puts the plain function
+    back on the class
+    """
+    def __init__(self, function, factory):
+        self.function = function
+        self.factory = factory
+
+    def __set_name__(self, owner, name):
+        _HOOKS.append((owner, name, self.function, self.factory))
+        setattr(owner, name, self.function)
+
+
+def hook(factory):
+    """
+    this function return a decorator that wraps a method with
+    factory(function, profiler) while a profiler is enabled
+    :param factory: function returning the wrapped method
+    :return: decorator
+    """
+    def decorator(function):
+        return _Hook(function, factory)
+    return decorator
+
+
+def stage(name):
+    """
+    this function return a decorator recording the count and time of every
+    call of a method under the stage name while a profiler is enabled
+    :param name: stage name, e.g. 'blts.mix_traffic'
+    :return: decorator
+    """
+    def factory(function, profiler):
+        clock = profiler.clock
+
+        def timed(*args, **kwargs):
+            began = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.record_stage(name, clock() - began)
+        return timed
+    return hook(factory)
+
+
+def enable(profiler=None):
+    """
+    this function installs the hooks of a profiler, replacing the profiler
+    enabled before
+    :param profiler: Profiler, a new one by default
+    :return: Profiler
+    """
+    global active
+    if active is not None:
+        disable()
+    active = profiler if profiler is not None else Profiler()
+    for owner, name, function, factory in _HOOKS:
+        setattr(owner, name, factory(function, active))
+    return active
+
+
+def disable():
+    """
+    this function removes the hooks and return the profiler that was enabled
+    :return: Profiler or None
+    """
+    global active
+    for owner, name, function, factory in _HOOKS:
+        setattr(owner, name, function)
+    profiler = active
+    active = None
+    return profiler
+
+
+class profiling(object):
+    """
+    context manager enabling a profiler, e.g.
+    with profiling() as profiler: ...; print(profiler.report())
+    """
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+
+    def __enter__(self):
+        self.profiler = enable(self.profiler)
+        return self.profiler
+
+    def __exit__(self, *exc):
+        disable()
+        return False
+
+
+class Stats(object):
+    """
+    call count, time, errors and resolved cells of one stage or table
+    """
+    __slots__ = ('count', 'seconds', 'errors', 'cells')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.errors = 0
+        self.cells = Counter()
+
+    def summary(self, cells=None):
+        result = {'count': self.count, 'seconds': self.seconds,
+                  'errors': self.errors}
+        if self.cells:
+            result['cells'] = [[list(cell), count] for cell, count in
+                               self.cells.most_common(cells)]
+        return result
+
+
+class Profiler(object):
+    """
+    collects the stage and criteria table statistics of the current process,
+    a cell is the tuple of the row index selected on each criteria axis
+    """
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.stages = {}
+        self.tables = {}
+
+    def _stats(self, group, name):
+        stats = group.get(name)
+        if stats is None:
+            stats = group[name] = Stats()
+        return stats
+
+    def record_stage(self, name, seconds, count=1):
+        stats = self._stats(self.stages, name)
+        stats.count += count
+        stats.seconds += seconds
+
+    def record_lookup(self, name, cell, seconds, error=False):
+        stats = self._stats(self.tables, name)
+        stats.count += 1
+        stats.seconds += seconds
+        if error:
+            stats.errors += 1
+        if cell is not None:
+            stats.cells[cell] += 1
+
+    def record_rows(self, name, cells, seconds, errors=0):
+        """
+        this function records a vectorized lookup
+        :param name: table name
+        :param cells: Counter of cell to number of rows
+        :param seconds: time of the lookup
+        :param errors: number of rows that could not be scored
+        """
+        stats = self._stats(self.tables, name)
+        stats.count += sum(cells.values())
+        stats.seconds += seconds
+        stats.errors += errors
+        stats.cells.update(cells)
+
+    def lookup(self, table, scores, obj):
+        """
+        this function looks up the score of a criteria table and records the
+        selected cell and the time it took
+        :param table: CriteriaTable
+        :param scores: nested list of scores
+        :param obj: lts object
+        :return: int score
+        """
+        began = self.clock()
+        try:
+            score, cell = table.resolve(scores, obj)
+        except Exception:
+            self.record_lookup(table.name, None, self.clock() - began, True)
+            raise
+        self.record_lookup(table.name, cell, self.clock() - began)
+        return score
+
+    def summary(self, cells=10):
+        """
+        this function return the statistics as a dictionary that can be
+        stored as JSON
+        :param cells: number of most common cells kept per table
+        :return: dict
+        """
+        return {
+            'stages': dict((name, stats.summary()) for name, stats in
+                           self.stages.items()),
+            'tables': dict((name, stats.summary(cells)) for name, stats in
+                           self.tables.items()),
+        }
+
+    def report(self, cells=3):
+        """
+        this function return a text report of the stages and tables sorted
+        by time, stage times include the nested stages
+        :param cells: number of most common cells listed per table
+        :return: str
+        """
+        lines = ['%-40s %12s %10s %10s' % (
+            'stage', 'calls', 'seconds', 'mean us')]
+        for name, stats in sorted(self.stages.items(),
+                                  key=lambda i: -i[1].seconds):
+            lines.append('%-40s %12d %10.3f %10.2f' % (
+                name, stats.count, stats.seconds,
+                stats.seconds / max(stats.count, 1) * 1e6))
+        lines.append('')
+        lines.append('%-40s %12s %10s %10s %8s' % (
+            'table', 'lookups', 'seconds', 'mean us', 'errors'))
+        for name, stats in sorted(self.tables.items(),
+                                  key=lambda i: -i[1].seconds):
+            lines.append('%-40s %12d %10.3f %10.2f %8d' % (
+                name, stats.count, stats.seconds,
+                stats.seconds / max(stats.count, 1) * 1e6, stats.errors))
+            total = float(sum(stats.cells.values())) or 1.0
+            for cell, count in stats.cells.most_common(cells):
+                lines.append('    cell %-31s %12d %9.1f%%' % (
+                    cell, count, count / total * 100))
+        return '\n'.join(lines)
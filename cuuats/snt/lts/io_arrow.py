@@ -0,0 +1,309 @@
+## Arrow and Parquet reader and score writer for LTS
+import numpy as np
+from cuuats.snt.lts.model.ApproachStore import ApproachStore
+from cuuats.snt.lts.model.SidewalkStore import SidewalkStore
+from cuuats.snt.lts.model.Segment import Segment
+from cuuats.snt.lts.model.LaneCodec import LANES
+from cuuats.snt.lts.parallel import BLTS_SCORES, PLTS_SCORES
+
+SEGMENT_COLUMNS = tuple(name for name, kind in Segment.FIELDS)
+
+APPROACH_COLUMNS = ('lane_configuration', 'right_turn_lane_length',
+                    'bike_lane_approach', 'median_present', 'control_type')
+
+SIDEWALK_COLUMNS = ('sidewalk_width', 'buffer_type', 'buffer_width',
+                    'sidewalk_score', 'overall_landuse')
+
+
+def _combined(array):
+    import pyarrow as pa
+
+    if isinstance(array, pa.ChunkedArray):
+        if array.num_chunks == 1:
+            return array.chunk(0)
+        return array.combine_chunks()
+    return array
+
+
+def arrow_column(array):
+    """
+    this function converts an Arrow array to the column types of the batch
+    scorers without a Python object per row, numeric arrays without nulls
+    are zero-copy views, numeric arrays with nulls masked arrays and text
+    object arrays with one object per distinct value
+    :param array: pyarrow Array or ChunkedArray
+    :return: ndarray or masked array
+    """
+    import pyarrow as pa
+
+    array = _combined(array)
+    kind = array.type
+    if pa.types.is_dictionary(kind):
+        values = np.empty(len(array.dictionary), dtype=object)
+        values[:] = array.dictionary.to_pylist()
+        indices = array.indices.fill_null(0).to_numpy(zero_copy_only=False)
+        column = np.empty(len(array), dtype=object)
+        if len(values):
+            column[:] = values[indices]
+        if array.null_count:
+            column[array.is_null().to_numpy(zero_copy_only=False)] = None
+        return column
+    if pa.types.is_string(kind) or pa.types.is_large_string(kind):
+        if len(array) and array.null_count == len(array):
+            return np.full(len(array), None, dtype=object)
+        return arrow_column(array.dictionary_encode())
+    if pa.types.is_null(kind):
+        return np.full(len(array), None, dtype=object)
+    if pa.types.is_boolean(kind):
+        if not array.null_count:
+            return array.to_numpy(zero_copy_only=False)
+        column = np.empty(len(array), dtype=object)
+        column[:] = array.to_pylist()
+        return column
+    if not array.null_count:
+        return array.to_numpy(zero_copy_only=False)
+    null = array.is_null().to_numpy(zero_copy_only=False)
+    return np.ma.array(array.fill_null(0).to_numpy(zero_copy_only=False),
+                       mask=null)
+
+
+def lane_codes(array):
+    """
+    this function return the LANES codes of an Arrow array of lane
+    configurations, only the distinct configurations are encoded
+    :param array: pyarrow Array or ChunkedArray of text
+    :return: ndarray of int32 code
+    """
+    import pyarrow as pa
+
+    array = _combined(array)
+    if not pa.types.is_dictionary(array.type):
+        array = array.dictionary_encode()
+    codes = LANES.encode_array(array.dictionary.to_pylist())
+    indices = array.indices.fill_null(0).to_numpy(zero_copy_only=False)
+    result = codes[indices] if len(codes) else \
+        np.zeros(len(array), dtype=np.int32)
+    if array.null_count:
+        result[array.is_null().to_numpy(zero_copy_only=False)] = 0
+    return result
+
+
+def _read(source, names):
+    """
+    this function reads the columns of names present in a Parquet file or
+    Arrow table
+    """
+    import pyarrow.parquet as pq
+
+    if isinstance(source, str):
+        schema = pq.read_schema(source)
+        return pq.read_table(source, columns=[
+            n for n in names if n in schema.names])
+    return source.select([n for n in names if n in source.column_names])
+
+
+class _GroupedRows(object):
+    """
+    rows of an approach or sidewalk table sorted by segment id once, so that
+    the rows of any chunk of segments are found by binary search
+    """
+    def __init__(self, table, id_column, store, names):
+        keys = np.asarray(arrow_column(table.column(id_column)))
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+        self.table = table
+        self.store = store
+        self.names = [n for n in names if n in table.column_names]
+
+    def take(self, segment_ids):
+        """
+        this function return the store of the rows of segment ids, rows of
+        other segments are left out
+        :param segment_ids: ids of the segments in scoring order
+        :return: ApproachStore or SidewalkStore
+        """
+        segment_ids = np.asarray(segment_ids)
+        low = np.searchsorted(self.keys, segment_ids, side='left')
+        high = np.searchsorted(self.keys, segment_ids, side='right')
+        counts = high - low
+        offsets = np.zeros(len(segment_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        rows = self.order[np.repeat(low - offsets[:-1], counts) +
+                          np.arange(offsets[-1])]
+        table = self.table.take(rows)
+        columns = dict((name, arrow_column(table.column(name)))
+                       for name in self.names)
+        if self.store is ApproachStore:
+            if 'lane_configuration' in self.names:
+                columns['lane_code'] = lane_codes(
+                    table.column('lane_configuration'))
+            else:
+                columns['lane_configuration'] = None
+        return self.store(offsets, **columns)
+
+
+class ArrowReader(object):
+    """
+    reads segments, approaches and sidewalks from Parquet files (e.g. a
+    GeoParquet export) or Arrow tables into the columns and stores of the
+    batch scorers, columns are named after the Segment, Approach and Sidewalk
+    attributes and only those are read, the approach and sidewalk tables are
+    keyed by the segment id column
+    """
+    def __init__(self, segments, approaches=None, sidewalks=None,
+                 id_column='segment_id', chunk_size=100000):
+        """
+        :param segments: Parquet path or pyarrow Table with one row per
+            segment
+        :param approaches: Parquet path or pyarrow Table of approaches
+        :param sidewalks: Parquet path or pyarrow Table of sidewalks
+        :param id_column: name of the segment id column
+        :param chunk_size: number of segments per chunk
+        """
+        self.segments = segments
+        self.id_column = id_column
+        self.chunk_size = chunk_size
+        self.approaches = None
+        self.sidewalks = None
+        if approaches is not None:
+            self.approaches = _GroupedRows(
+                _read(approaches, (id_column,) + APPROACH_COLUMNS),
+                id_column, ApproachStore, APPROACH_COLUMNS)
+        if sidewalks is not None:
+            self.sidewalks = _GroupedRows(
+                _read(sidewalks, (id_column,) + SIDEWALK_COLUMNS),
+                id_column, SidewalkStore, SIDEWALK_COLUMNS)
+
+    def _batches(self):
+        import pyarrow.parquet as pq
+
+        names = (self.id_column,) + SEGMENT_COLUMNS
+        if isinstance(self.segments, str):
+            source = pq.ParquetFile(self.segments)
+            names = [n for n in names if n in source.schema_arrow.names]
+            return source.iter_batches(batch_size=self.chunk_size,
+                                       columns=names)
+        table = self.segments.select(
+            [n for n in names if n in self.segments.column_names])
+        return table.to_batches(max_chunksize=self.chunk_size)
+
+    def iter_segment_chunks(self, start=0):
+        """
+        this function streams segments in chunks together with their
+        approaches and sidewalks
+        :param start: number of chunks skipped, e.g. those of a resumed run,
+            their approaches and sidewalks are not read
+        :return: generator of (segment columns, ApproachStore,
+            SidewalkStore), stores are None without their table
+        """
+        for index, batch in enumerate(self._batches()):
+            if index < start:
+                continue
+            columns = dict((name, arrow_column(batch.column(i)))
+                           for i, name in enumerate(batch.schema.names))
+            segment_ids = np.asarray(columns[self.id_column])
+            approaches = None
+            sidewalks = None
+            if self.approaches is not None:
+                approaches = self.approaches.take(segment_ids)
+            if self.sidewalks is not None:
+                sidewalks = self.sidewalks.take(segment_ids)
+            yield columns, approaches, sidewalks
+
+    def read(self):
+        """
+        this function reads every segment in one chunk
+        :return: tuple of (segment columns, ApproachStore, SidewalkStore)
+        """
+        chunk_size = self.chunk_size
+        self.chunk_size = max(self._rows(), 1)
+        try:
+            return next(self.iter_segment_chunks())
+        finally:
+            self.chunk_size = chunk_size
+
+    def _rows(self):
+        import pyarrow.parquet as pq
+
+        if isinstance(self.segments, str):
+            return pq.ParquetFile(self.segments).metadata.num_rows
+        return self.segments.num_rows
+
+
+def batch_scores(batch):
+    """
+    this function return the sub-scores and final score of a scored
+    BltsBatch or PltsBatch
+    :param batch: BltsBatch or PltsBatch
+    :return: dictionary of score name to ndarray
+    """
+    names = BLTS_SCORES if hasattr(batch, 'blts_score') else PLTS_SCORES
+    return dict((name, getattr(batch, name)) for name in names
+                if getattr(batch, name, None) is not None)
+
+
+def scores_table(ids, scores, invalid=None, id_column='segment_id'):
+    """
+    this function return score columns as an Arrow table of int8 columns,
+    scores of invalid rows are null
+    :param ids: ids of the scored rows
+    :param scores: dictionary of column name to score array
+    :param invalid: boolean mask of rows whose scores are null
+    :param id_column: name of the id column
+    :return: pyarrow Table
+    """
+    import pyarrow as pa
+
+    mask = None if invalid is None else np.asarray(invalid, dtype=bool)
+    arrays = [pa.array(np.asarray(ids))]
+    names = [id_column]
+    for name, values in scores.items():
+        arrays.append(pa.array(np.asarray(values, dtype=np.int8), mask=mask))
+        names.append(name)
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+class ArrowWriter(object):
+    """
+    appends score columns to a Parquet file, one row group per write
+    """
+    def __init__(self, path, id_column='segment_id', compression='zstd'):
+        """
+        :param path: Parquet file
+        :param id_column: name of the id column
+        :param compression: Parquet compression codec
+        """
+        self.path = path
+        self.id_column = id_column
+        self.compression = compression
+        self.writer = None
+
+    def write_scores(self, ids, scores, invalid=None):
+        """
+        this function writes score columns
+        :param ids: ids of the scored rows
+        :param scores: dictionary of column name to score array, e.g.
+            batch_scores(batch)
+        :param invalid: boolean mask of rows whose scores are written as null
+        :return: int number of written rows
+        """
+        import pyarrow.parquet as pq
+
+        table = scores_table(ids, scores, invalid, self.id_column)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema,
+                                           compression=self.compression)
+        self.writer.write_table(table)
+        return table.num_rows
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,201 @@
+## streaming PostGIS reader and bulk score writer for LTS
+import io
+import numpy as np
+from cuuats.snt.lts.model.ApproachStore import ApproachStore
+from cuuats.snt.lts.model.SidewalkStore import SidewalkStore
+
+
+class PostgisReader(object):
+    """
+    streams query results through server-side cursors in chunks of columns,
+    query columns are named after the Segment, Approach and Sidewalk
+    attributes (e.g. SELECT speed AS posted_speed), server-side cursors need
+    a connection that is not in autocommit mode
+    """
+    def __init__(self, connection, chunk_size=10000):
+        """
+        :param connection: psycopg2 connection
+        :param chunk_size: number of rows fetched per round trip
+        """
+        self.connection = connection
+        self.chunk_size = chunk_size
+        self._cursor_count = 0
+
+    def _to_columns(self, names, rows):
+        columns = {}
+        for name, values in zip(names, zip(*rows)):
+            column = np.empty(len(rows), dtype=object)
+            column[:] = values
+            columns[name] = column
+        if not rows:
+            for name in names:
+                columns[name] = np.empty(0, dtype=object)
+        return columns
+
+    def iter_chunks(self, query, params=None):
+        """
+        this function runs a query on a named server-side cursor and yields
+        dictionaries of object columns with at most chunk_size rows
+        :param query: SQL query
+        :param params: query parameters
+        :return: generator of dict
+        """
+        self._cursor_count += 1
+        name = 'lts_reader_%d' % self._cursor_count
+        with self.connection.cursor(name=name) as cursor:
+            cursor.itersize = self.chunk_size
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                names = [d[0] for d in cursor.description]
+                yield self._to_columns(names, rows)
+
+    def read_columns(self, query, params=None):
+        """
+        this function runs a query on a regular cursor and return all rows as
+        object columns, used for the rows belonging to one chunk of segments
+        :param query: SQL query
+        :param params: query parameters
+        :return: dict
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            names = [d[0] for d in cursor.description]
+        return self._to_columns(names, rows)
+
+    def _read_store(self, store, query, segment_ids, id_column):
+        columns = self.read_columns(query, (list(segment_ids),))
+        keys = columns.pop(id_column)
+        return store.keyed(segment_ids, keys, **columns)
+
+    def iter_segment_chunks(self, segment_query, approach_query=None,
+                            sidewalk_query=None, id_column='segment_id'):
+        """
+        this function streams segments in chunks together with their
+        approaches and sidewalks, the approach and sidewalk queries take the
+        chunk's segment ids as their only parameter
+        (e.g. WHERE segment_id = ANY(%s))
+        :param segment_query: query returning one row per segment
+        :param approach_query: query returning approaches with id_column
+        :param sidewalk_query: query returning sidewalks with id_column
+        :param id_column: name of the segment id column
+        :return: generator of (segment columns, ApproachStore, SidewalkStore)
+        """
+        for columns in self.iter_chunks(segment_query):
+            approaches, sidewalks = self.read_groups(
+                columns[id_column], approach_query, sidewalk_query,
+                id_column)
+            yield columns, approaches, sidewalks
+
+    def read_groups(self, segment_ids, approach_query=None,
+                    sidewalk_query=None, id_column='segment_id'):
+        """
+        this function reads the approaches and sidewalks of a chunk of
+        segments
+        :param segment_ids: ids of the segments in chunk order
+        :param approach_query: query returning approaches with id_column
+        :param sidewalk_query: query returning sidewalks with id_column
+        :param id_column: name of the segment id column
+        :return: tuple of (ApproachStore, SidewalkStore), None without their
+            query
+        """
+        approaches = None
+        sidewalks = None
+        if approach_query is not None:
+            approaches = self._read_store(
+                ApproachStore, approach_query, segment_ids, id_column)
+        if sidewalk_query is not None:
+            sidewalks = self._read_store(
+                SidewalkStore, sidewalk_query, segment_ids, id_column)
+        return approaches, sidewalks
+
+
+class PostgisWriter(object):
+    """
+    writes scores back with COPY into a temporary staging table followed by
+    one set-based UPDATE
+    """
+    def __init__(self, connection):
+        """
+        :param connection: psycopg2 connection
+        """
+        self.connection = connection
+
+    def _copy_buffer(self, ids, scores, invalid):
+        # the lines are joined column by column from the text of the
+        # distinct scores, the last text is \N, the COPY null, for the rows
+        # of invalid segments
+        lines = np.asarray(ids).astype(str).astype(object)
+        for score in scores:
+            distinct, index = np.unique(np.asarray(score).astype(int),
+                                        return_inverse=True)
+            text = np.array(['\t%d' % v for v in distinct.tolist()] +
+                            ['\t\\N'], dtype=object)
+            index = index.ravel()
+            if invalid is not None:
+                index[invalid] = len(distinct)
+            lines = lines + text[index]
+        buffer = io.StringIO()
+        if len(lines):
+            buffer.write('\n'.join(lines.tolist()))
+            buffer.write('\n')
+        buffer.seek(0)
+        return buffer
+
+    def write_scores(self, table, id_column, ids, scores, invalid=None,
+                     id_type='bigint'):
+        """
+        this function writes score columns to a table
+        :param table: name of the table to update, may be schema qualified
+        :param id_column: name of the id column of the table
+        :param ids: ids of the scored rows
+        :param scores: dictionary of column name to score array
+        :param invalid: boolean mask of rows whose scores are written as NULL
+        :param id_type: SQL type of the id column
+        :return: int number of updated rows
+        """
+        from psycopg2 import sql
+        from psycopg2.extensions import TRANSACTION_STATUS_INERROR
+
+        names = list(scores)
+        if not names:
+            return 0
+        staging = sql.Identifier('lts_staging')
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql.SQL(
+                'CREATE TEMP TABLE {} ({} {}, {})').format(
+                    staging,
+                    sql.Identifier(id_column),
+                    sql.SQL(id_type),
+                    sql.SQL(', ').join(
+                        sql.SQL('{} smallint').format(sql.Identifier(n))
+                        for n in names)))
+            try:
+                cursor.copy_expert(
+                    sql.SQL('COPY {} FROM STDIN').format(staging).as_string(
+                        cursor),
+                    self._copy_buffer(ids, [scores[n] for n in names],
+                                      invalid))
+                cursor.execute(sql.SQL(
+                    'UPDATE {} AS t SET {} FROM {} AS s '
+                    'WHERE t.{} = s.{}').format(
+                        sql.Identifier(*table.split('.')),
+                        sql.SQL(', ').join(
+                            sql.SQL('{} = s.{}').format(
+                                sql.Identifier(n), sql.Identifier(n))
+                            for n in names),
+                        staging,
+                        sql.Identifier(id_column),
+                        sql.Identifier(id_column)))
+                count = cursor.rowcount
+            finally:
+                # a failed transaction drops the staging table on rollback,
+                # with autocommit it would stay in the session
+                if self.connection.get_transaction_status() != \
+                        TRANSACTION_STATUS_INERROR:
+                    cursor.execute(sql.SQL('DROP TABLE IF EXISTS {}').format(
+                        staging))
+        return count
@@ -0,0 +1,446 @@
+## vectorized base class of LTS
+import numpy as np
+from collections import Counter
+from cuuats.snt.lts.criteria import ANY, Bins, Members, Predicates
+from cuuats.snt.lts import instrument
+
+
+def as_column(values, numeric=True):
+    """
+    this function takes array-like values and return the column data and its
+    null mask
+    :param values: ndarray, masked array or sequence that may contain None
+    :param numeric: True for float data, False for object data
+    :return: tuple of (data, null)
+    """
+    if isinstance(values, np.ma.MaskedArray):
+        null = np.ma.getmaskarray(values).copy()
+        data = np.asarray(values.data)
+    else:
+        data = np.asarray(values)
+        if data.dtype == object:
+            null = np.equal(data, None)
+        else:
+            null = np.zeros(data.shape, dtype=bool)
+
+    if numeric:
+        if data.dtype == object:
+            data = np.where(null, 0, data)
+        data = data.astype(float)
+        null |= np.isnan(data)
+        data[null] = 0
+    else:
+        data = data.astype(object)
+        data[null] = None
+    return data, null
+
+
+def column_values(data, null):
+    """
+    this function is the inverse of as_column
+    :param data: column data
+    :param null: null mask
+    :return: masked array for numeric data, object array otherwise
+    """
+    if data.dtype == object:
+        return data
+    return np.ma.array(data, mask=null)
+
+
+def _get_column(columns, value):
+    if isinstance(value, str):
+        return columns[value]
+    data, null = columns[value[0]]
+    data = data.copy()
+    null = null.copy()
+    for v in value[1:]:
+        d, n = columns[v]
+        data += d
+        null |= n
+    return data, null
+
+
+def _compare(op, data, null, operand):
+    """
+    this function compares a column against an operand, null rows never match
+    """
+    valid = ~null
+    if op == 'in':
+        members = [o for o in operand if o is not None]
+        result = np.isin(data, members) & valid
+        if None in operand:
+            result |= null
+        return result
+    if op == 'contains':
+        result = np.zeros(data.shape, dtype=bool)
+        if valid.any():
+            values, inverse = np.unique(data[valid], return_inverse=True)
+            found = np.array([operand in v for v in values])
+            result[valid] = found[inverse.reshape(-1)]
+        return result
+    if op == '==':
+        result = (data == operand) & valid
+        if operand is None:
+            result |= null
+        return result
+    if op == '<':
+        return (data < operand) & valid
+    if op == '<=':
+        return (data <= operand) & valid
+    if op == '>=':
+        return (data >= operand) & valid
+    if op == '>':
+        return (data > operand) & valid
+    raise ValueError('unknown operator: %s' % op)
+
+
+def _bins_indices(bins, columns):
+    data, null = _get_column(columns, bins.value)
+    points = np.asarray(bins.points, dtype=float)
+    regions = np.array([-1 if r is None else r for r in bins.regions])
+    if len(points):
+        i = np.searchsorted(points, data, side='left')
+        exact = points[np.minimum(i, len(points) - 1)] == data
+        index = regions[i * 2 + (exact & (i < len(points)))]
+    else:
+        index = np.full(data.shape, regions[0])
+
+    error = np.zeros(data.shape, dtype=bool)
+    if bins.none_error is not None:
+        error = null
+    else:
+        index[null] = -1 if bins.none_index is None else bins.none_index
+    return index, error
+
+
+def _members_indices(members, columns):
+    data, null = _get_column(columns, members.value)
+    default = -1 if members.default is None else members.default
+    index = np.full(data.shape, default)
+    if null.any():
+        index[null] = members.lookup.get(None, default)
+    valid = ~null
+    if valid.any():
+        values, inverse = np.unique(data[valid], return_inverse=True)
+        mapped = np.array([members.lookup.get(v, default) for v in values])
+        index[valid] = mapped[inverse.reshape(-1)]
+    return index, np.zeros(data.shape, dtype=bool)
+
+
+def _predicates_indices(predicates, columns):
+    size = len(_get_column(columns, next(
+        c for c in predicates.conditions if c is not ANY)[0][0])[0])
+    index = np.full(size, -1)
+    error = np.zeros(size, dtype=bool)
+    pending = np.ones(size, dtype=bool)
+    for i, condition in enumerate(predicates.conditions):
+        if condition is ANY:
+            index[pending] = i
+            break
+        alive = pending.copy()
+        for value, op, operand in condition:
+            data, null = _get_column(columns, value)
+            if op not in ('==', 'in'):
+                error |= alive & null
+                alive &= ~null
+            alive &= _compare(op, data, null, operand)
+        index[alive] = i
+        pending &= ~(alive | error)
+    return index, error
+
+
+def criterion_indices(criterion, columns):
+    """
+    this function evaluates a criteria axis over columns
+    :param criterion: Bins, Members or Predicates
+    :param columns: dictionary of value path to (data, null)
+    :return: tuple of (index, error), index is -1 where no condition is true
+    """
+    if isinstance(criterion, Bins):
+        return _bins_indices(criterion, columns)
+    elif isinstance(criterion, Members):
+        return _members_indices(criterion, columns)
+    elif isinstance(criterion, Predicates):
+        return _predicates_indices(criterion, columns)
+    raise TypeError('unknown criterion: %s' % type(criterion).__name__)
+
+
+def lookup(scores, criteria, columns):
+    """
+    this function is the vectorized equivalent of CriteriaTable.lookup
+    :param scores: nested list of scores
+    :param criteria: CriteriaTable
+    :param columns: dictionary of value path to (data, null)
+    :return: tuple of (score, invalid), score is 0 on invalid rows
+    """
+    scores = np.asarray(scores, dtype=np.int8)
+    assert scores.shape == tuple(len(c) for c in criteria.criteria)
+    indices = []
+    invalid = None
+    for criterion in criteria.criteria:
+        index, error = criterion_indices(criterion, columns)
+        missing = (index < 0) | error
+        invalid = missing if invalid is None else invalid | missing
+        indices.append(np.where(missing, 0, index))
+    score = scores[tuple(indices)]
+    score[invalid] = 0
+    return score, invalid
+
+
+def segment_max(values, offsets):
+    """
+    this function reduces grouped values to the maximum of each group, groups
+    without values return 0
+    :param values: ndarray of values sorted by group along the last axis
+    :param offsets: CSR offsets, group i is values[..., offsets[i]:offsets[i+1]]
+    :return: ndarray with a last axis of length len(offsets) - 1
+    """
+    offsets = np.asarray(offsets)
+    result = np.zeros(values.shape[:-1] + (len(offsets) - 1,),
+                      dtype=values.dtype)
+    nonempty = offsets[1:] > offsets[:-1]
+    if nonempty.any():
+        result[..., nonempty] = np.maximum.reduceat(
+            values, offsets[:-1][nonempty], axis=-1)
+    return result
+
+
+def group_by_segment(segment_ids, keys):
+    """
+    this function orders rows keyed by segment id into CSR groups
+    :param segment_ids: ids of the segments in scoring order
+    :param keys: segment id of every row
+    :return: tuple of (order, offsets), order sorts the rows into groups
+    """
+    segment_ids = np.asarray(segment_ids)
+    keys = np.asarray(keys)
+    sorter = np.argsort(segment_ids, kind='stable')
+    position = np.searchsorted(segment_ids, keys, sorter=sorter)
+    position = np.minimum(position, len(segment_ids) - 1)
+    position = sorter[position] if len(segment_ids) else position
+    if len(keys) and (not len(segment_ids) or
+                      (segment_ids[position] != keys).any()):
+        raise ValueError('rows reference unknown segment ids')
+    order = np.argsort(position, kind='stable')
+    offsets = np.zeros(len(segment_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(position, minlength=len(segment_ids)),
+              out=offsets[1:])
+    return order, offsets
+
+
+class GroupedStore(object):
+    """
+    base class of the columnar stores of rows grouped by segment, the rows of
+    segment i are rows offsets[i]:offsets[i+1]
+    """
+    prefix = None
+
+    def __init__(self, offsets):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.size = int(self.offsets[-1])
+        self.segment_index = np.repeat(
+            np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+        self.columns = {}
+
+    def _fill(self, values):
+        if values is None:
+            return np.full(self.size, None, dtype=object)
+        return values
+
+    def _add_column(self, name, values, numeric=True):
+        data, null = as_column(self._fill(values), numeric)
+        if len(data) != self.size:
+            raise ValueError('%s has %d rows, expected %d' %
+                             (name, len(data), self.size))
+        self.columns[self.prefix + '.' + name] = (data, null)
+        return data, null
+
+    @classmethod
+    def from_columns(cls, offsets, columns):
+        """
+        this function builds a store from a dictionary of (data, null)
+        columns keyed by value path, e.g. the columns of another store
+        :param offsets: CSR offsets
+        :param columns: dictionary of value path to (data, null)
+        :return: store
+        """
+        kwargs = {}
+        for path, (data, null) in columns.items():
+            kwargs[path.split('.', 1)[1]] = column_values(data, null)
+        return cls(offsets, **kwargs)
+
+    def take(self, start, stop):
+        """
+        this function return a store with the rows of segments start:stop
+        :param start: first segment
+        :param stop: segment after the last one
+        :return: store
+        """
+        low = self.offsets[start]
+        high = self.offsets[stop]
+        columns = dict((path, (data[low:high], null[low:high]))
+                       for path, (data, null) in self.columns.items())
+        return self.from_columns(self.offsets[start:stop + 1] - low, columns)
+
+    @classmethod
+    def keyed(cls, segment_ids, keys, **columns):
+        """
+        this function builds a store from unordered rows keyed by segment id
+        :param segment_ids: ids of the segments in scoring order
+        :param keys: segment id of every row
+        :param columns: columns of the store
+        :return: store
+        """
+        order, offsets = group_by_segment(segment_ids, keys)
+        for name, values in columns.items():
+            if values is not None:
+                columns[name] = np.asarray(values)[order] \
+                    if not isinstance(values, np.ma.MaskedArray) \
+                    else values[order]
+        return cls(offsets, **columns)
+
+    @staticmethod
+    def _flatten(object_lists):
+        objects = []
+        offsets = [0]
+        for group in object_lists:
+            objects.extend(group or [])
+            offsets.append(len(objects))
+
+        def column(name):
+            values = np.empty(len(objects), dtype=object)
+            values[:] = [getattr(o, name, None) for o in objects]
+            return values
+        return offsets, column
+
+
+def table_cells(criteria, columns, where=None):
+    """
+    this function counts the rows resolved to each cell of a criteria table,
+    -1 on an axis where no condition is true or a value is missing
+    :param criteria: CriteriaTable
+    :param columns: dictionary of value path to (data, null)
+    :param where: boolean mask of the rows to count
+    :return: Counter of cell tuple to number of rows
+    """
+    indices = []
+    for criterion in criteria.criteria:
+        index, error = criterion_indices(criterion, columns)
+        indices.append(np.where(error, -1, index))
+    cells = np.stack(indices, axis=1)
+    if where is not None:
+        cells = cells[where]
+    if not len(cells):
+        return Counter()
+    cells, counts = np.unique(cells, axis=0, return_counts=True)
+    return Counter(dict((tuple(int(i) for i in cell), int(count))
+                        for cell, count in zip(cells, counts)))
+
+
+def _profile_score(function, profiler):
+    """
+    this function wraps LtsBatch._calculate_score to record the rows scored
+    by each criteria table and the cells they resolved to while profiling,
+    counting the cells is not included in the recorded time
+    """
+    def calculate_score(self, scores, criteria, where=None, columns=None,
+                        offsets=None):
+        invalid = self.invalid.sum()
+        began = profiler.clock()
+        score = function(self, scores, criteria, where, columns, offsets)
+        seconds = profiler.clock() - began
+        cells = table_cells(criteria,
+                            self.columns if columns is None else columns,
+                            where)
+        profiler.record_rows(criteria.name, cells, seconds,
+                             int(self.invalid.sum() - invalid))
+        return score
+    return calculate_score
+
+
+class LtsBatch(object):
+    """
+    base class of the vectorized LTS scorers, the columns dictionary is keyed
+    by the same value paths the criteria tables use (e.g. 'segment.aadt')
+    """
+    def __init__(self, size):
+        self.size = size
+        self.columns = {}
+        self.invalid = np.zeros(size, dtype=bool)
+
+    @classmethod
+    def _from_columns(cls, batch):
+        """
+        this function return an unscored batch sharing the columns of batch
+        """
+        self = cls.__new__(cls)
+        LtsBatch.__init__(self, batch.size)
+        self.columns = batch.columns
+        return self
+
+    def _add_column(self, name, values, numeric=True):
+        data, null = as_column(values, numeric)
+        if len(data) != self.size:
+            raise ValueError('%s has %d rows, expected %d' %
+                             (name, len(data), self.size))
+        self.columns[name] = (data, null)
+        return data, null
+
+    def _join(self, store):
+        """
+        this function return the columns of a grouped store (e.g. approaches)
+        together with the segment columns repeated for every row of the store
+        :param store: object with columns, offsets and segment_index
+        :return: dictionary of value path to (data, null)
+        """
+        if len(store.offsets) != self.size + 1:
+            raise ValueError('store has %d segments, expected %d' %
+                             (len(store.offsets) - 1, self.size))
+        columns = dict(store.columns)
+        index = store.segment_index
+        for name, (data, null) in self.columns.items():
+            columns[name] = (data[index], null[index])
+        return columns
+
+    @instrument.hook(_profile_score)
+    def _calculate_score(self, scores, criteria, where=None, columns=None,
+                         offsets=None):
+        """
+        this function takes the scores and criteria and return the score of
+        every row, rows outside of where score 0
+        :param scores: nested list of scores
+        :param criteria: CriteriaTable
+        :param where: boolean mask of the rows to score
+        :param columns: joined columns of a grouped store, defaults to segments
+        :param offsets: CSR offsets of the grouped store
+        :return: ndarray score
+        """
+        score, invalid = lookup(scores, criteria,
+            self.columns if columns is None else columns)
+        if where is not None:
+            score[~where] = 0
+            invalid &= where
+        if offsets is not None:
+            invalid = segment_max(invalid, offsets)
+        self.invalid |= invalid
+        return score
+
+    @instrument.stage('lts_batch.aggregate_score')
+    def _aggregate_score(self, *scores, **kwargs):
+        """
+        this function aggregate score arrays ignoring zeros
+        :param scores: score arrays
+        :param kwargs: "MAX" - returns maximum, "MIN" - return minimum
+        :return: ndarray score
+        """
+        stack = np.stack(scores)
+        method = kwargs.get("method")
+        if method == "MIN":
+            masked = np.where(stack == 0, np.iinfo(stack.dtype).max, stack)
+            score = masked.min(axis=0)
+            score[(stack == 0).all(axis=0)] = 0
+        elif method == "MAX":
+            score = stack.max(axis=0)
+        else:
+            score = np.zeros(stack.shape[1:], dtype=stack.dtype)
+        return score
@@ -1,29 +1,65 @@
 ## base classs of LTS
+from cuuats.snt.lts.criteria import CriteriaTable
+from cuuats.snt.lts import instrument
+
+_CODE_CACHE = {}
+
+
+def _compile_condition(condition):
+    code = _CODE_CACHE.get(condition)
+    if code is None:
+        code = compile(condition, '<condition>', 'eval')
+        _CODE_CACHE[condition] = code
+    return code
+
+
+def _profile_score(function, profiler):
+    """
+    this function wraps Lts._calculate_score to record the cell selected in
+    each criteria table while profiling
+    """
+    def calculate_score(self, scores, *condition_sets):
+        if len(condition_sets) == 1 and \
+            isinstance(condition_sets[0], CriteriaTable):
+            return profiler.lookup(condition_sets[0], scores, self)
+        began = profiler.clock()
+        try:
+            return function(self, scores, *condition_sets)
+        finally:
+            profiler.record_stage('lts.conditions', profiler.clock() - began)
+    return calculate_score
+
 
 class Lts:
     def __init__(self):
         self.overall_score = 0
         self.segment_score = 0
 
+    @instrument.hook(_profile_score)
     def _calculate_score(self, scores, *condition_sets):
         """
         this function takes the scores and condition_sets and return the score
         based on which argument is true
         :param self: self
         :param scores: list of scores
-        :param condition_sets: lists of conditions
+        :param condition_sets: a CriteriaTable, or lists of condition strings
         :return: int score
         """
+        if len(condition_sets) == 1 and \
+            isinstance(condition_sets[0], CriteriaTable):
+            return condition_sets[0].lookup(scores, self)
+
         score = scores
         for condition_set in condition_sets:
             assert len(score) == len(condition_set)
             for index, condition in enumerate(condition_set):
-                if eval(condition):
+                if eval(_compile_condition(condition)):
                     score = score[index]
                     break
         assert isinstance(score, int)
         return score
 
+    @instrument.stage('lts.aggregate_score')
     def _aggregate_score(self, *scores, **kwargs):
         """
         this function aggregate number of scores based on *scores
@@ -42,6 +78,25 @@ class Lts:
             score = max(score_list)
         return score
 
+    def _changed_paths(self, obj, prefix, version):
+        return [prefix + name for name in obj.changed_since(version)]
+
+    def _changed_scores(self, obj, prefix, version, dependencies):
+        """
+        this function return the names of the scores that read attributes of
+        obj assigned after version
+        :param self: self
+        :param obj: Segment, Approach or Sidewalk
+        :param prefix: value path prefix of obj, e.g. 'segment.'
+        :param version: version of obj at the last calculation
+        :param dependencies: dictionary of value path to score names
+        :return: set of score names
+        """
+        names = set()
+        for path in self._changed_paths(obj, prefix, version):
+            names.update(dependencies.get(path, ()))
+        return names
+
     def _get_high_score(self, *scores):
         return
 
@@ -56,7 +111,7 @@ class Lts:
         elif self.approach.lane_configuration is None:
             lanes = 2
         else:
-            lanes = len(self.approach.lane_configuration)
+            lanes = self.approach.total_lanes
 
         self.total_lanes_crossed = lanes
         return(lanes)
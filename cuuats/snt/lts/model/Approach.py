@@ -1,18 +1,75 @@
 ## Approach class for LTS
+from cuuats.snt.lts.model.Record import Record
+from cuuats.snt.lts.model.LaneCodec import LANES
+
+
+class Approach(Record):
+    FIELDS = (
+        ('lane_configuration', 'text'),
+        ('lane_code', 'int'),
+        ('right_turn_lane_length', 'float'),
+        ('right_turn_lane_config', 'text'),
+        ('bike_lane_approach', 'text'),
+        ('lanes_crossed', 'int'),
+        ('max_lane', 'int'),
+        ('total_lanes', 'int'),
+        ('median_present', 'bool'),
+        ('control_type', 'text'),
+    )
+    DERIVED = (
+        ('lane_code', 'lane_configuration', '_encode_lane_configuration'),
+        ('lanes_crossed', 'lane_configuration', '_calculate_lanes_crossed'),
+        ('max_lane', 'lane_configuration', '_calculate_max_lane'),
+        ('total_lanes', 'lane_configuration', '_calculate_total_lanes'),
+    )
 
-class Approach(object):
     def __init__(self, **kwargs):
         self.lane_configuration = kwargs.get('lane_configuration')
         self.right_turn_lane_length = kwargs.get('right_turn_lane_length')
         self.right_turn_lane_config = kwargs.get('right_turn_lane_config')
         self.bike_lane_approach = kwargs.get('bike_lane_approach')
-        self.lanes_crossed = self._calculate_lanes_crossed(self.lane_configuration)
-        self.max_lane = self._calculate_max_lane(self.lane_configuration)
-        if self.lane_configuration is not None:
-            self.total_lanes = len(self.lane_configuration)
         self.median_present = kwargs.get('median_present')
         self.control_type = kwargs.get('control_type')
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name == 'lane_configuration':
+            self._set_lane_features(value)
+
+    def _set_lane_features(self, lane_config):
+        """
+        this function interns the lane configuration and copies its features
+        from the codec table
+        :param self: self
+        :param lane_config: coded string of lane configuration
+        :return: None
+        """
+        code = LANES.encode(lane_config)
+        features = LANES.features[code]
+        self.lane_code = code
+        self.lanes_crossed = features.lanes_crossed
+        self.max_lane = features.max_lane
+        self.total_lanes = features.total_lanes
+
+    @property
+    def lane_features(self):
+        return LANES.features[self.lane_code]
+
+    @property
+    def has_right(self):
+        return LANES.features[self.lane_code].has_right
+
+    def has_right_turn_lane(self):
+        features = LANES.features[self.lane_code]
+        return features.has_right or features.has_shared_right
+
+    def has_left_turn_lane(self):
+        features = LANES.features[self.lane_code]
+        return features.has_left or features.has_dual_left
+
+    def _encode_lane_configuration(self, lane_config):
+        return LANES.encode(lane_config)
+
     def _calculate_max_lane(self, lane_config):
         """
         this function takes lane configuration string and return the max lane in
@@ -21,15 +78,10 @@ class Approach(object):
         :param lane_config: coded string of lane configuration
         :return: int represent max lane
         """
-        if lane_config is None:
-            max_lane = 1
-        else:
-            away_lane = len(lane_config[lane_config.find("X"):
-                            lane_config.rfind("X")+1])
-            incomeing_lane = len(lane_config[lane_config.rfind("X")+1:])
-            max_lane = max(away_lane, incomeing_lane)
+        return LANES.features[LANES.encode(lane_config)].max_lane
 
-        return(max_lane)
+    def _calculate_total_lanes(self, lane_config):
+        return LANES.features[LANES.encode(lane_config)].total_lanes
 
     def _calculate_lanes_crossed(self, lane_config):
         """
@@ -39,14 +91,7 @@ class Approach(object):
         :param lane_config: coded string of lane_config
         :return:
         """
-        if lane_config is None:
-            lanecrossed = 0
-        elif lane_config == "X" or lane_config == "XX" or lane_config == "XXX":
-            lanecrossed = 0
-        else:
-            lanecrossed = len(lane_config) - \
-                          lane_config.rfind("X") - 2
-        return(lanecrossed)
+        return LANES.features[LANES.encode(lane_config)].lanes_crossed
 
     def is_signalized(self):
         if self.control_type == 'signalized':
@@ -0,0 +1,71 @@
+## columnar Approach store for LTS
+import numpy as np
+from cuuats.snt.lts.lts_batch import GroupedStore
+from cuuats.snt.lts.model.LaneCodec import LANES, LaneFeatures
+
+
+class ApproachStore(GroupedStore):
+    """
+    approaches of many segments held as flat columns, the approaches of
+    segment i are rows offsets[i]:offsets[i+1]
+    """
+    prefix = 'approach'
+
+    def __init__(self, offsets, lane_configuration, right_turn_lane_length=None,
+                 bike_lane_approach=None, median_present=None,
+                 control_type=None, lane_code=None, **derived):
+        """
+        :param offsets: CSR offsets with one more entry than segments
+        :param lane_configuration: lane configuration code of every approach
+        :param lane_code: optional LANES codes of the lane configurations
+        :param derived: optional lanes_crossed, max_lane, total_lanes and
+            has_* feature columns, looked up from the lane codes when omitted
+        """
+        GroupedStore.__init__(self, offsets)
+        config, config_null = self._add_column(
+            'lane_configuration', lane_configuration, False)
+        self._add_column('right_turn_lane_length', right_turn_lane_length)
+        self._add_column('bike_lane_approach', bike_lane_approach, False)
+        self._add_column('control_type', control_type, False)
+
+        median = self._add_column('median_present', median_present, False)[0]
+        self.median_present = median.astype(bool)
+
+        if lane_code is None:
+            lane_code = LANES.encode_array(config)
+        self.lane_code = np.asarray(lane_code, dtype=np.intp)
+        for name in LaneFeatures._fields:
+            values = derived.get(name)
+            if values is None:
+                values = self.feature(name)
+            self._add_column(name, values)
+
+    def feature(self, name):
+        """
+        this function return a lane configuration feature of every approach
+        from the codec table, e.g. feature('has_right')
+        :param name: LaneFeatures field
+        :return: ndarray, masked for total_lanes
+        """
+        return LANES.table(name)[self.lane_code]
+
+    def is_signalized(self):
+        control, null = self.columns['approach.control_type']
+        return control == 'signalized'
+
+    @classmethod
+    def from_approaches(cls, approach_lists):
+        """
+        this function builds a store from lists of Approach objects, one list
+        per segment, None is treated as an empty list
+        :param approach_lists: list of lists of Approach
+        :return: ApproachStore
+        """
+        offsets, column = cls._flatten(approach_lists)
+        return cls(offsets,
+                   lane_configuration=column('lane_configuration'),
+                   right_turn_lane_length=column('right_turn_lane_length'),
+                   bike_lane_approach=column('bike_lane_approach'),
+                   median_present=column('median_present'),
+                   control_type=column('control_type'),
+                   lane_code=column('lane_code'))
@@ -2,4 +2,5 @@
 
 class Intersection(object):
     def __init__(self, **kwargs):
+        self.intersection_id = kwargs.get('intersection_id')
         self.intersection_control = kwargs.get('control_type')
@@ -0,0 +1,118 @@
+## interned lane configuration codes for LTS
+from collections import namedtuple
+
+LaneFeatures = namedtuple('LaneFeatures', [
+    'lanes_crossed',
+    'max_lane',
+    'total_lanes',
+    'has_right',
+    'has_shared_right',
+    'has_left',
+    'has_dual_left',
+])
+
+
+def parse_lane_configuration(lane_config):
+    """
+    this function takes lane configuration string and return its features,
+    lanes crossed from the right most lane to the left turn lane, max lane in
+    either direction, total lanes and the turn lanes present
+    :param lane_config: coded string of lane configuration, e.g. "XXLTTR"
+    :return: LaneFeatures
+    """
+    if lane_config is None:
+        return LaneFeatures(0, 1, None, False, False, False, False)
+
+    if lane_config == "X" or lane_config == "XX" or lane_config == "XXX":
+        lanes_crossed = 0
+    else:
+        lanes_crossed = len(lane_config) - lane_config.rfind("X") - 2
+
+    away_lane = len(lane_config[lane_config.find("X"):
+                    lane_config.rfind("X")+1])
+    incoming_lane = len(lane_config[lane_config.rfind("X")+1:])
+
+    return LaneFeatures(
+        lanes_crossed,
+        max(away_lane, incoming_lane),
+        len(lane_config),
+        "R" in lane_config,
+        "Q" in lane_config,
+        "L" in lane_config,
+        "K" in lane_config)
+
+
+class LaneCodec(object):
+    """
+    interns lane configurations to small integer codes, each configuration is
+    parsed once into a row of the feature table, code 0 is the missing
+    configuration
+    """
+    def __init__(self):
+        self.configurations = [None]
+        self.features = [parse_lane_configuration(None)]
+        self._codes = {None: 0}
+        self._tables = {}
+
+    def __len__(self):
+        return len(self.configurations)
+
+    def encode(self, lane_config):
+        """
+        this function return the code of a lane configuration, interning it
+        on first use
+        :param lane_config: coded string of lane configuration or None
+        :return: int code
+        """
+        code = self._codes.get(lane_config)
+        if code is None:
+            code = len(self.configurations)
+            self.features.append(parse_lane_configuration(lane_config))
+            self.configurations.append(lane_config)
+            self._codes[lane_config] = code
+            self._tables = {}
+        return code
+
+    def decode(self, code):
+        return self.configurations[code]
+
+    def encode_array(self, values):
+        """
+        this function return the codes of a sequence of lane configurations
+        :param values: sequence of str or None
+        :return: ndarray of int32 code
+        """
+        import numpy as np
+
+        get = self._codes.get
+        encode = self.encode
+        codes = [get(v) for v in values]
+        for i, code in enumerate(codes):
+            if code is None:
+                codes[i] = encode(values[i])
+        return np.array(codes, dtype=np.int32)
+
+    def table(self, name):
+        """
+        this function return one feature of every code as an array indexed by
+        code, total_lanes is a masked array as it is missing for code 0
+        :param name: feature name, e.g. 'lanes_crossed'
+        :return: ndarray
+        """
+        import numpy as np
+
+        table = self._tables.get(name)
+        if table is None:
+            index = LaneFeatures._fields.index(name)
+            values = [f[index] for f in self.features]
+            if name.startswith('has_'):
+                table = np.array(values, dtype=bool)
+            else:
+                data = np.array([-1 if v is None else v for v in values],
+                                dtype=np.int32)
+                table = np.ma.array(data, mask=data == -1)
+            self._tables[name] = table
+        return table
+
+
+LANES = LaneCodec()
@@ -0,0 +1,78 @@
+## record base class for LTS models
+from cuuats.snt.lts.model.Tracked import Tracked
+
+
+class Field(object):
+    """
+    attribute of a record view, read from and written to a row of a
+    RecordStore
+    """
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        return obj._store.get(self.name, obj._row)
+
+    def __set__(self, obj, value):
+        obj._store.set(self.name, obj._row, value)
+
+
+class _View(Tracked):
+    """
+    base of the view classes, assignments to fields go to the store row
+    """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        field = getattr(type(self), name, None)
+        if not isinstance(field, Field):
+            Tracked.__setattr__(self, name, value)
+            return
+        old = field.__get__(self, None)
+        if old is value or (type(old) is type(value) and old == value):
+            return
+        field.__set__(self, value)
+        self._track(name)
+
+
+class Record(Tracked):
+    """
+    base class of Segment, Approach and Sidewalk, FIELDS lists (name, kind)
+    with kind one of 'int', 'float', 'bool' or 'text', DERIVED lists
+    (field, source field, method) for fields computed from another field,
+    records keep their values as plain attributes and views of a store row
+    are instances of a subclass with Field descriptors
+    """
+    FIELDS = ()
+    DERIVED = ()
+
+    @classmethod
+    def _view_class(cls):
+        view = cls.__dict__.get('_view')
+        if view is None:
+            namespace = dict((name, Field(name)) for name, kind in cls.FIELDS)
+            # the record classes have a __dict__, so views keep one as well,
+            # the slots only keep the row reference out of it
+            namespace['__slots__'] = ('_store', '_row')
+            view = type(cls.__name__ + 'View', (cls, _View), namespace)
+            # views of views are the same class
+            view._view = view
+            cls._view = view
+        return view
+
+    @classmethod
+    def view(cls, store, row):
+        """
+        this function return a record reading and writing a row of a store
+        :param store: RecordStore
+        :param row: row index
+        :return: record
+        """
+        self = object.__new__(cls._view_class())
+        object.__setattr__(self, '_store', store)
+        object.__setattr__(self, '_row', row)
+        return self
@@ -0,0 +1,219 @@
+## struct-of-arrays store of LTS records
+import numpy as np
+
+_DTYPES = {
+    'int': np.int32,
+    'float': np.float64,
+    'bool': np.bool_,
+    'text': np.int32,
+}
+
+
+class RecordStore(object):
+    """
+    records of one class held as one typed array and one null mask per field,
+    text fields are int32 codes into a list of distinct values, rows are read
+    and written through record views, e.g. store[i].aadt
+    """
+    def __init__(self, record_class, size):
+        """
+        :param record_class: Record subclass, e.g. Segment
+        :param size: number of records
+        """
+        self.record_class = record_class
+        self.size = size
+        self.kinds = dict(record_class.FIELDS)
+        self.data = {}
+        self.null = {}
+        self.values = {}
+        self._codes = {}
+        for name, kind in record_class.FIELDS:
+            self.data[name] = np.zeros(size, dtype=_DTYPES[kind])
+            self.null[name] = np.ones(size, dtype=bool)
+            if kind == 'text':
+                self.values[name] = []
+                self._codes[name] = {}
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.size
+        if not 0 <= row < self.size:
+            raise IndexError(row)
+        return self.record_class.view(self, row)
+
+    def __iter__(self):
+        view = self.record_class.view
+        for row in range(self.size):
+            yield view(self, row)
+
+    def _code(self, name, value):
+        codes = self._codes[name]
+        code = codes.get(value)
+        if code is None:
+            code = len(self.values[name])
+            codes[value] = code
+            self.values[name].append(value)
+        return code
+
+    def get(self, name, row):
+        """
+        this function return the value of a field as a python object
+        :param name: field name
+        :param row: row index
+        :return: value or None
+        """
+        if self.null[name][row]:
+            return None
+        value = self.data[name][row]
+        if self.kinds[name] == 'text':
+            return self.values[name][value]
+        return value.item()
+
+    def set(self, name, row, value):
+        """
+        this function assigns the value of a field, None sets it to null
+        :param name: field name
+        :param row: row index
+        :param value: value or None
+        """
+        if value is None:
+            self.null[name][row] = True
+            return
+        if self.kinds[name] == 'text':
+            value = self._code(name, value)
+        elif self.kinds[name] == 'int' and not float(value).is_integer():
+            raise ValueError('%s must be an integer, got %r' % (name, value))
+        self.data[name][row] = value
+        self.null[name][row] = False
+
+    def set_column(self, name, values):
+        """
+        this function assigns a whole field from array-like values that may
+        contain None or be a masked array
+        :param name: field name
+        :param values: values of every record
+        """
+        if isinstance(values, np.ma.MaskedArray):
+            null = np.ma.getmaskarray(values).copy()
+            values = np.asarray(values.data, dtype=object)
+        else:
+            values = np.asarray(values, dtype=object)
+            null = np.equal(values, None)
+        if len(values) != self.size:
+            raise ValueError('%s has %d rows, expected %d' %
+                             (name, len(values), self.size))
+        if self.kinds[name] == 'text':
+            distinct = {}
+            data = np.zeros(self.size, dtype=np.int32)
+            for row in np.flatnonzero(~null):
+                value = values[row]
+                code = distinct.get(value)
+                if code is None:
+                    code = distinct[value] = self._code(name, value)
+                data[row] = code
+        elif self.kinds[name] == 'bool':
+            data = np.where(null, False, values).astype(np.bool_)
+        else:
+            # int fields are checked as floats so that fractions are not
+            # truncated, NaN is null in either kind
+            data = np.where(null, 0, values).astype(np.float64)
+            null |= np.isnan(data)
+            data[null] = 0
+            if self.kinds[name] == 'int' and \
+                    (data != np.trunc(data)).any():
+                raise ValueError('%s must be integers' % name)
+            data = data.astype(self.data[name].dtype)
+        self.data[name] = data
+        self.null[name] = null
+
+    def column(self, name):
+        """
+        this function return a field as the columns the batch scorers take,
+        a masked array for numbers and an object array for text
+        :param name: field name
+        :return: masked array or ndarray of object
+        """
+        null = self.null[name]
+        if self.kinds[name] == 'text':
+            values = np.array(self.values[name] + [None], dtype=object)
+            return values[np.where(null, -1, self.data[name])]
+        return np.ma.array(self.data[name], mask=null.copy())
+
+    def _derive(self, columns):
+        """
+        this function computes the DERIVED fields of the record class once
+        per distinct source value, a derived field given in columns is kept
+        unless it is derived from itself
+        """
+        parser = self.record_class.__new__(self.record_class)
+        for name, source, method in self.record_class.DERIVED:
+            if name in columns and name != source:
+                continue
+            function = getattr(parser, method)
+            null = self.null[source]
+            if self.kinds[source] == 'text':
+                codes = np.where(null, -1, self.data[source])
+                distinct, index = np.unique(codes, return_inverse=True)
+                values = [self.values[source][code] if code >= 0 else None
+                          for code in distinct]
+            else:
+                # null rows point past the distinct values, to None
+                distinct, inverse = np.unique(self.data[source][~null],
+                                              return_inverse=True)
+                values = distinct.tolist() + [None]
+                index = np.full(self.size, len(distinct), dtype=np.intp)
+                index[~null] = inverse.ravel()
+            result = np.empty(len(values), dtype=object)
+            for i, value in enumerate(values):
+                result[i] = self._apply(function, value)
+            derived = result[index.ravel()]
+            self.set_column(name, derived)
+
+    @staticmethod
+    def _apply(function, value):
+        try:
+            return function(value)
+        except TypeError:
+            return None
+
+    @classmethod
+    def from_columns(cls, record_class, columns):
+        """
+        this function builds a store from a dictionary of field columns, the
+        derived fields are computed as the record constructor would
+        :param record_class: Record subclass
+        :param columns: dictionary of field name to array-like values
+        :return: RecordStore
+        """
+        sizes = set(len(values) for values in columns.values())
+        if len(sizes) > 1:
+            raise ValueError('columns have different lengths')
+        store = cls(record_class, sizes.pop() if sizes else 0)
+        for name, values in columns.items():
+            store.set_column(name, values)
+        store._derive(columns)
+        return store
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        this function copies records of one class into a store
+        :param records: list of Record
+        :return: RecordStore
+        """
+        records = list(records)
+        if not records:
+            raise ValueError('records is empty')
+        record_class = type(records[0])
+        store = cls(record_class, len(records))
+        for name, kind in record_class.FIELDS:
+            store.set_column(name, [getattr(r, name, None) for r in records])
+        return store
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.data.values()) + \
+            sum(a.nbytes for a in self.null.values())
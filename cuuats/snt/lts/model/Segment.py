@@ -1,6 +1,23 @@
 ## Segment Class for LTS Assessment
+from cuuats.snt.lts.model.Record import Record
+
+
+class Segment(Record):
+    FIELDS = (
+        ('bicycle_facility_type', 'text'),
+        ('bicycle_facility_width', 'float'),
+        ('lanes_per_direction', 'int'),
+        ('parking_lane_width', 'float'),
+        ('aadt', 'int'),
+        ('functional_class', 'int'),
+        ('posted_speed', 'float'),
+        ('total_lanes', 'int'),
+        ('marked_center_lane', 'text'),
+    )
+    DERIVED = (
+        ('aadt', 'aadt', '_remove_none'),
+    )
 
-class Segment(object):
     def __init__(self, **kwargs):
         self.bicycle_facility_type = kwargs.get('bicycle_facility_type')
         self.bicycle_facility_width = kwargs.get('bicycle_facility_width')
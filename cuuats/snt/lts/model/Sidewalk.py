@@ -1,6 +1,20 @@
 # Sidewalk class for Lts`
+from cuuats.snt.lts.model.Record import Record
+
+
+class Sidewalk(Record):
+    FIELDS = (
+        ('sidewalk_width', 'float'),
+        ('buffer_type', 'text'),
+        ('buffer_width', 'float'),
+        ('sidewalk_score', 'float'),
+        ('sidewalk_condition', 'text'),
+        ('overall_landuse', 'float'),
+    )
+    DERIVED = (
+        ('sidewalk_condition', 'sidewalk_score', '_convert_score_to_condition'),
+    )
 
-class Sidewalk(object):
     def __init__(self, **kwargs):
         self.sidewalk_width = kwargs.get('sidewalk_width')
         self.buffer_type = kwargs.get('buffer_type')
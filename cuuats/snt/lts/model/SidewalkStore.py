@@ -0,0 +1,54 @@
+## columnar Sidewalk store for LTS
+import numpy as np
+from cuuats.snt.lts.lts_batch import GroupedStore
+
+
+class SidewalkStore(GroupedStore):
+    """
+    sidewalks of many segments held as flat columns, the sidewalks of
+    segment i are rows offsets[i]:offsets[i+1]
+    """
+    prefix = 'sidewalk'
+
+    def __init__(self, offsets, sidewalk_width, buffer_type=None,
+                 buffer_width=None, sidewalk_score=None,
+                 sidewalk_condition=None, overall_landuse=None):
+        """
+        :param offsets: CSR offsets with one more entry than segments
+        :param sidewalk_condition: optional condition column, converted from
+            sidewalk_score when omitted
+        """
+        GroupedStore.__init__(self, offsets)
+        self._add_column('sidewalk_width', sidewalk_width)
+        self._add_column('buffer_type', buffer_type, False)
+        self._add_column('buffer_width', buffer_width)
+        score, score_null = self._add_column('sidewalk_score', sidewalk_score)
+        self._add_column('overall_landuse', overall_landuse)
+        if sidewalk_condition is None:
+            sidewalk_condition = self._convert_score_to_condition(
+                score, score_null)
+        self._add_column('sidewalk_condition', sidewalk_condition, False)
+
+    def _convert_score_to_condition(self, score, null):
+        condition = np.select(
+            [score > 70, score > 60, score > 50],
+            ['Good', 'Fair', 'Poor'], 'Very Poor').astype(object)
+        condition[null] = None
+        return condition
+
+    @classmethod
+    def from_sidewalks(cls, sidewalk_lists):
+        """
+        this function builds a store from lists of Sidewalk objects, one list
+        per segment, None is treated as an empty list
+        :param sidewalk_lists: list of lists of Sidewalk
+        :return: SidewalkStore
+        """
+        offsets, column = cls._flatten(sidewalk_lists)
+        return cls(offsets,
+                   sidewalk_width=column('sidewalk_width'),
+                   buffer_type=column('buffer_type'),
+                   buffer_width=column('buffer_width'),
+                   sidewalk_score=column('sidewalk_score'),
+                   sidewalk_condition=column('sidewalk_condition'),
+                   overall_landuse=column('overall_landuse'))
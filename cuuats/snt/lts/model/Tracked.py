@@ -0,0 +1,39 @@
+## attribute change tracking for LTS models
+
+class Tracked(object):
+    """
+    records which attributes changed, each assignment of a new value bumps
+    the object version so scorers can ask what changed since they last read
+    the object
+    """
+    def __setattr__(self, name, value):
+        values = self.__dict__
+        if name in values:
+            old = values[name]
+            if old is value or (type(old) is type(value) and old == value):
+                return
+        values[name] = value
+        if name[0] != '_':
+            version = values.get('_version', 0) + 1
+            values['_version'] = version
+            values.setdefault('_changes', {})[name] = version
+
+    def _track(self, name):
+        values = self.__dict__
+        version = values.get('_version', 0) + 1
+        values['_version'] = version
+        values.setdefault('_changes', {})[name] = version
+
+    @property
+    def version(self):
+        return self.__dict__.get('_version', 0)
+
+    def changed_since(self, version):
+        """
+        this function return the attributes assigned after version
+        :param self: self
+        :param version: version returned by a previous read
+        :return: list of attribute names
+        """
+        changes = self.__dict__.get('_changes', {})
+        return [name for name, v in changes.items() if v > version]
@@ -0,0 +1,136 @@
+## vectorized scorer of several LTS modes in one pass
+import numpy as np
+from cuuats.snt.lts.lts_batch import LtsBatch
+from cuuats.snt.lts.blts_batch import BltsBatch
+from cuuats.snt.lts.plts_batch import PltsBatch
+from cuuats.snt.lts.model.ApproachStore import ApproachStore
+from cuuats.snt.lts.model.SidewalkStore import SidewalkStore
+from cuuats.snt.lts.model.Segment import Segment
+from cuuats.snt.lts import instrument
+
+MODES = ('blts', 'plts')
+
+# segment columns read by each mode and those that may be left out
+SEGMENT_COLUMNS = {
+    'blts': ('aadt', 'lanes_per_direction', 'bicycle_facility_width',
+             'parking_lane_width', 'posted_speed', 'functional_class'),
+    'plts': ('posted_speed', 'total_lanes', 'aadt', 'functional_class',
+             'marked_center_lane'),
+}
+OPTIONAL_COLUMNS = {
+    'blts': ('posted_speed', 'functional_class'),
+    'plts': (),
+}
+
+
+class MultiBatch(object):
+    """
+    scores BLTS and PLTS of the same segments in one pass, the segment
+    columns are converted and joined to the approaches once and the
+    BltsBatch and PltsBatch share them, so each segment, approach and
+    sidewalk is read once for both modes, ALTS is left out until Alts is
+    implemented
+    """
+    def __init__(self, approaches=None, sidewalks=None, modes=MODES,
+                 turn_criteria=10000, **segments):
+        """
+        :param approaches: ApproachStore grouped by segment
+        :param sidewalks: SidewalkStore grouped by segment, needed by plts
+        :param modes: modes to score, 'blts' and 'plts'
+        :param turn_criteria: aadt above which turn lanes are scored
+        :param segments: segment columns named as the keyword arguments of
+            BltsBatch and PltsBatch
+        """
+        for mode in modes:
+            if mode == 'alts':
+                raise ValueError('alts is not implemented yet')
+            if mode not in MODES:
+                raise ValueError('unknown mode: %s' % mode)
+        fields = dict(Segment.FIELDS)
+        for name in segments:
+            if name not in fields:
+                raise TypeError('unknown segment column: %s' % name)
+        needed = [name for name, kind in Segment.FIELDS
+                  if any(name in SEGMENT_COLUMNS[m] for m in modes)]
+        for name in needed:
+            if name not in segments and not all(
+                    name in OPTIONAL_COLUMNS[m] for m in modes
+                    if name in SEGMENT_COLUMNS[m]):
+                raise TypeError('missing segment column: %s' % name)
+
+        size = len(next(iter(segments.values())))
+        self.size = size
+        self.modes = tuple(modes)
+        base = LtsBatch(size)
+        for name in needed:
+            values = segments.get(name)
+            if values is None:
+                values = np.ma.masked_all(size)
+            data, null = base._add_column('segment.' + name, values,
+                                          fields[name] != 'text')
+            if name == 'aadt':
+                # Segment stores a missing aadt as 0
+                data[null] = 0
+                null[:] = False
+
+        if approaches is None:
+            approaches = ApproachStore(np.zeros(size + 1), [])
+        self.approaches = approaches
+        self.sidewalks = sidewalks
+        approach_columns = base._join(approaches)
+
+        self.blts = None
+        self.plts = None
+        if 'blts' in modes:
+            self.blts = BltsBatch.from_shared(
+                base, approaches, approach_columns, turn_criteria)
+        if 'plts' in modes:
+            if sidewalks is None:
+                raise ValueError('plts needs sidewalks')
+            self.plts = PltsBatch.from_shared(
+                base, sidewalks, base._join(sidewalks), approaches,
+                approach_columns)
+
+    @classmethod
+    def from_objects(cls, segments, approach_lists=None, sidewalk_lists=None,
+                     modes=MODES, turn_criteria=10000):
+        """
+        this function builds a batch from Segment objects and lists of
+        Approach and Sidewalk objects with one list per segment, each list
+        is flattened once for every mode
+        :param segments: list of Segment
+        :param approach_lists: list of lists of Approach
+        :param sidewalk_lists: list of lists of Sidewalk
+        :param modes: modes to score
+        :param turn_criteria: aadt above which turn lanes are scored
+        :return: MultiBatch
+        """
+        columns = {}
+        for name in set(n for m in modes if m in SEGMENT_COLUMNS
+                        for n in SEGMENT_COLUMNS[m]):
+            values = np.empty(len(segments), dtype=object)
+            values[:] = [getattr(s, name) for s in segments]
+            columns[name] = values
+
+        approaches = None
+        if approach_lists is not None:
+            approaches = ApproachStore.from_approaches(approach_lists)
+        sidewalks = None
+        if sidewalk_lists is not None:
+            sidewalks = SidewalkStore.from_sidewalks(sidewalk_lists)
+        return cls(approaches=approaches, sidewalks=sidewalks, modes=modes,
+                   turn_criteria=turn_criteria, **columns)
+
+    @instrument.stage('multi_batch.calculate')
+    def calculate(self):
+        """
+        this function scores every mode
+        :param self: self
+        :return: dictionary of mode to ndarray score
+        """
+        scores = {}
+        if self.blts is not None:
+            scores['blts'] = self.blts.calculate_blts()
+        if self.plts is not None:
+            scores['plts'] = self.plts.calculate_plts()
+        return(scores)
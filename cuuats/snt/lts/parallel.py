@@ -0,0 +1,252 @@
+## process pool driver for network scoring
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from cuuats.snt.lts.lts_batch import as_column, column_values
+from cuuats.snt.lts.model.ApproachStore import ApproachStore
+from cuuats.snt.lts.model.SidewalkStore import SidewalkStore
+
+# segment columns holding text rather than numbers
+TEXT_COLUMNS = ('marked_center_lane',)
+
+BLTS_SCORES = [
+    'bike_lane_with_adj_parking_score',
+    'bike_lane_without_adj_parking_score',
+    'mix_traffic_score',
+    'segment_score',
+    'right_turn_lane_score',
+    'left_turn_lane_score',
+    'crossing_with_median_score',
+    'crossing_without_median_score',
+    'blts_score',
+]
+
+PLTS_SCORES = [
+    'condition_score',
+    'physical_buffer_score',
+    'buffer_width_score',
+    'collector_crossing_score',
+    'arterial_crossing_score',
+    'plts_score',
+]
+
+
+class SharedColumns(object):
+    """
+    (data, null) columns copied into shared memory blocks, object columns are
+    stored as int32 codes into a small list of distinct values
+    """
+    def __init__(self, columns, offsets=None):
+        self.blocks = []
+        self.descriptors = {'columns': {}, 'offsets': None}
+        if offsets is not None:
+            self.descriptors['offsets'] = self._share(offsets)
+        for path, (data, null) in columns.items():
+            values = None
+            if data.dtype == object:
+                values, codes = np.unique(data[~null], return_inverse=True)
+                data = np.full(len(null), -1, dtype=np.int32)
+                data[~null] = codes.reshape(-1)
+                values = list(values)
+            self.descriptors['columns'][path] = (
+                self._share(data), self._share(null), values)
+
+    def _share(self, array):
+        block = shared_memory.SharedMemory(create=True,
+                                           size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[:] = array
+        self.blocks.append(block)
+        return (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+class _Attached(object):
+    """
+    worker side view of SharedColumns
+    """
+    def __init__(self, descriptors):
+        self.blocks = []
+        self.columns = {}
+        self.offsets = None
+        if descriptors['offsets'] is not None:
+            self.offsets = self._attach(descriptors['offsets'])
+        for path, (data, null, values) in descriptors['columns'].items():
+            data = self._attach(data)
+            null = self._attach(null)
+            self.columns[path] = (data, null, values)
+
+    def _attach(self, descriptor):
+        name, shape, dtype = descriptor
+        block = shared_memory.SharedMemory(name=name)
+        self.blocks.append(block)
+        return np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+
+    def take(self, low, high):
+        """
+        this function copies rows low:high out of shared memory
+        """
+        columns = {}
+        for path, (data, null, values) in self.columns.items():
+            data = data[low:high]
+            null = null[low:high].copy()
+            if values is not None:
+                decoded = np.empty(len(data), dtype=object)
+                decoded[~null] = np.array(values, dtype=object)[data[~null]]
+                data = decoded
+            else:
+                data = data.copy()
+            columns[path] = (data, null)
+        return columns
+
+    def close(self):
+        self.columns = {}
+        self.offsets = None
+        for block in self.blocks:
+            block.close()
+
+
+def _score_chunk(mode, shared, start, stop, options):
+    """
+    this function scores segments start:stop in a worker process
+    """
+    began = time.time()
+    segments = _Attached(shared['segment'])
+    kwargs = dict((path.split('.', 1)[1], column_values(data, null))
+                  for path, (data, null) in segments.take(start, stop).items())
+    stores = {}
+    for name, store in (('approaches', ApproachStore),
+                        ('sidewalks', SidewalkStore)):
+        if name not in shared:
+            continue
+        attached = _Attached(shared[name])
+        offsets = attached.offsets[start:stop + 1].copy()
+        stores[name] = store.from_columns(
+            offsets - offsets[0], attached.take(offsets[0], offsets[-1]))
+        attached.close()
+    segments.close()
+
+    if mode == 'blts':
+        from cuuats.snt.lts.blts_batch import BltsBatch
+        batch = BltsBatch(approaches=stores.get('approaches'),
+                          turn_criteria=options.get('turn_criteria', 10000),
+                          **kwargs)
+        batch.calculate_blts()
+        names = BLTS_SCORES
+    else:
+        from cuuats.snt.lts.plts_batch import PltsBatch
+        batch = PltsBatch(sidewalks=stores['sidewalks'],
+                          approaches=stores['approaches'], **kwargs)
+        batch.calculate_plts()
+        names = PLTS_SCORES
+
+    scores = dict((name, getattr(batch, name)) for name in names)
+    return (start, scores, batch.invalid, os.getpid(), stop - start,
+            time.time() - began)
+
+
+class ScoreResult(object):
+    """
+    merged result of a parallel run ordered by segment id
+    """
+    def __init__(self, segment_ids, scores, invalid, workers, elapsed):
+        self.segment_ids = segment_ids
+        self.scores = scores
+        self.invalid = invalid
+        self.workers = workers
+        self.elapsed = elapsed
+
+    def report(self):
+        """
+        this function return a text summary of the per worker throughput
+        :return: str
+        """
+        lines = ['%d segments in %.2f s (%.0f segments/s)' % (
+            len(self.segment_ids), self.elapsed,
+            len(self.segment_ids) / max(self.elapsed, 1e-9))]
+        for pid in sorted(self.workers):
+            count, seconds, chunks = self.workers[pid]
+            lines.append('worker %d: %d chunks, %d segments, %.0f segments/s'
+                         % (pid, chunks, count, count / max(seconds, 1e-9)))
+        return '\n'.join(lines)
+
+
+class ParallelScorer(object):
+    """
+    scores a segment set with BltsBatch or PltsBatch in a process pool, the
+    input columns are passed to the workers through shared memory
+    """
+    def __init__(self, mode='blts', workers=None, chunk_size=50000,
+                 **options):
+        """
+        :param mode: 'blts' or 'plts'
+        :param workers: number of processes, defaults to the number of cores
+        :param chunk_size: number of segments per task
+        :param options: passed to the scorer, e.g. turn_criteria
+        """
+        if mode not in ('blts', 'plts'):
+            raise ValueError('mode must be blts or plts')
+        self.mode = mode
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.options = options
+
+    def score(self, segment_ids, segments, approaches=None, sidewalks=None):
+        """
+        this function scores the segments and merges the chunks in segment id
+        order
+        :param segment_ids: id of every segment
+        :param segments: dictionary of segment columns, named as the keyword
+            arguments of BltsBatch or PltsBatch
+        :param approaches: ApproachStore grouped by segment
+        :param sidewalks: SidewalkStore grouped by segment
+        :return: ScoreResult
+        """
+        began = time.time()
+        segment_ids = np.asarray(segment_ids)
+        size = len(segment_ids)
+        columns = dict(('segment.' + name,
+                        as_column(values, name not in TEXT_COLUMNS))
+                       for name, values in segments.items())
+        shared = {'segment': SharedColumns(columns)}
+        for name, store in (('approaches', approaches),
+                            ('sidewalks', sidewalks)):
+            if store is not None:
+                shared[name] = SharedColumns(store.columns, store.offsets)
+
+        names = BLTS_SCORES if self.mode == 'blts' else PLTS_SCORES
+        scores = dict((name, np.zeros(size, dtype=np.int8)) for name in names)
+        invalid = np.zeros(size, dtype=bool)
+        workers = {}
+        try:
+            descriptors = dict((k, v.descriptors) for k, v in shared.items())
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(
+                    _score_chunk, self.mode, descriptors, start,
+                    min(start + self.chunk_size, size), self.options)
+                    for start in range(0, size, self.chunk_size)]
+                for future in futures:
+                    start, chunk, chunk_invalid, pid, count, seconds = \
+                        future.result()
+                    stop = start + count
+                    for name in names:
+                        scores[name][start:stop] = chunk[name]
+                    invalid[start:stop] = chunk_invalid
+                    total = workers.get(pid, (0, 0.0, 0))
+                    workers[pid] = (total[0] + count, total[1] + seconds,
+                                    total[2] + 1)
+        finally:
+            for block in shared.values():
+                block.close()
+
+        order = np.argsort(segment_ids, kind='stable')
+        for name in names:
+            scores[name] = scores[name][order]
+        return ScoreResult(segment_ids[order], scores, invalid[order],
+                           workers, time.time() - began)
@@ -0,0 +1,305 @@
+## asyncio pipeline of PostGIS reads, batch scoring and writes for LTS
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from cuuats.snt.lts.io_postgis import PostgisReader, PostgisWriter
+from cuuats.snt.lts.parallel import BLTS_SCORES, PLTS_SCORES
+
+# end of a queue
+_DONE = None
+
+
+def _score_chunk(mode, columns, approaches, sidewalks, options):
+    """
+    this function scores a chunk of segments in the scoring executor
+    :return: tuple of (dictionary of score name to ndarray, invalid mask)
+    """
+    if mode == 'blts':
+        from cuuats.snt.lts.blts_batch import BltsBatch
+        batch = BltsBatch(approaches=approaches,
+                          turn_criteria=options.get('turn_criteria', 10000),
+                          **columns)
+        batch.calculate_blts()
+        names = BLTS_SCORES
+    else:
+        from cuuats.snt.lts.plts_batch import PltsBatch
+        batch = PltsBatch(sidewalks=sidewalks, approaches=approaches,
+                          **columns)
+        batch.calculate_plts()
+        names = PLTS_SCORES
+    return dict((name, getattr(batch, name)) for name in names), \
+        batch.invalid
+
+
+class ConnectionPool(object):
+    """
+    fixed number of psycopg2 connections opened on first use, the blocking
+    calls made with them run in a thread pool of the same size
+    """
+    def __init__(self, connect, size=4):
+        """
+        :param connect: function returning a new psycopg2 connection, e.g.
+            functools.partial(psycopg2.connect, dsn)
+        :param size: number of connections
+        """
+        self.connect = connect
+        self.size = size
+        self.executor = ThreadPoolExecutor(max_workers=size)
+        self.connections = []
+        self._idle = None
+
+    async def run(self, function, *args):
+        """
+        this function calls a blocking function in the pool's threads
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+
+    async def acquire(self):
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+        if self._idle.empty() and len(self.connections) < self.size:
+            self.connections.append(None)
+            try:
+                connection = await self.run(self.connect)
+            except BaseException:
+                self.connections.pop()
+                raise
+            self.connections[-1] = connection
+            return connection
+        return await self._idle.get()
+
+    def release(self, connection):
+        self._idle.put_nowait(connection)
+
+    def close(self):
+        for connection in self.connections:
+            if connection is not None:
+                connection.close()
+        self.connections = []
+        self._idle = None
+        self.executor.shutdown()
+
+
+class PipelineResult(object):
+    """
+    totals of a pipeline run, busy seconds are summed over the concurrent
+    tasks of a stage
+    """
+    def __init__(self, rows, chunks, seconds, elapsed):
+        self.rows = rows
+        self.chunks = chunks
+        self.seconds = seconds
+        self.elapsed = elapsed
+
+    def report(self):
+        """
+        this function return a text summary of the busy time of each stage
+        against the wall time
+        :return: str
+        """
+        lines = ['%d segments in %d chunks in %.2f s (%.0f segments/s)' % (
+            self.rows, self.chunks, self.elapsed,
+            self.rows / max(self.elapsed, 1e-9))]
+        for stage in ('read', 'load', 'score', 'write'):
+            lines.append('%s: %.2f s busy' % (stage, self.seconds[stage]))
+        return '\n'.join(lines)
+
+
+class AsyncScorer(object):
+    """
+    scores segments read from PostGIS in a pipeline of stages joined by
+    bounded queues, segment chunks are streamed from a server-side cursor,
+    their approaches and sidewalks loaded and the scores written back on
+    pooled connections while earlier chunks are scored in an executor, a
+    full queue holds up the stages before it so at most depth chunks wait
+    between two stages
+    """
+    def __init__(self, connect, mode='blts', pool_size=4, workers=None,
+                 chunk_size=10000, depth=None, executor=None, **options):
+        """
+        :param connect: function returning a new psycopg2 connection
+        :param mode: 'blts' or 'plts'
+        :param pool_size: number of connections loading and writing chunks,
+            one more connection streams the segments
+        :param workers: number of chunks scored at once, defaults to the
+            number of cores
+        :param chunk_size: number of segments per chunk
+        :param depth: number of chunks each queue holds, defaults to workers
+        :param executor: executor scoring the chunks, a process pool of
+            workers by default
+        :param options: passed to the scorer, e.g. turn_criteria
+        """
+        if mode not in ('blts', 'plts'):
+            raise ValueError('mode must be blts or plts')
+        self.connect = connect
+        self.mode = mode
+        self.pool_size = pool_size
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.depth = depth or self.workers
+        self.executor = executor
+        self.options = options
+
+    async def stream(self, segment_query, approach_query=None,
+                     sidewalk_query=None, table=None, id_column='segment_id',
+                     columns=None):
+        """
+        this function yields the scores of every chunk as soon as they are
+        scored, and written when table is given, chunks come in the order
+        they finish, the queries are those of
+        PostgisReader.iter_segment_chunks and the segment query returns the
+        id column and the keyword arguments of BltsBatch or PltsBatch
+        :param segment_query: query returning one row per segment
+        :param approach_query: query returning approaches with id_column
+        :param sidewalk_query: query returning sidewalks with id_column
+        :param table: table whose score columns are updated, None to only
+            stream the scores
+        :param id_column: name of the segment id column
+        :param columns: dictionary of score name to table column, every
+            score under its own name by default
+        :return: async generator of (segment ids, dictionary of score name
+            to ndarray, invalid mask)
+        """
+        loop = asyncio.get_running_loop()
+        pool = ConnectionPool(self.connect, self.pool_size)
+        reading = ThreadPoolExecutor(max_workers=1)
+        executor = self.executor or ProcessPoolExecutor(self.workers)
+        segments = asyncio.Queue(self.depth)
+        loaded = asyncio.Queue(self.depth)
+        scored = asyncio.Queue(self.depth)
+        results = asyncio.Queue(self.depth)
+        self.seconds = dict.fromkeys(('read', 'load', 'score', 'write'), 0.0)
+
+        async def timed(stage, function, *args, executor=None):
+            began = time.time()
+            try:
+                if executor is None:
+                    return await pool.run(function, *args)
+                return await loop.run_in_executor(executor, function, *args)
+            finally:
+                self.seconds[stage] += time.time() - began
+
+        async def read():
+            connection = await loop.run_in_executor(reading, self.connect)
+            try:
+                reader = PostgisReader(connection, self.chunk_size)
+                chunks = reader.iter_chunks(segment_query)
+                while True:
+                    chunk = await timed('read', next, chunks, None,
+                                        executor=reading)
+                    if chunk is None:
+                        break
+                    await segments.put(chunk)
+                await loop.run_in_executor(reading, chunks.close)
+            finally:
+                await loop.run_in_executor(reading, connection.close)
+            await segments.put(_DONE)
+
+        async def load(chunk):
+            connection = await pool.acquire()
+            try:
+                reader = PostgisReader(connection)
+                approaches, sidewalks = await timed(
+                    'load', reader.read_groups, chunk[id_column],
+                    approach_query, sidewalk_query, id_column)
+                await timed('load', connection.rollback)
+            finally:
+                pool.release(connection)
+            return chunk, approaches, sidewalks
+
+        async def score(item):
+            chunk, approaches, sidewalks = item
+            ids = chunk.pop(id_column)
+            scores, invalid = await timed(
+                'score', _score_chunk, self.mode, chunk, approaches,
+                sidewalks, self.options, executor=executor)
+            return ids, scores, invalid
+
+        async def write(item):
+            ids, scores, invalid = item
+            if table is None:
+                return item
+            names = columns or dict((name, name) for name in scores)
+            connection = await pool.acquire()
+            try:
+                writer = PostgisWriter(connection)
+                await timed('write', writer.write_scores, table, id_column,
+                            ids, dict((names[name], scores[name])
+                                      for name in names), invalid)
+                await timed('write', connection.commit)
+            finally:
+                pool.release(connection)
+            return item
+
+        tasks = [asyncio.ensure_future(t) for t in (
+            read(),
+            _stage(segments, loaded, load, self.pool_size),
+            _stage(loaded, scored, score, self.workers),
+            _stage(scored, results, write, self.pool_size))]
+        try:
+            while True:
+                getter = asyncio.ensure_future(results.get())
+                finished, pending = await asyncio.wait(
+                    tasks + [getter], return_when=asyncio.FIRST_COMPLETED)
+                if getter not in finished:
+                    getter.cancel()
+                    # raise the error of a failed stage
+                    for task in finished:
+                        task.result()
+                    tasks = [t for t in tasks if t not in finished]
+                    continue
+                item = getter.result()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.executor is None:
+                executor.shutdown()
+            reading.shutdown()
+            pool.close()
+
+    async def score(self, *args, **kwargs):
+        """
+        this function runs the pipeline to the end, the arguments are those
+        of stream
+        :return: PipelineResult
+        """
+        began = time.time()
+        rows = 0
+        chunks = 0
+        async for ids, scores, invalid in self.stream(*args, **kwargs):
+            rows += len(ids)
+            chunks += 1
+        return PipelineResult(rows, chunks, self.seconds,
+                              time.time() - began)
+
+    def run(self, *args, **kwargs):
+        """
+        this function runs the pipeline in a new event loop, the arguments
+        are those of stream
+        :return: PipelineResult
+        """
+        return asyncio.run(self.score(*args, **kwargs))
+
+
+async def _stage(inbound, outbound, function, tasks):
+    """
+    this function runs tasks coroutines applying function to the items of a
+    queue, the end marker is put back for the other tasks and passed on
+    once every task ended
+    """
+    async def work():
+        while True:
+            item = await inbound.get()
+            if item is _DONE:
+                inbound.put_nowait(_DONE)
+                return
+            await outbound.put(await function(item))
+
+    await asyncio.gather(*[work() for _ in range(tasks)])
+    await outbound.put(_DONE)
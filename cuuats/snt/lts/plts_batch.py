@@ -0,0 +1,184 @@
+## vectorized plts class
+import numpy as np
+from cuuats.snt.lts.lts_batch import LtsBatch, segment_max
+from cuuats.snt.lts import plts_postgis as p
+from cuuats.snt.lts.model.ApproachStore import ApproachStore
+from cuuats.snt.lts.model.SidewalkStore import SidewalkStore
+from cuuats.snt.lts.tables import TABLES as c
+from cuuats.snt.lts import instrument
+
+
+class PltsBatch(LtsBatch):
+    """
+    scores columns of segments with their sidewalks and approaches at once,
+    results match Plts
+    """
+    def __init__(self, posted_speed, total_lanes, aadt, functional_class,
+                 marked_center_lane, sidewalks, approaches):
+        """
+        :param sidewalks: SidewalkStore grouped by segment
+        :param approaches: ApproachStore grouped by segment
+        """
+        LtsBatch.__init__(self, len(posted_speed))
+        self._add_column('segment.posted_speed', posted_speed)
+        self._add_column('segment.total_lanes', total_lanes)
+        aadt, aadt_null = self._add_column('segment.aadt', aadt)
+        # Segment stores a missing aadt as 0
+        aadt[aadt_null] = 0
+        aadt_null[:] = False
+        self._add_column('segment.functional_class', functional_class)
+        self._add_column('segment.marked_center_lane', marked_center_lane,
+                         False)
+
+        self._set_groups(sidewalks, self._join(sidewalks), approaches,
+                         self._join(approaches))
+
+    @classmethod
+    def from_shared(cls, batch, sidewalks, sidewalk_columns, approaches,
+                    approach_columns):
+        """
+        this function builds a batch on the converted segment columns of
+        another batch and sidewalk and approach columns already joined to
+        them, e.g. to score the segments of a BltsBatch without converting
+        them again
+        :param batch: LtsBatch with the segment columns of PltsBatch
+        :param sidewalks: SidewalkStore grouped by segment
+        :param sidewalk_columns: columns of batch._join(sidewalks)
+        :param approaches: ApproachStore grouped by segment
+        :param approach_columns: columns of batch._join(approaches)
+        :return: PltsBatch
+        """
+        self = cls._from_columns(batch)
+        self._set_groups(sidewalks, sidewalk_columns, approaches,
+                         approach_columns)
+        return self
+
+    def _set_groups(self, sidewalks, sidewalk_columns, approaches,
+                    approach_columns):
+        self.sidewalks = sidewalks
+        self.sidewalk_columns = sidewalk_columns
+        self.approaches = approaches
+        self.approach_columns = approach_columns
+
+        self.plts_score = None
+        self.condition_score = None
+        self.physical_buffer_score = None
+        self.buffer_width_score = None
+        self.landuse_score = np.zeros(self.size, dtype=np.int8)
+        self.collector_crossing_score = None
+        self.arterial_crossing_score = None
+
+    @classmethod
+    def from_objects(cls, segments, sidewalk_lists, approach_lists):
+        """
+        this function builds a batch from Segment objects and lists of
+        Sidewalk and Approach objects with one list per segment
+        :param segments: list of Segment
+        :param sidewalk_lists: list of lists of Sidewalk
+        :param approach_lists: list of lists of Approach
+        :return: PltsBatch
+        """
+        def column(name):
+            values = np.empty(len(segments), dtype=object)
+            values[:] = [getattr(s, name) for s in segments]
+            return values
+
+        return cls(column('posted_speed'),
+                   column('total_lanes'),
+                   column('aadt'),
+                   column('functional_class'),
+                   column('marked_center_lane'),
+                   SidewalkStore.from_sidewalks(sidewalk_lists),
+                   ApproachStore.from_approaches(approach_lists))
+
+    def _sidewalk_score(self, scores, criteria):
+        score = self._calculate_score(scores, criteria,
+            columns=self.sidewalk_columns, offsets=self.sidewalks.offsets)
+        return segment_max(score, self.sidewalks.offsets)
+
+    def _approach_score(self, scores, criteria, where):
+        score = self._calculate_score(scores, criteria, where,
+            self.approach_columns, self.approaches.offsets)
+        return segment_max(score, self.approaches.offsets)
+
+    @instrument.stage('plts_batch.sidewalks')
+    def _calculate_sidewalk_scores(self):
+        """
+        this function calculates the condition, physical buffer and buffer
+        width score of every sidewalk and reduces them to the maximum of each
+        segment
+        :param self: self
+        :return: tuple of ndarray score
+        """
+        self.condition_score = self._sidewalk_score(
+            c.SW_COND_TABLE,
+            p.SW_COND_CRITERIA)
+        self.physical_buffer_score = self._sidewalk_score(
+            c.BUFFER_TYPE_TABLE,
+            p.BUFFER_TYPE_CRITERIA)
+        self.buffer_width_score = self._sidewalk_score(
+            c.BUFFER_WIDTH_TABLE,
+            p.BUFFER_WIDTH_CRITERIA)
+        return(self.condition_score, self.physical_buffer_score,
+               self.buffer_width_score)
+
+    def _calculate_total_lanes_crossed(self):
+        columns = self.approach_columns
+        config_null = columns['approach.lane_configuration'][1]
+        total_lanes = columns['approach.total_lanes'][0]
+        marked = columns['segment.marked_center_lane'][0]
+        lanes = np.where(config_null,
+                         np.where(marked == "No", 1, 2),
+                         total_lanes)
+        columns['total_lanes_crossed'] = (lanes.astype(float),
+                                          np.zeros(len(lanes), dtype=bool))
+        return lanes
+
+    @instrument.stage('plts_batch.crossings')
+    def _calculate_crossing_scores(self):
+        """
+        this function calculates the collector or arterial crossing score of
+        every approach and reduces them to the maximum of each segment
+        :param self: self
+        :return: tuple of ndarray score
+        """
+        lanes = self._calculate_total_lanes_crossed()
+        fc, fc_null = self.approach_columns['segment.functional_class']
+        collector = fc_null | (fc >= 4)
+
+        self.collector_crossing_score = self._approach_score(
+            c.COLLECTOR_CROSSING_TABLE,
+            p.COLLECTOR_CROSSING_CRITERIA,
+            collector)
+        arterial_two_lanes = self._approach_score(
+            c.ARTERIAL_CROSSING_TWO_LANES_TABLE,
+            p.ARTERIAL_CROSSING_CRITERIA_TWO_LANES,
+            ~collector & (lanes <= 2))
+        arterial_three_lanes = self._approach_score(
+            c.ARTERIAL_CROSSING_THREE_LANES_TABLE,
+            p.ARTERIAL_CROSSING_CRITERIA_THREE_LANES,
+            ~collector & (lanes > 2))
+        self.arterial_crossing_score = np.maximum(arterial_two_lanes,
+                                                  arterial_three_lanes)
+        return(self.collector_crossing_score, self.arterial_crossing_score)
+
+    @instrument.stage('plts_batch.calculate')
+    def calculate_plts(self):
+        """
+        this function calculates the sidewalk and crossing scores of every
+        segment and aggregates the sidewalk scores with MAX, segments without
+        sidewalks raise an error in Plts and are flagged in self.invalid
+        :param self: self
+        :return: ndarray score
+        """
+        self._calculate_sidewalk_scores()
+        self._calculate_crossing_scores()
+        self.plts_score = self._aggregate_score(
+            self.condition_score,
+            self.physical_buffer_score,
+            self.buffer_width_score,
+            self.landuse_score,
+            method = "MAX"
+        )
+        self.invalid |= self.plts_score == 0
+        return(self.plts_score)
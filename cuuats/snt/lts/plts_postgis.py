@@ -3,25 +3,83 @@ from cuuats.snt.lts.lts_postgis import Lts
 from cuuats.snt.lts.model.Segment import Segment
 from cuuats.snt.lts.model.Approach import Approach
 from cuuats.snt.lts.model.Sidewalk import Sidewalk
-from cuuats.snt.lts import config as c
+from cuuats.snt.lts.tables import TABLES as c
+from cuuats.snt.lts import instrument
+from cuuats.snt.lts.criteria import ANY, Bins, Members, CriteriaTable, \
+    dependencies, name_tables
+
+SPEED_CRITERIA = Bins('segment.posted_speed',
+    [('<=', 25), ('==', 30), ('==', 35), ANY])
+
+SW_COND_CRITERIA = CriteriaTable(
+    Bins('sidewalk.sidewalk_width', [('<', 4), ('<', 5), ('<', 6), ANY]),
+    Members('sidewalk.sidewalk_condition', ['Good', 'Fair', 'Poor', ANY]))
+
+BUFFER_TYPE_CRITERIA = CriteriaTable(
+    Members('sidewalk.buffer_type',
+        ['No Buffer', 'Solid Buffer', 'Landscaped', ANY]),
+    SPEED_CRITERIA)
+
+BUFFER_WIDTH_CRITERIA = CriteriaTable(
+    Bins('segment.total_lanes', [('<=', 2), ('==', 3), ('<=', 5), ANY]),
+    Bins('sidewalk.buffer_width',
+        [('<', 5), ('<', 10), ('<', 15), ('<', 25), ANY]))
+
+COLLECTOR_CROSSING_CRITERIA = CriteriaTable(
+    SPEED_CRITERIA,
+    Bins('total_lanes_crossed', [('<=', 1), ANY]))
+
+ARTERIAL_CROSSING_CRITERIA_TWO_LANES = CriteriaTable(
+    SPEED_CRITERIA,
+    Bins('segment.aadt', [('<', 5000), ('<', 9000), ANY]))
+
+ARTERIAL_CROSSING_CRITERIA_THREE_LANES = CriteriaTable(
+    SPEED_CRITERIA,
+    Bins('segment.aadt', [('<', 8000), ('<', 12000), ANY]))
+
+name_tables(globals(), 'plts.')
+
+SIDEWALK_SCORES = ('condition_score', 'physical_buffer_score',
+                   'buffer_width_score')
+
+CROSSING_SCORES = ('collector_crossing_score', 'arterial_crossing_score')
+
+# criteria and attributes read by each sub-score, total_lanes_crossed is
+# derived from the marked center lane, the lane configuration and the total
+# lanes of the approach
+CROSSING_INPUTS = ['segment.functional_class', 'segment.marked_center_lane',
+                   'approach.lane_configuration', 'approach.total_lanes']
+
+DEPENDENCIES = dependencies({
+    'condition_score': [SW_COND_CRITERIA],
+    'physical_buffer_score': [BUFFER_TYPE_CRITERIA],
+    'buffer_width_score': [BUFFER_WIDTH_CRITERIA],
+    'collector_crossing_score': [
+        COLLECTOR_CROSSING_CRITERIA, ARTERIAL_CROSSING_CRITERIA_TWO_LANES,
+        ARTERIAL_CROSSING_CRITERIA_THREE_LANES] + CROSSING_INPUTS,
+    'arterial_crossing_score': [
+        COLLECTOR_CROSSING_CRITERIA, ARTERIAL_CROSSING_CRITERIA_TWO_LANES,
+        ARTERIAL_CROSSING_CRITERIA_THREE_LANES] + CROSSING_INPUTS,
+})
+
 
 class Plts(Lts):
     def __init__(self, segment, sidewalks, approaches):
-        if type(segment) is Segment:
+        if isinstance(segment, Segment):
             self.segment = segment
         else:
             raise TypeError('segment is not a Segment object')
 
         self.sidewalks = []
         for s in sidewalks:
-            if type(s) is Sidewalk:
+            if isinstance(s, Sidewalk):
                 self.sidewalks.append(s)
             else:
                 raise TypeError('sidewalk is not a Sidewalk object')
 
         self.approaches = []
         for a in approaches:
-            if type(a) is Approach:
+            if isinstance(a, Approach):
                 self.approaches.append(a)
             else:
                 raise TypeError('approach is not an Approach object')
@@ -34,55 +92,35 @@ class Plts(Lts):
         self.collector_crossing_score = 0
         self.arterial_crossing_score = 0
         self.total_lanes_crossed = 0
+        self._sidewalk_scores = None
+        self._crossing_scores = None
 
+    @instrument.stage('plts.condition')
     def _calculate_condition_score(self):
         score = 0
         score = self._calculate_score(
             c.SW_COND_TABLE,
-            ['self.sidewalk.sidewalk_width < 4',
-             'self.sidewalk.sidewalk_width < 5',
-             'self.sidewalk.sidewalk_width < 6',
-             'True'],
-            ['self.sidewalk.sidewalk_condition is "Good"',
-             'self.sidewalk.sidewalk_condition is "Fair"',
-             'self.sidewalk.sidewalk_condition is "Poor"',
-             'True']
-        )
+            SW_COND_CRITERIA)
 
         self.condition_score = max(self.condition_score, score)
         return(score)
 
+    @instrument.stage('plts.physical_buffer')
     def _calculate_physical_buffer_score(self):
         score = 0
         score = self._calculate_score(
             c.BUFFER_TYPE_TABLE,
-            ['self.sidewalk.buffer_type == "No Buffer"',
-             'self.sidewalk.buffer_type == "Solid Buffer"',
-             'self.sidewalk.buffer_type == "Landscaped"',
-             'True'],
-            ['self.segment.posted_speed <= 25',
-             'self.segment.posted_speed == 30',
-             'self.segment.posted_speed == 35',
-             'True']
-        )
+            BUFFER_TYPE_CRITERIA)
 
         self.physical_buffer_score = max(self.physical_buffer_score, score)
         return(score)
 
+    @instrument.stage('plts.buffer_width')
     def _calculate_buffer_width_score(self):
         score = 0
         score = self._calculate_score(
             c.BUFFER_WIDTH_TABLE,
-            ['self.segment.total_lanes <= 2',
-             'self.segment.total_lanes == 3',
-             'self.segment.total_lanes <= 5',
-             'True'],
-            ['self.sidewalk.buffer_width < 5',
-             'self.sidewalk.buffer_width < 10',
-             'self.sidewalk.buffer_width < 15',
-             'self.sidewalk.buffer_width < 25',
-             'True']
-        )
+            BUFFER_WIDTH_CRITERIA)
 
         self.buffer_width_score = max(self.buffer_width_score, score)
         return(score)
@@ -95,63 +133,81 @@ class Plts(Lts):
         self.sidewalk.landuse_score = max(self.sidewalk.landuse_score, score)
         return(score)
 
+    @instrument.stage('plts.collector_crossing')
     def _calculate_collector_crossing_score(self):
         score = 0
         score = self._calculate_score(
             c.COLLECTOR_CROSSING_TABLE,
-            ['self.segment.posted_speed <= 25',
-             'self.segment.posted_speed == 30',
-             'self.segment.posted_speed == 35',
-             'True'],
-            ['self.total_lanes_crossed <= 1',
-             'True']
-        )
+            COLLECTOR_CROSSING_CRITERIA)
         self.collector_crossing_score = max(self.collector_crossing_score, score)
         return(score)
 
+    @instrument.stage('plts.arterial_crossing')
     def _calculate_arterial_crossing_score(self):
         score = 0
         if self.total_lanes_crossed <= 2:
             score = self._calculate_score(
                 c.ARTERIAL_CROSSING_TWO_LANES_TABLE,
-                ['self.segment.posted_speed <= 25',
-                 'self.segment.posted_speed == 30',
-                 'self.segment.posted_speed == 35',
-                 'True'],
-                ['self.segment.aadt < 5000',
-                 'self.segment.aadt < 9000',
-                 'True']
-            )
+                ARTERIAL_CROSSING_CRITERIA_TWO_LANES)
         else:
             score = self._calculate_score(
                 c.ARTERIAL_CROSSING_THREE_LANES_TABLE,
-                ['self.segment.posted_speed <= 25',
-                 'self.segment.posted_speed == 30',
-                 'self.segment.posted_speed == 35',
-                 'True'],
-                ['self.segment.aadt < 8000',
-                 'self.segment.aadt < 12000',
-                 'True']
-            )
+                ARTERIAL_CROSSING_CRITERIA_THREE_LANES)
         self.arterial_crossing_score = max(self.arterial_crossing_score, score)
         return score
 
-    def calculate_plts(self):
-        # sidewalk criteria scores
-        for sidewalk in self.sidewalks:
-            self.sidewalk = sidewalk
-            self._calculate_condition_score()
-            self._calculate_physical_buffer_score()
-            self._calculate_buffer_width_score()
+    @instrument.stage('plts.sidewalk')
+    def _score_sidewalk(self, sidewalk, names, previous):
+        """
+        this function calculates the sidewalk scores of one sidewalk, scores
+        not in names are kept from previous
+        :param self: self
+        :param sidewalk: Sidewalk
+        :param names: names of the scores to calculate
+        :param previous: dictionary of the previous scores of the sidewalk
+        :return: dictionary of score name to int score
+        """
+        scores = dict(previous)
+        self.sidewalk = sidewalk
+        if 'condition_score' in names:
+            self.condition_score = 0
+            scores['condition_score'] = self._calculate_condition_score()
+        if 'physical_buffer_score' in names:
+            self.physical_buffer_score = 0
+            scores['physical_buffer_score'] = \
+                self._calculate_physical_buffer_score()
+        if 'buffer_width_score' in names:
+            self.buffer_width_score = 0
+            scores['buffer_width_score'] = self._calculate_buffer_width_score()
+        return(scores)
 
-        # crossing related scores
-        for approach in self.approaches:
-            self.approach = approach
-            self._calculate_total_lanes_crossed()
-            if self.segment.categorize_functional_class() == "C":
-                self._calculate_collector_crossing_score()
-            else:
-                self._calculate_arterial_crossing_score()
+    @instrument.stage('plts.crossing')
+    def _score_crossing(self, approach):
+        """
+        this function calculates the crossing scores of one approach
+        :param self: self
+        :param approach: Approach
+        :return: dictionary of score name to int score
+        """
+        self.approach = approach
+        self.collector_crossing_score = 0
+        self.arterial_crossing_score = 0
+        self._calculate_total_lanes_crossed()
+        if self.segment.categorize_functional_class() == "C":
+            self._calculate_collector_crossing_score()
+        else:
+            self._calculate_arterial_crossing_score()
+        return({'collector_crossing_score': self.collector_crossing_score,
+                'arterial_crossing_score': self.arterial_crossing_score})
+
+    @instrument.stage('plts.aggregate')
+    def _aggregate_plts(self):
+        for name in SIDEWALK_SCORES:
+            setattr(self, name, max([s[name] for s in self._sidewalk_scores]
+                                    + [0]))
+        for name in CROSSING_SCORES:
+            setattr(self, name, max([s[name] for s in self._crossing_scores]
+                                    + [0]))
 
         self.plts_score = self._aggregate_score(
             self.condition_score,
@@ -160,6 +216,53 @@ class Plts(Lts):
             self.landuse_score,
             method = "MAX"
         )
+        self._versions = [self.segment.version] + \
+            [s.version for s in self.sidewalks] + \
+            [a.version for a in self.approaches]
+        return(self.plts_score)
+
+    @instrument.stage('plts.calculate')
+    def calculate_plts(self):
+        # sidewalk criteria scores
+        names = set(SIDEWALK_SCORES)
+        empty = dict((name, 0) for name in names)
+        self._sidewalk_scores = [self._score_sidewalk(s, names, empty)
+                                 for s in self.sidewalks]
+
+        # crossing related scores
+        self._crossing_scores = [self._score_crossing(a)
+                                 for a in self.approaches]
+        return(self._aggregate_plts())
+
+    @instrument.stage('plts.update')
+    def update_plts(self):
+        """
+        this function recalculates only the sub-scores that read attributes
+        of the segment, the sidewalks or the approaches changed since the last
+        calculation, sidewalks or approaches added or removed need a full
+        calculate_plts
+        :param self: self
+        :return: int score
+        """
+        if self._sidewalk_scores is None:
+            return(self.calculate_plts())
+
+        segment_names = self._changed_scores(
+            self.segment, 'segment.', self._versions[0], DEPENDENCIES)
+        versions = iter(self._versions[1:])
+        for i, sidewalk in enumerate(self.sidewalks):
+            names = segment_names | self._changed_scores(
+                sidewalk, 'sidewalk.', next(versions), DEPENDENCIES)
+            if names.intersection(SIDEWALK_SCORES):
+                self._sidewalk_scores[i] = self._score_sidewalk(
+                    sidewalk, names, self._sidewalk_scores[i])
+
+        for i, approach in enumerate(self.approaches):
+            names = segment_names | self._changed_scores(
+                approach, 'approach.', next(versions), DEPENDENCIES)
+            if names.intersection(CROSSING_SCORES):
+                self._crossing_scores[i] = self._score_crossing(approach)
+        return(self._aggregate_plts())
 
 if __name__ == '__main__':
     # how to use the plts class
@@ -187,4 +290,3 @@ if __name__ == '__main__':
     plts = Plts(segment = segment, sidewalks = sidewalks, approaches = approaches)
     plts.calculate_plts()
     print(plts.plts_score)
-    import pdb; pdb.set_trace()
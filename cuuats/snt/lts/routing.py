@@ -0,0 +1,231 @@
+## stress-constrained shortest paths and accessibility for LTS
+import heapq
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from cuuats.snt.lts import instrument
+
+# graph searched by the worker processes, set once per worker
+_GRAPH = None
+
+
+def _set_graph(offsets, targets, costs, weights):
+    global _GRAPH
+    _GRAPH = (offsets, targets, costs, weights)
+
+
+def bounded_dijkstra(offsets, targets, costs, sources, budget):
+    """
+    this function return the least cost of every node reached from any of
+    the sources within the budget, edges of infinite cost are never taken
+    :param offsets: CSR offsets of the edges leaving every node
+    :param targets: node every edge leads to
+    :param costs: cost of every edge
+    :param sources: node indices the search starts from at no cost
+    :param budget: largest cost reached
+    :return: tuple of (ndarray of reached node, ndarray of cost, ndarray of
+        the source reaching each node at that cost)
+    """
+    best = {}
+    source_of = {}
+    heap = []
+    for source in sources:
+        source = int(source)
+        if source not in best:
+            best[source] = 0.0
+            source_of[source] = source
+            heap.append((0.0, source))
+    heapq.heapify(heap)
+    done = set()
+    while heap:
+        cost, node = heapq.heappop(heap)
+        if node in done:
+            continue
+        done.add(node)
+        low = offsets[node]
+        high = offsets[node + 1]
+        if low == high:
+            continue
+        for target, edge in zip(targets[low:high].tolist(),
+                                costs[low:high].tolist()):
+            reached = cost + edge
+            if reached <= budget and reached < best.get(target, np.inf):
+                best[target] = reached
+                source_of[target] = source_of[node]
+                heapq.heappush(heap, (reached, target))
+    nodes = np.fromiter(best.keys(), dtype=np.int64, count=len(best))
+    return nodes, \
+        np.fromiter(best.values(), dtype=np.float64, count=len(best)), \
+        np.fromiter((source_of[n] for n in best), dtype=np.int64,
+                    count=len(best))
+
+
+def _reach_batch(origins, budget, graph=None):
+    """
+    this function sums the destination weights reached from every origin of
+    a batch, searching one origin at a time
+    """
+    offsets, targets, costs, weights = graph or _GRAPH
+    totals = np.zeros(len(origins))
+    counts = np.zeros(len(origins), dtype=np.int64)
+    for i, origin in enumerate(origins):
+        nodes = bounded_dijkstra(offsets, targets, costs, (origin,),
+                                 budget)[0]
+        totals[i] = weights[nodes].sum()
+        counts[i] = len(nodes)
+    return totals, counts
+
+
+class StressGraph(object):
+    """
+    segments joining intersections as a CSR graph of directed edges, one
+    each way per segment, with the length and stress of the segment every
+    edge follows, searches only take edges whose segment is scored and at
+    most a stress threshold
+    """
+    def __init__(self, segment_ids, from_nodes, to_nodes, lengths, scores,
+                 invalid=None, intersections=None):
+        """
+        :param segment_ids: id of every segment
+        :param from_nodes: id of the intersection at one end of every segment
+        :param to_nodes: id of the intersection at the other end
+        :param lengths: length of every segment
+        :param scores: BLTS or PLTS score of every segment, 0 for unscored
+            segments
+        :param invalid: boolean mask of segments that could not be scored
+        :param intersections: Intersection objects, so that intersections
+            without segments can be origins
+        """
+        node_ids = [np.asarray(from_nodes), np.asarray(to_nodes)]
+        if intersections is not None:
+            node_ids.append(np.array([i.intersection_id
+                                      for i in intersections],
+                                     dtype=node_ids[0].dtype))
+        self.node_ids, inverse = np.unique(np.concatenate(node_ids),
+                                           return_inverse=True)
+        size = len(segment_ids)
+        u = inverse[:size]
+        v = inverse[size:2 * size]
+
+        self.segment_ids = np.asarray(segment_ids)
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        self.stress = np.array(scores, dtype=np.int8)
+        if invalid is not None:
+            self.stress[np.asarray(invalid, dtype=bool)] = 0
+
+        # edges of every node in CSR order
+        tails = np.concatenate([u, v])
+        order = np.argsort(tails, kind='stable')
+        self.targets = np.concatenate([v, u])[order].astype(np.int32)
+        self.edge_segments = np.concatenate([np.arange(size),
+                                             np.arange(size)])[order]
+        self.offsets = np.zeros(len(self.node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tails, minlength=len(self.node_ids)),
+                  out=self.offsets[1:])
+
+    def costs(self, threshold, speed=1.0, stress_weights=None):
+        """
+        this function return the cost of every edge, the time to travel its
+        segment at speed, multiplied by the weight of the segment's stress
+        :param threshold: highest stress taken, edges above it or unscored
+            cost infinity
+        :param speed: length travelled per unit of cost, e.g. meters per
+            minute
+        :param stress_weights: dictionary of stress to cost multiplier, e.g.
+            {1: 1.0, 2: 1.2, 3: 1.5, 4: 2.0}, every stress weighs 1 by default
+        :return: ndarray of float64
+        """
+        stress = self.stress[self.edge_segments]
+        costs = self.lengths[self.edge_segments] / speed
+        if stress_weights:
+            weights = np.ones(max(max(stress_weights), 6) + 1)
+            for level, weight in stress_weights.items():
+                weights[level] = weight
+            costs *= weights[stress]
+        costs[(stress <= 0) | (stress > threshold)] = np.inf
+        return costs
+
+    def nodes(self, intersection_ids):
+        """
+        this function return the node index of intersections
+        :param intersection_ids: intersection ids
+        :return: ndarray of node index
+        """
+        intersection_ids = np.asarray(intersection_ids)
+        position = np.minimum(np.searchsorted(self.node_ids,
+                                              intersection_ids),
+                              len(self.node_ids) - 1)
+        if (self.node_ids[position] != intersection_ids).any():
+            raise KeyError('unknown intersection id')
+        return position
+
+    def isochrone(self, origins, budget, threshold, speed=1.0,
+                  stress_weights=None):
+        """
+        this function return the intersections reached within the budget
+        from the nearest of the origins
+        :param origins: intersection id or ids the search starts from
+        :param budget: largest cost, in the units of length / speed
+        :param threshold: highest stress taken
+        :param speed: length travelled per unit of cost
+        :param stress_weights: dictionary of stress to cost multiplier
+        :return: tuple of (ndarray of intersection id, ndarray of cost,
+            ndarray of the id of the nearest origin), by increasing cost
+        """
+        sources = self.nodes(np.atleast_1d(origins))
+        nodes, costs, sources = bounded_dijkstra(
+            self.offsets, self.targets,
+            self.costs(threshold, speed, stress_weights), sources, budget)
+        order = np.argsort(costs, kind='stable')
+        return self.node_ids[nodes[order]], costs[order], \
+            self.node_ids[sources[order]]
+
+    @instrument.stage('routing.accessibility')
+    def accessibility(self, origins, budget, threshold, destinations=None,
+                      speed=1.0, stress_weights=None, workers=None,
+                      batch_size=256):
+        """
+        this function counts the destinations reached from every origin
+        within the budget, origins are searched in batches spread over a
+        process pool that holds one copy of the graph and destinations per
+        worker
+        :param origins: intersection ids of the origins, e.g. the
+            intersections nearest to every block
+        :param budget: largest cost, in the units of length / speed
+        :param threshold: highest stress taken
+        :param destinations: dictionary of intersection id to the number of
+            destinations there, every intersection counts 1 by default
+        :param speed: length travelled per unit of cost
+        :param stress_weights: dictionary of stress to cost multiplier
+        :param workers: number of processes, 1 searches in this process,
+            defaults to the number of cores
+        :param batch_size: number of origins per task
+        :return: tuple of (ndarray of destinations reached, ndarray of
+            intersections reached) in the order of origins
+        """
+        sources = self.nodes(np.atleast_1d(origins))
+        weights = np.ones(len(self.node_ids))
+        if destinations is not None:
+            weights[:] = 0
+            ids = np.fromiter(destinations.keys(), dtype=self.node_ids.dtype,
+                              count=len(destinations))
+            np.add.at(weights, self.nodes(ids),
+                      np.fromiter(destinations.values(), dtype=np.float64,
+                                  count=len(destinations)))
+        graph = (self.offsets, self.targets,
+                 self.costs(threshold, speed, stress_weights), weights)
+        batches = [sources[i:i + batch_size]
+                   for i in range(0, len(sources), batch_size)]
+        workers = workers or os.cpu_count()
+        if workers == 1 or len(batches) <= 1:
+            results = [_reach_batch(batch, budget, graph)
+                       for batch in batches]
+        else:
+            with ProcessPoolExecutor(workers, initializer=_set_graph,
+                                     initargs=graph) as executor:
+                results = list(executor.map(
+                    _reach_batch, batches, [budget] * len(batches)))
+        if not results:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        return np.concatenate([r[0] for r in results]), \
+            np.concatenate([r[1] for r in results])
@@ -0,0 +1,534 @@
+## checkpointed, resumable batch runner for LTS
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from cuuats.snt.lts.multi_batch import SEGMENT_COLUMNS
+from cuuats.snt.lts.parallel import BLTS_SCORES, PLTS_SCORES
+from cuuats.snt.lts.model.ApproachStore import ApproachStore
+from cuuats.snt.lts.model.SidewalkStore import SidewalkStore
+from cuuats.snt.lts import instrument
+
+SCORES = {'blts': BLTS_SCORES, 'plts': PLTS_SCORES}
+
+
+def _sync_directory(path):
+    # a rename is durable once its directory is synced, which not every
+    # platform allows
+    try:
+        fd = os.open(path or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_durably(path, write):
+    """
+    this function writes a file through a temporary file that is synced to
+    disk and renamed over path, so that path holds either its old or its
+    new content after a crash
+    :param path: file
+    :param write: function writing the content to a binary file object
+    """
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporary, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    _sync_directory(os.path.dirname(path))
+
+
+class SyntheticSource(object):
+    """
+    synthetic network generated one chunk at a time, chunk i is the
+    SyntheticNetwork of its size and seed offset by its first segment id
+    """
+    def __init__(self, size, chunk_size=50000, seed=0):
+        self.size = size
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.settings = {'source': 'synthetic', 'size': size, 'seed': seed}
+
+    def total(self):
+        return self.size
+
+    def chunks(self, start=0):
+        """
+        this function return the chunks from chunk start on
+        :param start: number of chunks skipped
+        :return: generator of (segment ids, segment columns, ApproachStore,
+            SidewalkStore)
+        """
+        from cuuats.snt.lts.synthetic import SyntheticNetwork
+        for offset in range(start * self.chunk_size, self.size,
+                            self.chunk_size):
+            network = SyntheticNetwork(
+                min(self.chunk_size, self.size - offset), self.seed, offset)
+            yield network.segment_ids, network.segments, \
+                network.approach_store(), network.sidewalk_store()
+
+
+class ParquetSource(object):
+    """
+    segments, approaches and sidewalks read from Parquet files by
+    ArrowReader, chunks follow the order of the segment file
+    """
+    def __init__(self, segments, approaches=None, sidewalks=None,
+                 id_column='segment_id', chunk_size=50000):
+        from cuuats.snt.lts.io_arrow import ArrowReader
+        self.reader = ArrowReader(segments, approaches, sidewalks, id_column,
+                                  chunk_size)
+        self.id_column = id_column
+        self.chunk_size = chunk_size
+        self.settings = {
+            'source': 'parquet',
+            'files': [os.path.abspath(p) if p else None
+                      for p in (segments, approaches, sidewalks)],
+            'rows': self.total(),
+            'id_column': id_column,
+        }
+
+    def total(self):
+        return self.reader._rows()
+
+    def chunks(self, start=0):
+        for columns, approaches, sidewalks in \
+                self.reader.iter_segment_chunks(start):
+            ids = np.asarray(columns.pop(self.id_column))
+            yield ids, columns, approaches, sidewalks
+
+
+class PostgisSource(object):
+    """
+    segments, approaches and sidewalks read from PostGIS by PostgisReader,
+    the segment query is ordered by the id column so that a resumed run
+    skips the completed chunks with OFFSET
+    """
+    def __init__(self, connection, segment_query, approach_query=None,
+                 sidewalk_query=None, id_column='segment_id',
+                 chunk_size=50000):
+        """
+        :param connection: psycopg2 connection, not in autocommit mode
+        :param segment_query: query returning one row per segment
+        :param approach_query: query returning approaches with id_column,
+            taking the chunk's segment ids as its only parameter
+        :param sidewalk_query: query returning sidewalks with id_column
+        :param id_column: name of the segment id column
+        :param chunk_size: number of segments per chunk
+        """
+        from cuuats.snt.lts.io_postgis import PostgisReader
+        from psycopg2 import sql
+        self.connection = connection
+        self.reader = PostgisReader(connection, chunk_size)
+        self.segment_query = segment_query
+        self.approach_query = approach_query
+        self.sidewalk_query = sidewalk_query
+        self.id_column = id_column
+        self.chunk_size = chunk_size
+        self._ordered = sql.SQL(
+            'SELECT * FROM ({}) AS segments ORDER BY {} OFFSET %s').format(
+                sql.SQL(segment_query), sql.Identifier(id_column))
+        self.settings = {
+            'source': 'postgis',
+            'queries': [segment_query, approach_query, sidewalk_query],
+            'id_column': id_column,
+        }
+
+    def total(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM (%s) AS segments'
+                           % self.segment_query)
+            return cursor.fetchone()[0]
+
+    def chunks(self, start=0):
+        for columns in self.reader.iter_chunks(
+                self._ordered, (start * self.chunk_size,)):
+            ids = columns.pop(self.id_column)
+            approaches, sidewalks = self.reader.read_groups(
+                ids, self.approach_query, self.sidewalk_query,
+                self.id_column)
+            yield np.asarray(ids.tolist()), columns, approaches, sidewalks
+
+
+class Checkpoint(object):
+    """
+    progress of a run kept in a directory, checkpoint.json names the run and
+    counts the completed chunks and chunk-NNNNNN.npz holds the scores of
+    each of them, a chunk file is synced before the count that covers it so
+    a crash loses at most the chunk being scored
+    """
+    def __init__(self, directory, settings, restart=False):
+        """
+        :param directory: checkpoint directory, created if needed
+        :param settings: dictionary describing the run, a checkpoint of
+            other settings is not resumed
+        :param restart: discard an existing checkpoint
+        """
+        self.directory = directory
+        self.path = os.path.join(directory, 'checkpoint.json')
+        os.makedirs(directory, exist_ok=True)
+        state = None
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                state = json.load(f)
+        if state is not None and state['settings'] != settings:
+            if not restart:
+                raise ValueError(
+                    '%s was written by a run of other settings, use a new '
+                    'directory or restart' % self.path)
+        if state is None or restart:
+            for name in os.listdir(directory):
+                if name.startswith('chunk-') and name.endswith('.npz'):
+                    os.remove(os.path.join(directory, name))
+            state = {'settings': settings, 'chunks': 0, 'rows': 0,
+                     'seconds': 0.0, 'complete': False}
+            self._save(state)
+        self.state = state
+
+    def _save(self, state):
+        write_durably(self.path, lambda f: f.write(
+            json.dumps(state, indent=2).encode()))
+
+    def _chunk_path(self, index):
+        return os.path.join(self.directory, 'chunk-%06d.npz' % index)
+
+    def save_chunk(self, index, ids, scores, invalid, seconds=0.0):
+        """
+        this function stores the scores of a chunk and counts it as done
+        :param index: chunk number, the next chunk of the run
+        :param ids: segment ids
+        :param scores: dictionary of score name to ndarray
+        :param invalid: boolean mask of segments that cannot be scored
+        :param seconds: time spent on the chunk
+        """
+        if index != self.state['chunks']:
+            raise ValueError('chunk %d is not the next chunk' % index)
+        arrays = dict(('score_' + name, np.asarray(values))
+                      for name, values in scores.items())
+        write_durably(self._chunk_path(index), lambda f: np.savez(
+            f, ids=np.asarray(ids), invalid=np.asarray(invalid), **arrays))
+        state = dict(self.state, chunks=index + 1,
+                     rows=self.state['rows'] + len(ids),
+                     seconds=self.state['seconds'] + seconds)
+        self._save(state)
+        self.state = state
+
+    def finish(self):
+        self.state = dict(self.state, complete=True)
+        self._save(self.state)
+
+    def iter_chunks(self):
+        """
+        this function reads back the completed chunks
+        :return: generator of (segment ids, dictionary of score name to
+            ndarray, invalid mask)
+        """
+        for index in range(self.state['chunks']):
+            with np.load(self._chunk_path(index)) as data:
+                scores = dict((name[6:], data[name]) for name in data.files
+                              if name.startswith('score_'))
+                yield data['ids'], scores, data['invalid']
+
+    def results(self):
+        """
+        this function return the scores of every completed chunk
+        :return: tuple of (segment ids, dictionary of score name to ndarray,
+            invalid mask) in chunk order
+        """
+        chunks = list(self.iter_chunks())
+        if not chunks:
+            return np.zeros(0, dtype=np.int64), {}, np.zeros(0, dtype=bool)
+        return np.concatenate([c[0] for c in chunks]), \
+            dict((name, np.concatenate([c[1][name] for c in chunks]))
+                 for name in chunks[0][1]), \
+            np.concatenate([c[2] for c in chunks])
+
+
+def score_chunk(mode, ids, columns, approaches=None, sidewalks=None,
+                workers=1, **options):
+    """
+    this function scores a chunk of segments, in this process with one
+    worker or else with a ParallelScorer
+    :param mode: 'blts' or 'plts'
+    :param ids: segment ids
+    :param columns: dictionary of segment columns, columns the mode does
+        not read are ignored
+    :param approaches: ApproachStore grouped by segment
+    :param sidewalks: SidewalkStore grouped by segment
+    :param workers: number of processes
+    :param options: passed to the scorer, e.g. turn_criteria
+    :return: tuple of (segment ids, dictionary of score name to ndarray,
+        invalid mask), ordered by id with several workers
+    """
+    size = len(ids)
+    columns = dict((name, values) for name, values in columns.items()
+                   if name in SEGMENT_COLUMNS[mode])
+    if approaches is None:
+        approaches = ApproachStore(np.zeros(size + 1), [])
+    if sidewalks is None and mode == 'plts':
+        sidewalks = SidewalkStore(np.zeros(size + 1), [])
+    if workers > 1 and size > 1:
+        from cuuats.snt.lts.parallel import ParallelScorer
+        result = ParallelScorer(mode, workers, -(-size // workers),
+                                **options).score(ids, columns, approaches,
+                                                 sidewalks)
+        return result.segment_ids, result.scores, result.invalid
+    if mode == 'blts':
+        from cuuats.snt.lts.blts_batch import BltsBatch
+        batch = BltsBatch(approaches=approaches, **dict(columns, **options))
+        batch.calculate_blts()
+    else:
+        from cuuats.snt.lts.plts_batch import PltsBatch
+        batch = PltsBatch(sidewalks=sidewalks, approaches=approaches,
+                          **columns)
+        batch.calculate_plts()
+    return np.asarray(ids), \
+        dict((name, getattr(batch, name)) for name in SCORES[mode]), \
+        batch.invalid
+
+
+class RunResult(object):
+    """
+    totals of a batch run, rows and seconds of this session and of the
+    whole run including the chunks of earlier sessions
+    """
+    def __init__(self, chunks, rows, resumed_chunks, resumed_rows, elapsed,
+                 total_seconds):
+        self.chunks = chunks
+        self.rows = rows
+        self.resumed_chunks = resumed_chunks
+        self.resumed_rows = resumed_rows
+        self.elapsed = elapsed
+        self.total_seconds = total_seconds
+
+    def report(self):
+        """
+        this function return a text summary of the run
+        :return: str
+        """
+        scored = self.rows - self.resumed_rows
+        lines = ['%d segments in %d chunks, %d segments scored in %.2f s '
+                 '(%.0f segments/s)' % (
+                     self.rows, self.chunks, scored, self.elapsed,
+                     scored / max(self.elapsed, 1e-9))]
+        if self.resumed_chunks:
+            lines.append('resumed after %d chunks, %d segments'
+                         % (self.resumed_chunks, self.resumed_rows))
+        return '\n'.join(lines)
+
+
+def _duration(seconds):
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60,
+                             seconds % 60)
+
+
+class BatchRunner(object):
+    """
+    scores a network in ordered chunks and checkpoints every chunk, a run
+    stopped at any point resumes after its last completed chunk with the
+    same source, mode, chunk size and criteria
+    """
+    def __init__(self, source, directory, mode='blts', workers=1,
+                 restart=False, progress=None, **options):
+        """
+        :param source: SyntheticSource, ParquetSource or PostgisSource
+        :param directory: checkpoint directory
+        :param mode: 'blts' or 'plts'
+        :param workers: number of processes scoring each chunk
+        :param restart: discard an existing checkpoint
+        :param progress: function called with a progress line after every
+            chunk
+        :param options: passed to the scorer, e.g. turn_criteria
+        """
+        from cuuats.snt.lts.cache import criteria_version
+        if mode not in SCORES:
+            raise ValueError('mode must be blts or plts')
+        self.source = source
+        self.mode = mode
+        self.workers = workers or os.cpu_count()
+        self.options = options
+        self.progress = progress
+        self.version = criteria_version()
+        settings = dict(source.settings, mode=mode,
+                        chunk_size=source.chunk_size, options=options,
+                        criteria=self.version)
+        self.checkpoint = Checkpoint(directory, settings, restart)
+
+    @instrument.stage('runner.run')
+    def run(self):
+        """
+        this function scores the chunks after the last completed one
+        :return: RunResult
+        """
+        began = time.time()
+        state = self.checkpoint.state
+        resumed_chunks = state['chunks']
+        resumed_rows = state['rows']
+        total = self.source.total() if self.progress else None
+        if resumed_chunks and self.progress:
+            self.progress('resuming after chunk %d, %d segments done'
+                          % (resumed_chunks, resumed_rows))
+        index = resumed_chunks
+        for ids, columns, approaches, sidewalks in \
+                self.source.chunks(resumed_chunks):
+            started = time.time()
+            ids, scores, invalid = score_chunk(
+                self.mode, ids, columns, approaches, sidewalks,
+                self.workers, **self.options)
+            self.checkpoint.save_chunk(index, ids, scores, invalid,
+                                       time.time() - started)
+            index += 1
+            if self.progress:
+                self.progress(self._progress(index, total, resumed_rows,
+                                             time.time() - began))
+        self.checkpoint.finish()
+        state = self.checkpoint.state
+        return RunResult(state['chunks'], state['rows'], resumed_chunks,
+                         resumed_rows, time.time() - began, state['seconds'])
+
+    def _progress(self, index, total, resumed_rows, elapsed):
+        rows = self.checkpoint.state['rows']
+        rate = (rows - resumed_rows) / max(elapsed, 1e-9)
+        line = 'chunk %d: %d' % (index, rows)
+        if total:
+            line += '/%d segments (%.1f%%)' % (total, 100.0 * rows / total)
+            line += ', eta %s' % _duration((total - rows) / max(rate, 1e-9))
+        else:
+            line += ' segments'
+        return '%s, %.0f segments/s' % (line, rate)
+
+    def write(self, path):
+        """
+        this function writes the scores of the run to a ScoreStore file, or
+        to a Parquet file when path ends in .parquet
+        :param path: output file
+        :return: int number of written rows
+        """
+        if path.endswith('.parquet'):
+            from cuuats.snt.lts.io_arrow import ArrowWriter
+            rows = 0
+            with ArrowWriter(path) as writer:
+                for ids, scores, invalid in self.checkpoint.iter_chunks():
+                    rows += writer.write_scores(ids, scores, invalid)
+            return rows
+        from cuuats.snt.lts.score_store import ScoreStore
+        ids, scores, invalid = self.checkpoint.results()
+        ScoreStore.write(path, ids, scores, invalid, SCORES[self.mode],
+                         self.version)
+        return len(ids)
+
+    def write_table(self, connection, table, id_column='segment_id'):
+        """
+        this function writes the scores of the run back to a PostGIS table
+        one chunk at a time, rewriting a chunk is harmless
+        :param connection: psycopg2 connection
+        :param table: name of the table to update, may be schema qualified
+        :param id_column: name of the id column of the table
+        :return: int number of updated rows
+        """
+        from cuuats.snt.lts.io_postgis import PostgisWriter
+        writer = PostgisWriter(connection)
+        rows = 0
+        for ids, scores, invalid in self.checkpoint.iter_chunks():
+            rows += writer.write_scores(table, id_column, ids, scores,
+                                        invalid)
+            connection.commit()
+        return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='score a network in checkpointed chunks, a stopped run '
+                    'resumes after its last completed chunk')
+    parser.add_argument('checkpoint', help='checkpoint directory')
+    parser.add_argument('--mode', choices=sorted(SCORES), default='blts')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--synthetic', type=int, metavar='SIZE',
+                        help='score a synthetic network of SIZE segments')
+    source.add_argument('--parquet', metavar='SEGMENTS',
+                        help='Parquet file of segments')
+    source.add_argument('--dsn', help='PostgreSQL connection string')
+    parser.add_argument('--approaches', help='Parquet file of approaches')
+    parser.add_argument('--sidewalks', help='Parquet file of sidewalks')
+    parser.add_argument('--segment-query')
+    parser.add_argument('--approach-query')
+    parser.add_argument('--sidewalk-query')
+    parser.add_argument('--id-column', default='segment_id')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes scoring each chunk, 0 for one per '
+                             'core')
+    parser.add_argument('--turn-criteria', type=int, default=10000)
+    parser.add_argument('--criteria', help='criteria file to load')
+    parser.add_argument('--output',
+                        help='write the scores to a score store, or to '
+                             'Parquet for a .parquet path')
+    parser.add_argument('--table',
+                        help='write the scores back to this PostGIS table')
+    parser.add_argument('--restart', action='store_true',
+                        help='discard the checkpoint and start over')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.criteria:
+        from cuuats.snt.lts.tables import TABLES
+        TABLES.load(args.criteria)
+    connection = None
+    if args.synthetic is not None:
+        source = SyntheticSource(args.synthetic, args.chunk_size, args.seed)
+    elif args.parquet:
+        source = ParquetSource(args.parquet, args.approaches, args.sidewalks,
+                               args.id_column, args.chunk_size)
+    else:
+        if not args.segment_query:
+            parser.error('--dsn needs --segment-query')
+        import psycopg2
+        connection = psycopg2.connect(args.dsn)
+        source = PostgisSource(connection, args.segment_query,
+                               args.approach_query, args.sidewalk_query,
+                               args.id_column, args.chunk_size)
+    if args.table and connection is None:
+        parser.error('--table needs --dsn')
+
+    def progress(line):
+        sys.stderr.write(line + '\n')
+        sys.stderr.flush()
+
+    options = {}
+    if args.mode == 'blts':
+        options['turn_criteria'] = args.turn_criteria
+    try:
+        runner = BatchRunner(source, args.checkpoint, args.mode,
+                             args.workers, args.restart,
+                             None if args.quiet else progress, **options)
+        result = runner.run()
+        if not args.quiet:
+            print(result.report())
+        if args.output:
+            runner.write(args.output)
+        if args.table:
+            runner.write_table(connection, args.table, args.id_column)
+    except ValueError as e:
+        sys.stderr.write('%s\n' % e)
+        return 2
+    except KeyboardInterrupt:
+        sys.stderr.write('interrupted, run again to resume\n')
+        return 130
+    finally:
+        if connection is not None:
+            connection.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+## scenario sweeps of LTS scores
+import itertools
+import numpy as np
+from cuuats.snt.lts.lts_batch import as_column, column_values
+from cuuats.snt.lts.blts_batch import BltsBatch
+from cuuats.snt.lts.cube import BltsCube, PltsCube, LaneAxis, get_cube
+from cuuats.snt.lts.model.LaneCodec import LaneFeatures
+from cuuats.snt.lts import instrument
+
+# segment values the batch scorers read a null of as 0
+NULL_AS_ZERO = ('segment.aadt',)
+
+# batch attribute of the store of each group
+STORES = {'approach': 'approaches', 'sidewalk': 'sidewalks'}
+
+
+def grid(**overrides):
+    """
+    this function return a scenario for every combination of override
+    values, e.g. grid(bicycle_facility_width=[5, 6, 7, 8],
+    parking_lane_width=[None, 8])
+    :param overrides: attribute to list of values
+    :return: list of dictionaries
+    """
+    names = sorted(overrides)
+    return [dict(zip(names, values)) for values in
+            itertools.product(*[overrides[name] for name in names])]
+
+
+class SweepResult(object):
+    """
+    scores of every scenario (rows) and segment (columns) with the baseline
+    scores of the unchanged segments, lower scores are less stressful
+    """
+    def __init__(self, scenarios, baseline, baseline_invalid, scores,
+                 invalid):
+        self.scenarios = scenarios
+        self.baseline = baseline
+        self.baseline_invalid = baseline_invalid
+        self.scores = scores
+        self.invalid = invalid
+
+    @property
+    def delta(self):
+        """
+        this function return the change of every score against the baseline,
+        masked where the scenario or the baseline cannot be scored
+        :return: masked ndarray of int16
+        """
+        return np.ma.array(
+            self.scores.astype(np.int16) - self.baseline,
+            mask=self.invalid | self.baseline_invalid)
+
+    def summary(self):
+        """
+        this function return the mean score and the number of segments
+        whose score went down (improved), up (worsened) or cannot be scored
+        in each scenario
+        :return: list of dictionaries
+        """
+        delta = self.delta
+        result = []
+        for i, scenario in enumerate(self.scenarios):
+            valid = ~self.invalid[i]
+            result.append({
+                'scenario': scenario,
+                'mean_score': float(self.scores[i][valid].mean())
+                if valid.any() else None,
+                'improved': int((delta[i] < 0).sum()),
+                'worsened': int((delta[i] > 0).sum()),
+                'invalid': int(self.invalid[i].sum()),
+            })
+        return result
+
+
+class ScenarioSweep(object):
+    """
+    scores scenarios of attribute overrides of a batch from the score cubes,
+    only the axes reading an overridden attribute are binned again and every
+    cube is looked up once for a chunk of scenarios, no per scenario batch or
+    object is built
+    """
+    def __init__(self, batch, cube=None, chunk_cells=1 << 24):
+        """
+        :param batch: BltsBatch or PltsBatch of the base segments
+        :param cube: BltsCube or PltsCube, compiled for the batch by default
+        :param chunk_cells: number of scenario rows times cube rows looked up
+            at once
+        """
+        self.batch = batch
+        if cube is None:
+            if isinstance(batch, BltsBatch):
+                cube = get_cube(BltsCube, batch.turn_criteria)
+            else:
+                cube = get_cube(PltsCube)
+        self.cube = cube
+        self.chunk_cells = chunk_cells
+
+    def _path(self, name):
+        path = name if '.' in name else 'segment.' + name
+        group, attribute = path.split('.', 1)
+        if group == 'approach' and (path == LaneAxis.path or
+                                    attribute in LaneFeatures._fields):
+            raise ValueError('%s is looked up from the lane configuration '
+                             'and cannot be overridden' % path)
+        columns = self.cube.source(
+            self.batch, None if group == 'segment' else group)[0]
+        if path not in columns:
+            raise ValueError('unknown attribute: %s' % name)
+        return path
+
+    def _column(self, path, value):
+        """
+        this function return the overridden column of the rows of the group
+        of the path, value is a constant or a function of the base column
+        """
+        group = path.split('.', 1)[0]
+        data, null = self.cube.source(
+            self.batch, None if group == 'segment' else group)[0][path]
+        numeric = data.dtype != object
+        if callable(value):
+            data, null = as_column(value(column_values(data, null)), numeric)
+        elif value is None:
+            data = np.zeros(len(data), dtype=data.dtype) if numeric else \
+                np.full(len(data), None, dtype=object)
+            null = np.ones(len(data), dtype=bool)
+        else:
+            data = np.full(len(data), float(value) if numeric else value,
+                           dtype=data.dtype)
+            null = np.zeros(len(data), dtype=bool)
+        if path in NULL_AS_ZERO:
+            data[null] = 0
+            null[:] = False
+        return data, null
+
+    def _cells(self, scenarios, base_codes):
+        """
+        this function looks up the cells of every part for a chunk of
+        scenarios, the codes of the axes no scenario overrides are shared
+        """
+        cells = {}
+        overrides = {}
+        for name, part in self.cube.parts.items():
+            codes = list(base_codes[name])
+            columns, lane_code = self.cube.source(self.batch, part.group)
+            index = None
+            if part.group is not None:
+                index = getattr(self.batch, STORES[part.group]).segment_index
+            for a, axis in enumerate(part.axes):
+                if axis is part.lanes:
+                    continue
+                paths = (axis.path,) if isinstance(axis.path, str) \
+                    else axis.path
+                if not any(path in s for s in scenarios for path in paths):
+                    continue
+                rows = np.empty((len(scenarios), len(codes[a])),
+                                dtype=np.intp)
+                for i, scenario in enumerate(scenarios):
+                    overridden = dict(columns)
+                    for path in paths:
+                        if path not in scenario:
+                            continue
+                        value = scenario[path]
+                        # constants are shared by the scenarios using them
+                        key = (i, path) if callable(value) else (path, value)
+                        if key not in overrides:
+                            overrides[key] = self._column(path, value)
+                        data, null = overrides[key]
+                        if index is not None and path.startswith('segment.'):
+                            data, null = data[index], null[index]
+                        overridden[path] = (data, null)
+                    rows[i] = axis.codes(overridden)
+                codes[a] = rows
+            cells[name] = part.cube[tuple(codes)]
+        return cells
+
+    @instrument.stage('scenario.run')
+    def run(self, scenarios):
+        """
+        this function scores every scenario
+        :param scenarios: list of dictionaries of attribute to a constant or
+            a function of the base column, e.g. grid(posted_speed=[25, 30])
+            or [{'posted_speed': lambda speed: speed - 5}], attributes
+            without a prefix are segment attributes
+        :return: SweepResult
+        """
+        if isinstance(scenarios, dict):
+            scenarios = grid(**scenarios)
+        resolved = [dict((self._path(name), value)
+                         for name, value in scenario.items())
+                    for scenario in scenarios]
+
+        base_codes = {}
+        rows = 1
+        for name in self.cube.parts:
+            part = self.cube.part(name)
+            columns, lane_code = self.cube.source(self.batch, part.group)
+            base_codes[name] = part.codes(columns, lane_code)
+            rows = max(rows, len(base_codes[name][0]))
+        baseline, baseline_invalid = self.cube.combine(
+            dict((name, part.cube[tuple(base_codes[name])])
+                 for name, part in self.cube.parts.items()), self.batch)
+
+        size = len(baseline)
+        scores = np.empty((len(resolved), size), dtype=np.int8)
+        invalid = np.empty((len(resolved), size), dtype=bool)
+        chunk = max(1, self.chunk_cells // rows)
+        for start in range(0, len(resolved), chunk):
+            stop = min(start + chunk, len(resolved))
+            score, error = self.cube.combine(
+                self._cells(resolved[start:stop], base_codes), self.batch)
+            scores[start:stop] = score
+            invalid[start:stop] = error
+        return SweepResult(scenarios, baseline, baseline_invalid, scores,
+                           invalid)
@@ -0,0 +1,229 @@
+## memory-mapped store of packed LTS scores
+import json
+import os
+import numpy as np
+
+MAGIC = b'LTSSCORE'
+
+# bits per score, scores run from 0 to 6 and NULL marks a missing score
+BITS = 3
+NULL = (1 << BITS) - 1
+
+# record types by the number of scores they hold
+_RECORDS = ((np.uint8, 2), (np.uint16, 5), (np.uint32, 10), (np.uint64, 21))
+
+_ALIGN = 64
+
+
+def _record_type(count):
+    for dtype, capacity in _RECORDS:
+        if count <= capacity:
+            return np.dtype(dtype)
+    raise ValueError('at most %d scores fit a record, got %d' %
+                     (_RECORDS[-1][1], count))
+
+
+def pack(scores, names, invalid=None):
+    """
+    this function packs the scores of every row into one fixed-width record
+    of 3 bits per score, the score of names[i] in bits 3i to 3i+2, masked
+    scores and the scores of invalid rows are stored as NULL
+    :param scores: dictionary of score name to array of int scores
+    :param names: score names in record order
+    :param invalid: boolean mask of rows whose scores are all NULL
+    :return: ndarray of records
+    """
+    dtype = _record_type(len(names))
+    size = len(scores[names[0]]) if names else 0
+    records = np.zeros(size, dtype=dtype)
+    for i, name in enumerate(names):
+        values = scores[name]
+        null = np.ma.getmaskarray(values)
+        values = np.asarray(np.ma.getdata(values), dtype=np.int64)
+        if len(values) != size:
+            raise ValueError('%s has %d rows, expected %d' %
+                             (name, len(values), size))
+        if ((values < 0) | (values >= NULL))[~null].any():
+            raise ValueError('%s has scores outside 0 to %d' %
+                             (name, NULL - 1))
+        values = np.where(null, NULL, values).astype(dtype)
+        records |= values << dtype.type(BITS * i)
+    if invalid is not None:
+        records[np.asarray(invalid, dtype=bool)] = \
+            dtype.type((1 << BITS * len(names)) - 1)
+    return records
+
+
+def unpack(records, names):
+    """
+    this function return the scores of packed records
+    :param records: ndarray of records
+    :param names: score names in record order
+    :return: dictionary of score name to masked ndarray of int8, masked
+        where the score is NULL
+    """
+    return dict((name, _unpack(records, i)) for i, name in enumerate(names))
+
+
+def _unpack(records, i):
+    values = ((records >> records.dtype.type(BITS * i)) &
+              records.dtype.type(NULL)).astype(np.int8)
+    return np.ma.array(values, mask=values == NULL)
+
+
+class ScoreStore(object):
+    """
+    read-only file of the packed scores of every segment sorted by segment
+    id, the ids and records are memory mapped so that opening a store reads
+    only its header, lookups are binary searches of the ids and processes
+    opening the same file share its pages
+    """
+    def __init__(self, path):
+        """
+        :param path: file written by ScoreStore.write
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('%s is not a score store' % path)
+            length = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+            header = json.loads(f.read(length).decode())
+        self.names = header['names']
+        self.count = header['count']
+        self.version = header.get('version')
+        offset = header['offset']
+        id_type = np.dtype(header['id_type'])
+        record_type = np.dtype(header['record_type'])
+        if self.count:
+            self.ids = np.memmap(path, dtype=id_type, mode='r',
+                                 offset=offset, shape=(self.count,))
+            self.records = np.memmap(
+                path, dtype=record_type, mode='r',
+                offset=offset + self.count * id_type.itemsize,
+                shape=(self.count,))
+        else:
+            self.ids = np.zeros(0, dtype=id_type)
+            self.records = np.zeros(0, dtype=record_type)
+
+    @classmethod
+    def write(cls, path, ids, scores, invalid=None, names=None,
+              version=None):
+        """
+        this function writes a store, replacing path only once it is
+        complete
+        :param path: file
+        :param ids: integer ids of the scored segments, without duplicates
+        :param scores: dictionary of score name to array of int scores, e.g.
+            batch_scores(batch)
+        :param invalid: boolean mask of segments that cannot be scored
+        :param names: score names in record order, the keys of scores by
+            default
+        :param version: criteria version stored in the header
+        :return: ScoreStore
+        """
+        names = list(scores) if names is None else list(names)
+        ids = np.asarray(ids)
+        if ids.dtype.kind not in 'iu':
+            raise ValueError('segment ids must be integers')
+        order = np.argsort(ids, kind='stable')
+        ids = ids[order].astype(ids.dtype.newbyteorder('<'))
+        if len(ids) and (ids[1:] == ids[:-1]).any():
+            raise ValueError('segment ids are not unique')
+        records = pack(scores, names, invalid)[order]
+        records = records.astype(records.dtype.newbyteorder('<'))
+
+        header = {
+            'names': names,
+            'count': len(ids),
+            'version': version,
+            'id_type': ids.dtype.str,
+            'record_type': records.dtype.str,
+        }
+        # the offset is part of the header, so it is sized with a guess
+        header['offset'] = 0
+        size = len(MAGIC) + 8 + len(json.dumps(header)) + 32
+        header['offset'] = -(-size // _ALIGN) * _ALIGN
+        encoded = json.dumps(header).encode()
+
+        temporary = '%s.%d.tmp' % (path, os.getpid())
+        with open(temporary, 'wb') as f:
+            f.write(MAGIC)
+            f.write(np.array([len(encoded)], dtype='<u8').tobytes())
+            f.write(encoded)
+            f.write(b'\0' * (header['offset'] - f.tell()))
+            f.write(ids.tobytes())
+            f.write(records.tobytes())
+        os.replace(temporary, path)
+        return cls(path)
+
+    def __len__(self):
+        return self.count
+
+    def _rows(self, segment_ids):
+        segment_ids = np.asarray(segment_ids)
+        rows = np.searchsorted(self.ids, segment_ids)
+        rows = np.minimum(rows, max(self.count - 1, 0))
+        found = self.ids[rows] == segment_ids if self.count else \
+            np.zeros(segment_ids.shape, dtype=bool)
+        return rows, found
+
+    def __contains__(self, segment_id):
+        return bool(self._rows([segment_id])[1][0])
+
+    def get(self, segment_id):
+        """
+        this function return the scores of a segment
+        :param segment_id: id of the segment
+        :return: dictionary of score name to int score or None, None when the
+            segment is not in the store
+        """
+        row = int(np.searchsorted(self.ids, segment_id))
+        if row == self.count or self.ids[row] != segment_id:
+            return None
+        record = int(self.records[row])
+        result = {}
+        for name in self.names:
+            value = record & NULL
+            result[name] = None if value == NULL else value
+            record >>= BITS
+        return result
+
+    def lookup(self, segment_ids):
+        """
+        this function return the scores of many segments
+        :param segment_ids: ids of the segments
+        :return: dictionary of score name to masked ndarray of int8, masked
+            where the score is NULL or the segment is not in the store
+        """
+        rows, found = self._rows(segment_ids)
+        if self.count:
+            records = np.asarray(self.records[rows])
+        else:
+            # an empty store has no row to clamp to, every score is masked
+            records = np.zeros(rows.shape, dtype=self.records.dtype)
+        scores = unpack(records, self.names)
+        for values in scores.values():
+            values[~found] = np.ma.masked
+        return scores
+
+    def column(self, name):
+        """
+        this function return a score of every segment in id order
+        :param name: score name
+        :return: masked ndarray of int8
+        """
+        return _unpack(np.asarray(self.records), self.names.index(name))
+
+    def close(self):
+        """
+        this function releases the memory maps
+        """
+        self.ids = None
+        self.records = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,391 @@
+## local HTTP scoring service for LTS
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+from cuuats.snt.lts.model.Segment import Segment
+from cuuats.snt.lts.parallel import BLTS_SCORES, PLTS_SCORES
+from cuuats.snt.lts.tables import TABLES
+
+MODES = ('blts', 'plts')
+
+SCORES = {'blts': BLTS_SCORES, 'plts': PLTS_SCORES}
+
+# fields of the JSON payloads, as the keyword arguments of the stores
+SEGMENT_FIELDS = tuple(name for name, kind in Segment.FIELDS)
+APPROACH_FIELDS = ('lane_configuration', 'right_turn_lane_length',
+                   'bike_lane_approach', 'median_present', 'control_type')
+SIDEWALK_FIELDS = ('sidewalk_width', 'buffer_type', 'buffer_width',
+                   'sidewalk_score', 'overall_landuse')
+
+
+def _column(rows, name):
+    values = np.empty(len(rows), dtype=object)
+    values[:] = [row.get(name) for row in rows]
+    return values
+
+
+def _rows(payloads, key, fields):
+    rows = []
+    offsets = [0]
+    for payload in payloads:
+        for row in payload.get(key) or []:
+            if not isinstance(row, dict):
+                raise ValueError('%s must be a list of objects' % key)
+            unknown = set(row) - set(fields)
+            if unknown:
+                raise ValueError('unknown %s field: %s'
+                                 % (key, ', '.join(sorted(unknown))))
+            rows.append(row)
+        offsets.append(len(rows))
+    return offsets, dict((name, _column(rows, name)) for name in fields)
+
+
+def check_payload(payload):
+    """
+    this function checks the shape of a segment payload before it is queued
+    :param payload: dictionary with a segment object and optional lists of
+        approach and sidewalk objects
+    """
+    if not isinstance(payload, dict) or \
+            not isinstance(payload.get('segment'), dict):
+        raise ValueError('a payload must have a segment object')
+    unknown = set(payload) - set(('segment', 'approaches', 'sidewalks'))
+    if unknown:
+        raise ValueError('unknown payload key: %s'
+                         % ', '.join(sorted(unknown)))
+    unknown = set(payload['segment']) - set(SEGMENT_FIELDS)
+    if unknown:
+        raise ValueError('unknown segment field: %s'
+                         % ', '.join(sorted(unknown)))
+    for key in ('approaches', 'sidewalks'):
+        if not isinstance(payload.get(key) or [], list):
+            raise ValueError('%s must be a list' % key)
+
+
+def score_payloads(payloads, modes=MODES):
+    """
+    this function scores segment payloads in one MultiBatch, the payloads
+    are read into columns directly without building Segment, Approach or
+    Sidewalk objects
+    :param payloads: list of dictionaries with a segment object and
+        optional lists of approach and sidewalk objects
+    :param modes: modes to score
+    :return: list of dictionaries of mode to the scores of that mode and
+        whether the segment is invalid
+    """
+    from cuuats.snt.lts.multi_batch import MultiBatch
+    from cuuats.snt.lts.model.ApproachStore import ApproachStore
+    from cuuats.snt.lts.model.SidewalkStore import SidewalkStore
+    segments = [payload['segment'] for payload in payloads]
+    offsets, columns = _rows(payloads, 'approaches', APPROACH_FIELDS)
+    approaches = ApproachStore(offsets, **columns)
+    offsets, columns = _rows(payloads, 'sidewalks', SIDEWALK_FIELDS)
+    sidewalks = SidewalkStore(offsets, **columns)
+    batch = MultiBatch(approaches=approaches, sidewalks=sidewalks,
+                       modes=modes, **dict((name, _column(segments, name))
+                                           for name in SEGMENT_FIELDS))
+    batch.calculate()
+    results = [{} for payload in payloads]
+    for mode in modes:
+        scorer = getattr(batch, mode)
+        columns = [(name, getattr(scorer, name).tolist())
+                   for name in SCORES[mode]]
+        invalid = scorer.invalid.tolist()
+        for i, result in enumerate(results):
+            scores = dict((name, int(values[i])) for name, values in columns)
+            scores['invalid'] = invalid[i]
+            result[mode] = scores
+    return results
+
+
+class Latencies(object):
+    """
+    latencies of the most recent requests of an endpoint kept in a ring
+    """
+    def __init__(self, size=10000):
+        self.samples = [0.0] * size
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.samples[self.count % len(self.samples)] = seconds
+            self.count += 1
+
+    def percentiles(self, points=(50, 90, 99)):
+        """
+        this function return the latency percentiles of the kept requests
+        :param points: percentiles
+        :return: dictionary of 'p50' etc to milliseconds, None before the
+            first request
+        """
+        with self._lock:
+            samples = sorted(self.samples[:min(self.count,
+                                               len(self.samples))])
+        if not samples:
+            return dict(('p%d' % p, None) for p in points)
+        return dict(('p%d' % p, round(1000 * samples[min(
+            len(samples) - 1, int(len(samples) * p / 100.0))], 3))
+            for p in points)
+
+
+class Coalescer(object):
+    """
+    one scoring thread fed by a queue, requests arriving within a short
+    window of the first waiting one are scored together in one batch per
+    set of modes, a batch that fails is scored again one request at a time
+    so that a bad payload only fails its own request
+    """
+    def __init__(self, score=score_payloads, window=0.005, max_batch=4096):
+        """
+        :param score: function scoring a list of payloads for some modes
+        :param window: seconds a batch waits for more requests
+        :param max_batch: number of payloads that closes a batch early
+        """
+        self.score = score
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.payloads = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, payloads, modes=MODES):
+        """
+        this function queues payloads for scoring
+        :param payloads: list of payloads
+        :param modes: modes to score
+        :return: Future of the list of results
+        """
+        future = Future()
+        self._queue.put((payloads, tuple(modes), future))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            items = [item]
+            size = len(item[0])
+            deadline = time.perf_counter() + self.window
+            while size < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                items.append(item)
+                size += len(item[0])
+            groups = {}
+            for item in items:
+                groups.setdefault(item[1], []).append(item)
+            for modes, group in groups.items():
+                self._score(modes, group)
+
+    def _score(self, modes, items):
+        payloads = [p for item in items for p in item[0]]
+        self.batches += 1
+        self.payloads += len(payloads)
+        try:
+            results = self.score(payloads, modes) if payloads else []
+        except Exception:
+            if len(items) == 1:
+                items[0][2].set_exception(sys.exc_info()[1])
+                return
+            for item in items:
+                self._score(modes, [item])
+            return
+        start = 0
+        for payloads, modes, future in items:
+            future.set_result(results[start:start + len(payloads)])
+            start += len(payloads)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service = None
+
+    def log_message(self, format, *args):
+        if self.service.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._send(200, {'status': 'ok', 'criteria': TABLES.version})
+        elif path == '/stats':
+            self._send(200, self.service.stats())
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        url = urlparse(self.path)
+        if url.path not in ('/score', '/score/batch'):
+            self._send(404, {'error': 'not found'})
+            return
+        try:
+            modes = parse_qs(url.query).get('modes', [','.join(MODES)])
+            modes = tuple(m for m in modes[0].split(',') if m)
+            for mode in modes:
+                if mode not in MODES:
+                    raise ValueError('unknown mode: %s' % mode)
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length).decode('utf-8'))
+            if url.path == '/score':
+                payloads = [body]
+            elif isinstance(body, dict) and 'features' in body:
+                payloads = body['features']
+            else:
+                payloads = body
+            if not isinstance(payloads, list):
+                raise ValueError('a batch must be a list of payloads')
+            for payload in payloads:
+                check_payload(payload)
+            results = self.service.coalescer.submit(payloads,
+                                                    modes).result()
+        except (ValueError, TypeError, AssertionError) as e:
+            status, body = 400, {'error': str(e)}
+        except Exception as e:
+            status, body = 500, {'error': '%s: %s' % (type(e).__name__, e)}
+        else:
+            status = 200
+            body = results[0] if url.path == '/score' else \
+                {'results': results}
+        # recorded before the response is written, so that a client seeing
+        # its response also sees it counted
+        self.service.latencies[url.path].record(time.perf_counter() - start)
+        self._send(status, body)
+
+
+class _Server(ThreadingHTTPServer):
+    # many map clients connect at once while a batch is scored
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class ScoringService(object):
+    """
+    long running HTTP service scoring JSON segment payloads, the criteria
+    tables are loaded and the scorers warmed up once at start, requests are
+    served on threads and coalesced into batches, it listens on localhost
+    by default
+    """
+    def __init__(self, host='127.0.0.1', port=8080, window=0.005,
+                 max_batch=4096, criteria=None, verbose=False):
+        """
+        :param host: address to listen on
+        :param port: port to listen on, 0 picks a free port
+        :param window: seconds a batch waits for more requests
+        :param max_batch: number of payloads that closes a batch early
+        :param criteria: criteria file to load, see tables.TABLES
+        :param verbose: log every request to stderr
+        """
+        if criteria is not None:
+            TABLES.load(criteria)
+        # the first batch pays for the imports and the table lookups
+        score_payloads([{'segment': {}}])
+        self.verbose = verbose
+        self.coalescer = Coalescer(window=window, max_batch=max_batch)
+        self.latencies = {'/score': Latencies(), '/score/batch': Latencies()}
+        self.started = time.time()
+        handler = type('Handler', (_Handler,), {'service': self})
+        self.server = _Server((host, port), handler)
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.server.server_address[:2]
+
+    def stats(self):
+        """
+        this function return the request counts and latency percentiles of
+        every endpoint and the number of batches scored
+        :return: dictionary
+        """
+        endpoints = dict((path, dict(requests=latencies.count,
+                                     latency_ms=latencies.percentiles()))
+                         for path, latencies in self.latencies.items())
+        batches = self.coalescer.batches
+        return {'uptime_s': round(time.time() - self.started, 3),
+                'criteria': TABLES.version,
+                'endpoints': endpoints,
+                'batches': batches,
+                'payloads': self.coalescer.payloads,
+                'payloads_per_batch': round(
+                    self.coalescer.payloads / float(batches), 2)
+                if batches else None}
+
+    def start(self):
+        """
+        this function serves requests on a background thread
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        if self._thread is not None:
+            self.server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server.server_close()
+        self.coalescer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='serve BLTS and PLTS scores of JSON segment payloads')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--window-ms', type=float, default=5.0,
+                        help='milliseconds a batch waits for more requests')
+    parser.add_argument('--max-batch', type=int, default=4096)
+    parser.add_argument('--criteria', help='criteria file to load')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    service = ScoringService(args.host, args.port, args.window_ms / 1000.0,
+                             args.max_batch, args.criteria, args.verbose)
+    print('serving on http://%s:%d' % service.address)
+    sys.stdout.flush()
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.server.server_close()
+        service.coalescer.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
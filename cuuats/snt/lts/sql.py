@@ -0,0 +1,428 @@
+## SQL generator of the BLTS and PLTS criteria tables for PostGIS
+import numpy as np
+from cuuats.snt.lts import blts_postgis as b
+from cuuats.snt.lts import plts_postgis as p
+from cuuats.snt.lts.tables import TABLES as c
+from cuuats.snt.lts.criteria import ANY, Bins, Members, Predicates
+from cuuats.snt.lts.parallel import BLTS_SCORES, PLTS_SCORES
+
+# value paths computed in the generated query rather than read from a column,
+# lane features are computed from the lane configuration as in LaneCodec
+SEGMENT_VALUES = {
+    # Segment stores a missing aadt as 0
+    'segment.aadt': 'COALESCE(segment.aadt, 0)',
+}
+
+APPROACH_VALUES = dict(
+    ('approach.' + name, 'approach.lts_' + name)
+    for name in ('lanes_crossed', 'max_lane', 'total_lanes', 'has_right',
+                 'has_shared_right', 'has_left', 'has_dual_left'))
+# lanes crossed by a PLTS crossing
+APPROACH_VALUES['total_lanes_crossed'] = 'approach.lts_total_lanes_crossed'
+
+SIDEWALK_VALUES = {
+    'sidewalk.sidewalk_condition': 'sidewalk.lts_sidewalk_condition',
+}
+
+
+def literal(value):
+    """
+    this function return the SQL literal of a criteria operand
+    :param value: None, bool, number or str
+    :return: str
+    """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (bool, np.bool_)):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return repr(value.item() if isinstance(value, np.generic) else value)
+    return "'%s'" % str(value).replace("'", "''")
+
+
+def identifier(name):
+    """
+    this function quotes a possibly schema qualified name, a parenthesized
+    query is returned as it is
+    :param name: table name or (query)
+    :return: str
+    """
+    if name.lstrip().startswith('('):
+        return name
+    return '.'.join('"%s"' % part.replace('"', '""')
+                    for part in name.split('.'))
+
+
+def value_sql(value, values):
+    """
+    this function return the SQL expression of a value path, or the sum of a
+    tuple of paths
+    :param value: dotted value path, e.g. 'segment.aadt', or tuple of paths
+    :param values: dictionary of value path to SQL expression, paths not in
+        it are read from the column of the same name
+    :return: str
+    """
+    if isinstance(value, str):
+        return values.get(value, value)
+    return '(%s)' % ' + '.join(value_sql(v, values) for v in value)
+
+
+def compare_sql(op, expr, operand):
+    """
+    this function return the SQL comparison of an expression against a
+    criteria operand, the comparison is NULL or false for a NULL expression
+    unless the operand includes None
+    :return: str
+    """
+    if op == 'in':
+        members = [o for o in operand if o is not None]
+        test = '%s IN (%s)' % (expr, ', '.join(literal(m) for m in members)) \
+            if members else 'FALSE'
+        if None in operand:
+            test = '(%s OR %s IS NULL)' % (test, expr)
+        return test
+    if op == 'contains':
+        return 'strpos(%s, %s) > 0' % (expr, literal(operand))
+    if op == '==':
+        if operand is None:
+            return '%s IS NULL' % expr
+        return '%s = %s' % (expr, literal(operand))
+    if op in ('<', '<=', '>=', '>'):
+        return '%s %s %s' % (expr, op, literal(operand))
+    raise ValueError('unknown operator: %s' % op)
+
+
+def _case(whens, default=None):
+    return 'CASE %s ELSE %s END' % (
+        ' '.join('WHEN %s THEN %s' % w for w in whens), literal(default))
+
+
+def criterion_sql(criterion, values):
+    """
+    this function compiles a criteria axis into a CASE expression of the
+    index of the first true condition, NULL where no condition is true or a
+    missing value cannot be compared, as criterion_indices does
+    :param criterion: Bins, Members or Predicates
+    :param values: dictionary of value path to SQL expression
+    :return: str
+    """
+    if isinstance(criterion, Predicates):
+        return _predicates_sql(criterion, values)
+    if not isinstance(criterion, (Bins, Members)):
+        raise TypeError('unknown criterion: %s' % type(criterion).__name__)
+
+    expr = value_sql(criterion.value, values)
+    if isinstance(criterion, Bins):
+        none = None if criterion.none_error is not None \
+            else criterion.none_index
+    else:
+        none = criterion.lookup.get(None, criterion.default)
+    whens = [('%s IS NULL' % expr, literal(none))]
+    default = None
+    for index, condition in enumerate(criterion.conditions):
+        if condition is ANY:
+            default = index
+            break
+        if isinstance(criterion, Bins):
+            whens.append((compare_sql(condition[0], expr, condition[1]),
+                          index))
+            continue
+        members = condition if isinstance(condition, tuple) \
+            else (condition,)
+        members = [m for m in members if m is not None]
+        if members:
+            whens.append((compare_sql('in', expr, members), index))
+    return _case(whens, default)
+
+
+def _predicates_sql(predicates, values):
+    whens = []
+    default = None
+    for index, condition in enumerate(predicates.conditions):
+        if condition is ANY:
+            default = index
+            break
+        tests = []
+        for value, op, operand in condition:
+            expr = value_sql(value, values)
+            if op not in ('==', 'in'):
+                # a missing value ends the search unmatched
+                whens.append((' AND '.join(
+                    tests + ['%s IS NULL' % expr]), 'NULL'))
+            tests.append(compare_sql(op, expr, operand))
+        whens.append((' AND '.join(tests), index))
+    return _case(whens, default)
+
+
+def lookup_sql(scores, criteria, values):
+    """
+    this function compiles a criteria table into an expression of the score
+    of its cell, NULL where an axis is NULL, as lookup flags invalid rows
+    :param scores: nested list of scores
+    :param criteria: CriteriaTable
+    :param values: dictionary of value path to SQL expression
+    :return: str
+    """
+    scores = np.asarray(scores, dtype=np.int8)
+    assert scores.shape == tuple(len(x) for x in criteria.criteria)
+    strides = np.cumprod((scores.shape + (1,))[:0:-1])[::-1]
+    index = ' + '.join(
+        '(%s) * %d' % (criterion_sql(criterion, values), stride)
+        if stride != 1 else '(%s)' % criterion_sql(criterion, values)
+        for criterion, stride in zip(criteria.criteria, strides))
+    return '(ARRAY[%s]::smallint[])[%s + 1]' % (
+        ', '.join(str(s) for s in scores.ravel()), index)
+
+
+def lane_features_sql(config):
+    """
+    this function return the SQL expressions of the LaneFeatures of a lane
+    configuration, as parse_lane_configuration computes them
+    :param config: SQL expression of the lane configuration
+    :return: dictionary of feature name to SQL expression
+    """
+    length = 'length(%s)' % config
+    found = "strpos(reverse(%s), 'X')" % config
+    # 1-based position of the last X, 0 without one
+    last = 'CASE %s WHEN 0 THEN 0 ELSE %s - %s + 1 END' % (
+        found, length, found)
+    first = "strpos(%s, 'X')" % config
+    away = 'CASE %s WHEN 0 THEN 0 ELSE %s - %s + 1 END' % (first, last, first)
+
+    def has(code):
+        return "COALESCE(strpos(%s, '%s') > 0, FALSE)" % (config, code)
+    return {
+        'lanes_crossed': "CASE WHEN %s IS NULL OR %s IN ('X', 'XX', 'XXX') "
+                         "THEN 0 ELSE %s - %s - 1 END" % (
+                             config, config, length, last),
+        'max_lane': 'CASE WHEN %s IS NULL THEN 1 ELSE GREATEST(%s, %s - %s) '
+                    'END' % (config, away, length, last),
+        'total_lanes': length,
+        'has_right': has('R'),
+        'has_shared_right': has('Q'),
+        'has_left': has('L'),
+        'has_dual_left': has('K'),
+    }
+
+
+def _approaches_sql(approaches, id_column, extra=()):
+    """
+    this function return the approaches of the current segment with their
+    lane features under the approach alias
+    """
+    features = lane_features_sql('a.lane_configuration')
+    columns = ['a.*'] + ['%s AS lts_%s' % (expr, name)
+                         for name, expr in features.items()]
+    columns += ['%s AS lts_%s' % (expr, name) for name, expr in extra]
+    return '(SELECT %s FROM %s AS a WHERE a.%s = segment.%s) AS approach' % (
+        ', '.join(columns), identifier(approaches), identifier(id_column),
+        identifier(id_column))
+
+
+def _scored(cells, relation, aggregate):
+    """
+    this function return the subquery scoring every row of a relation into
+    cells, a cell is NULL on rows the criteria flag invalid, together with
+    the maximum of every cell and whether any row is invalid
+    """
+    columns = ['COALESCE(MAX(%s), 0) AS %s' % (name, name)
+               for name, expr in cells if name in aggregate]
+    columns.append('COALESCE(bool_or(%s), FALSE) AS invalid' % ' OR '.join(
+        '%s IS NULL' % name for name, expr in cells))
+    return '(SELECT %s FROM (SELECT %s FROM %s) AS cells)' % (
+        ', '.join(columns),
+        ', '.join('%s AS %s' % (expr, name) for name, expr in cells),
+        relation)
+
+
+def _where(condition, score):
+    return 'CASE WHEN %s THEN %s ELSE 0 END' % (condition, score)
+
+
+def _min_nonzero(*names):
+    return 'COALESCE(LEAST(%s), 0)' % ', '.join(
+        'NULLIF(%s, 0)' % n for n in names)
+
+
+def blts_query(segments, approaches, id_column='segment_id',
+               turn_criteria=10000):
+    """
+    this function generates a query scoring BLTS on the server, with the
+    sub-scores and invalid flags of BltsBatch, each segment's approaches are
+    scored in a lateral subquery so filters on the segments and an index on
+    the approach id column are used
+    :param segments: table or (query) with one row per segment, columns are
+        named after the Segment attributes
+    :param approaches: table or (query) of approaches keyed by id_column,
+        columns are named after the Approach attributes
+    :param id_column: name of the segment id column
+    :param turn_criteria: aadt above which turn lanes are scored
+    :return: str query returning id_column, BLTS_SCORES and invalid
+    """
+    values = dict(SEGMENT_VALUES, **APPROACH_VALUES)
+    one_lane = '(segment.lanes_per_direction IS NULL OR ' \
+        'segment.lanes_per_direction = 1)'
+    segment_cells = [
+        ('bike_lane_with_adj_parking_score', _where(
+            'segment.bicycle_facility_width IS NOT NULL AND '
+            'segment.parking_lane_width IS NOT NULL',
+            'CASE WHEN %s THEN %s ELSE %s END' % (
+                one_lane,
+                lookup_sql(c.BL_ADJ_PK_TABLE_ONE_LANE,
+                           b.BL_ADJ_PK_CRITERIA_ONE_LANE, values),
+                lookup_sql(c.BL_ADJ_PK_TABLE_TWO_LANES,
+                           b.BL_ADJ_PK_CRITERIA_TWO_LANES, values)))),
+        ('bike_lane_without_adj_parking_score', _where(
+            'segment.bicycle_facility_width IS NOT NULL',
+            'CASE WHEN %s THEN %s ELSE %s END' % (
+                one_lane,
+                lookup_sql(c.BL_NO_ADJ_PK_TABLE_ONE_LANE,
+                           b.BL_NO_ADJ_PK_CRITERIA_ONE_LANE, values),
+                lookup_sql(c.BL_NO_ADJ_PK_TABLE_TWO_LANES,
+                           b.BL_NO_ADJ_PK_CRITERIA_TWO_LANES, values)))),
+        ('mix_traffic_score', lookup_sql(
+            c.MIXED_TRAF_TABLE, b.MIXED_TRAF_CRITERIA, values)),
+    ]
+
+    turn = '%s > %s AND approach.lane_configuration IS NOT NULL AND ' \
+        'segment.functional_class IS NOT NULL' % (
+            values['segment.aadt'], literal(turn_criteria))
+    dual = '(approach.lts_has_left OR approach.lts_has_dual_left)'
+    configured = 'approach.lane_configuration IS NOT NULL'
+    median = "COALESCE(approach.median_present, FALSE) AND " \
+        "approach.control_type IS DISTINCT FROM 'signalized'"
+    approach_cells = [
+        ('right_turn_lane_score', _where(
+            '%s AND (approach.lts_has_right OR '
+            'approach.lts_has_shared_right)' % turn,
+            lookup_sql(c.RTL_CRIT_TABLE, b.RTL_CRITERIA, values))),
+        # dual and shared left turn lanes are validated but do not count
+        ('dual_shared_left_turn_lane_score', _where(
+            '%s AND %s' % (turn, dual),
+            lookup_sql(c.LTL_DUAL_SHARED_TABLE, b.LTL_DUAL_SHARED_CRITERIA,
+                       values))),
+        ('left_turn_lane_score', _where(
+            '%s AND NOT %s' % (turn, dual),
+            lookup_sql(c.LTL_CRIT_TABLE, b.LTL_CRITERIA, values))),
+        ('crossing_with_median_score', _where(
+            '%s AND %s' % (configured, median),
+            lookup_sql(c.CROSSING_HAS_MED_TABLE, b.CROSSING_HAS_MED_CRITERIA,
+                       values))),
+        ('crossing_without_median_score', _where(
+            '%s AND NOT (%s)' % (configured, median),
+            lookup_sql(c.CROSSING_NO_MED_TABLE, b.CROSSING_NO_MED_CRITERIA,
+                       values))),
+    ]
+
+    segment_names = [name for name, expr in segment_cells]
+    approach_names = ['right_turn_lane_score', 'left_turn_lane_score',
+                      'crossing_with_median_score',
+                      'crossing_without_median_score']
+    scores = dict((n, 'COALESCE(s.%s, 0)' % n) for n in segment_names)
+    scores['segment_score'] = _min_nonzero(*[scores[n]
+                                             for n in segment_names])
+    for name in approach_names:
+        scores[name] = 'a.%s' % name
+    scores['blts_score'] = 'GREATEST(%s)' % ', '.join(
+        scores[n] for n in approach_names + ['segment_score'])
+    invalid = '(%s OR a.invalid)' % ' OR '.join(
+        's.%s IS NULL' % n for n in segment_names)
+
+    return 'SELECT segment.%s, %s, %s AS invalid FROM %s AS segment ' \
+        'CROSS JOIN LATERAL (SELECT %s) AS s ' \
+        'CROSS JOIN LATERAL %s AS a' % (
+            identifier(id_column),
+            ', '.join('%s AS %s' % (scores[n], n) for n in BLTS_SCORES),
+            invalid, identifier(segments),
+            ', '.join('%s AS %s' % (expr, name)
+                      for name, expr in segment_cells),
+            _scored(approach_cells, _approaches_sql(approaches, id_column),
+                    approach_names))
+
+
+def plts_query(segments, sidewalks, approaches, id_column='segment_id'):
+    """
+    this function generates a query scoring PLTS on the server, with the
+    sub-scores and invalid flags of PltsBatch, the sidewalks and approaches
+    of each segment are scored in lateral subqueries
+    :param segments: table or (query) with one row per segment, columns are
+        named after the Segment attributes
+    :param sidewalks: table or (query) of sidewalks keyed by id_column,
+        columns are named after the Sidewalk attributes
+    :param approaches: table or (query) of approaches keyed by id_column
+    :param id_column: name of the segment id column
+    :return: str query returning id_column, PLTS_SCORES and invalid
+    """
+    values = dict(SEGMENT_VALUES, **APPROACH_VALUES)
+    values.update(SIDEWALK_VALUES)
+    condition = "CASE WHEN w.sidewalk_score IS NULL THEN NULL " \
+        "WHEN w.sidewalk_score > 70 THEN 'Good' " \
+        "WHEN w.sidewalk_score > 60 THEN 'Fair' " \
+        "WHEN w.sidewalk_score > 50 THEN 'Poor' ELSE 'Very Poor' END"
+    sidewalk_relation = '(SELECT w.*, %s AS lts_sidewalk_condition ' \
+        'FROM %s AS w WHERE w.%s = segment.%s) AS sidewalk' % (
+            condition, identifier(sidewalks), identifier(id_column),
+            identifier(id_column))
+    sidewalk_cells = [
+        ('condition_score', lookup_sql(
+            c.SW_COND_TABLE, p.SW_COND_CRITERIA, values)),
+        ('physical_buffer_score', lookup_sql(
+            c.BUFFER_TYPE_TABLE, p.BUFFER_TYPE_CRITERIA, values)),
+        ('buffer_width_score', lookup_sql(
+            c.BUFFER_WIDTH_TABLE, p.BUFFER_WIDTH_CRITERIA, values)),
+    ]
+
+    total_lanes = lane_features_sql('a.lane_configuration')['total_lanes']
+    lanes_crossed = "CASE WHEN a.lane_configuration IS NULL THEN " \
+        "CASE WHEN segment.marked_center_lane = 'No' THEN 1 ELSE 2 END " \
+        "ELSE %s END" % total_lanes
+    collector = '(segment.functional_class IS NULL OR ' \
+        'segment.functional_class >= 4)'
+    lanes = values['total_lanes_crossed']
+    approach_cells = [
+        ('collector_crossing_score', _where(
+            collector,
+            lookup_sql(c.COLLECTOR_CROSSING_TABLE,
+                       p.COLLECTOR_CROSSING_CRITERIA, values))),
+        ('arterial_two_lanes_score', _where(
+            'NOT %s AND %s <= 2' % (collector, lanes),
+            lookup_sql(c.ARTERIAL_CROSSING_TWO_LANES_TABLE,
+                       p.ARTERIAL_CROSSING_CRITERIA_TWO_LANES, values))),
+        ('arterial_three_lanes_score', _where(
+            'NOT %s AND %s > 2' % (collector, lanes),
+            lookup_sql(c.ARTERIAL_CROSSING_THREE_LANES_TABLE,
+                       p.ARTERIAL_CROSSING_CRITERIA_THREE_LANES, values))),
+    ]
+
+    sidewalk_names = [name for name, expr in sidewalk_cells]
+    scores = dict((n, 'w.%s' % n) for n in sidewalk_names)
+    scores['collector_crossing_score'] = 'a.collector_crossing_score'
+    scores['arterial_crossing_score'] = 'GREATEST(' \
+        'a.arterial_two_lanes_score, a.arterial_three_lanes_score)'
+    # the land use score is not scored yet and counts 0
+    scores['plts_score'] = 'GREATEST(%s, 0)' % ', '.join(
+        scores[n] for n in sidewalk_names)
+    invalid = '(w.invalid OR a.invalid OR %s = 0)' % scores['plts_score']
+
+    return 'SELECT segment.%s, %s, %s AS invalid FROM %s AS segment ' \
+        'CROSS JOIN LATERAL %s AS w CROSS JOIN LATERAL %s AS a' % (
+            identifier(id_column),
+            ', '.join('%s AS %s' % (scores[n], n) for n in PLTS_SCORES),
+            invalid, identifier(segments),
+            _scored(sidewalk_cells, sidewalk_relation, sidewalk_names),
+            _scored(approach_cells,
+                    _approaches_sql(approaches, id_column,
+                                    [('total_lanes_crossed', lanes_crossed)]),
+                    [name for name, expr in approach_cells]))
+
+
+def view_sql(name, query):
+    """
+    this function return the statement creating or replacing a view of a
+    generated query, e.g. view_sql('blts', blts_query('segment',
+    'approach')), so that ad hoc queries filter the scores on the server
+    :param name: view name, may be schema qualified
+    :param query: generated query
+    :return: str
+    """
+    return 'CREATE OR REPLACE VIEW %s AS %s' % (identifier(name), query)
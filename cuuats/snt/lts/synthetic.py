@@ -0,0 +1,217 @@
+## seeded synthetic street network for LTS benchmarks
+import numpy as np
+from cuuats.snt.lts.model.ApproachStore import ApproachStore
+from cuuats.snt.lts.model.SidewalkStore import SidewalkStore
+from cuuats.snt.lts.model.Segment import Segment
+from cuuats.snt.lts.model.Approach import Approach
+from cuuats.snt.lts.model.Sidewalk import Sidewalk
+
+FUNCTIONAL_CLASSES = np.array([1, 2, 3, 4, 5, 6, 7])
+FUNCTIONAL_CLASS_WEIGHTS = np.array([.01, .03, .08, .12, .16, .05, .55])
+
+# median aadt of each functional class
+MEDIAN_AADT = np.array([0, 45000, 28000, 14000, 6000, 2500, 900, 400])
+
+# class 0 is arterial (functional class 1-3), 1 collector (4-5), 2 local
+LANES_PER_DIRECTION = [[0, .05, .55, .3, .1], [0, .7, .3, 0, 0],
+                       [0, .97, .03, 0, 0]]
+SPEEDS = np.array([20, 25, 30, 35, 40, 45, 55])
+SPEED_WEIGHTS = [[0, .05, .15, .3, .25, .2, .05], [0, .3, .4, .25, .05, 0, 0],
+                 [.05, .8, .15, 0, 0, 0, 0]]
+
+# lane configuration parts, opposing lanes, left turn, through and right turn
+OPPOSING = ['X', 'XX', 'XXX']
+LEFT = ['', 'L', 'K', 'LL']
+THROUGH = ['T', 'TT', 'TTT']
+RIGHT = ['', 'R', 'Q']
+LANE_CONFIGURATIONS = np.array(
+    [o + l + t + r for o in OPPOSING for l in LEFT for t in THROUGH
+     for r in RIGHT], dtype=object)
+LEFT_WEIGHTS = [[.3, .5, .1, .1], [.6, .35, .05, 0], [.95, .05, 0, 0]]
+RIGHT_WEIGHTS = [[.5, .4, .1], [.8, .15, .05], [.97, .02, .01]]
+SIGNALIZED = [.6, .25, .02]
+
+BUFFER_TYPES = np.array(['No Buffer', 'Solid Buffer', 'Landscaped',
+                         'Landscaped with Trees'], dtype=object)
+
+
+def _choice(rng, values, weights, size):
+    return np.asarray(values)[rng.choice(len(weights), size=size, p=weights)]
+
+
+def _by_road_class(rng, road_class, values, weights):
+    """
+    this function draws one value per row from the weights of the row's road
+    class
+    """
+    result = np.empty(len(road_class), dtype=np.asarray(values).dtype)
+    for c, w in enumerate(weights):
+        rows = np.flatnonzero(road_class == c)
+        result[rows] = _choice(rng, values, w, len(rows))
+    return result
+
+
+def _object_column(values, null):
+    column = np.asarray(values).astype(object)
+    column[null] = None
+    return column
+
+
+def _masked(values, null):
+    return np.ma.array(values, mask=null)
+
+
+class SyntheticNetwork(object):
+    """
+    randomly generated segments with their approaches and sidewalks, the same
+    size, seed and offset always give the same network, offset lets a large
+    network be generated in independent chunks
+    """
+    def __init__(self, size, seed=0, offset=0):
+        """
+        :param size: number of segments
+        :param seed: random seed
+        :param offset: id of the first segment, also mixed into the seed
+        """
+        self.size = size
+        self.seed = seed
+        rng = np.random.default_rng([seed, offset])
+        self.segment_ids = np.arange(offset, offset + size, dtype=np.int64)
+        self._generate_segments(rng)
+        self._generate_approaches(rng)
+        self._generate_sidewalks(rng)
+
+    def _generate_segments(self, rng):
+        size = self.size
+        fc = _choice(rng, FUNCTIONAL_CLASSES, FUNCTIONAL_CLASS_WEIGHTS, size)
+        road_class = np.where(fc <= 3, 0, np.where(fc <= 5, 1, 2))
+        self.road_class = road_class
+
+        aadt = np.round(MEDIAN_AADT[fc] * rng.lognormal(0, .6, size), -1)
+        lanes = _by_road_class(rng, road_class, np.arange(5),
+                               LANES_PER_DIRECTION)
+        center = rng.random(size) < np.array([.8, .5, .05])[road_class]
+        bike_lane = rng.random(size) < np.array([.25, .3, .05])[road_class]
+        parking = rng.random(size) < np.array([.2, .5, .7])[road_class]
+
+        self.segments = {
+            'aadt': _masked(aadt, rng.random(size) < .02),
+            'lanes_per_direction': _masked(lanes, rng.random(size) < .03),
+            'bicycle_facility_width': _masked(
+                _choice(rng, [4, 5, 6, 7, 8], [.1, .4, .3, .1, .1], size),
+                ~bike_lane),
+            'parking_lane_width': _masked(
+                _choice(rng, [7, 8], [.5, .5], size), ~parking),
+            'posted_speed': _masked(
+                _by_road_class(rng, road_class, SPEEDS, SPEED_WEIGHTS),
+                rng.random(size) < .02),
+            'functional_class': _masked(fc, rng.random(size) < .01),
+            'total_lanes': _masked(lanes * 2 + center,
+                                   rng.random(size) < .03),
+            'marked_center_lane': _object_column(
+                np.where(center, 'Yes', 'No'), rng.random(size) < .05),
+        }
+
+    def _generate_approaches(self, rng):
+        counts = _choice(rng, [0, 1, 2], [.1, .2, .7], self.size)
+        offsets = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        road_class = np.repeat(self.road_class, counts)
+        size = len(road_class)
+
+        opposing = np.minimum(np.repeat(
+            np.maximum(self.segments['lanes_per_direction'].data, 1), counts),
+            3) - 1
+        through = np.maximum(
+            opposing - (rng.random(size) < .2), 0).astype(int)
+        left = _by_road_class(rng, road_class, np.arange(4), LEFT_WEIGHTS)
+        right = _by_road_class(rng, road_class, np.arange(3), RIGHT_WEIGHTS)
+        config = LANE_CONFIGURATIONS[((opposing * 4 + left) * 3 + through) * 3
+                                     + right]
+        signalized = rng.random(size) < np.array(SIGNALIZED)[road_class]
+
+        self.approach_offsets = offsets
+        self.approaches = {
+            'lane_configuration': _object_column(
+                config, rng.random(size) < .02),
+            'right_turn_lane_length': _masked(
+                rng.integers(5, 40, size) * 10.0, right == 0),
+            'bike_lane_approach': _object_column(
+                _choice(rng, ['Straight', 'Left', ''], [.2, .1, .7], size),
+                rng.random(size) < .7),
+            'median_present': rng.random(size) <
+                np.array([.3, .1, .01])[road_class],
+            'control_type': _object_column(
+                np.where(signalized, 'signalized', 'stop'),
+                rng.random(size) < .05),
+        }
+
+    def _generate_sidewalks(self, rng):
+        counts = _choice(rng, [0, 1, 2], [.15, .25, .6], self.size)
+        offsets = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        size = int(offsets[-1])
+
+        self.sidewalk_offsets = offsets
+        self.sidewalks = {
+            'sidewalk_width': _choice(
+                rng, [3, 4, 5, 6, 8, 10], [.05, .3, .35, .15, .1, .05], size),
+            'buffer_type': _choice(rng, BUFFER_TYPES, [.2, .2, .4, .2], size),
+            'buffer_width': _choice(
+                rng, [0, 3, 5, 8, 10, 15, 25], [.2, .15, .25, .15, .1, .1, .05],
+                size),
+            'sidewalk_score': np.clip(
+                np.round(rng.normal(70, 15, size)), 0, 100),
+            'overall_landuse': np.ones(size),
+        }
+
+    def approach_store(self):
+        """
+        this function return the approaches as an ApproachStore
+        :return: ApproachStore
+        """
+        return ApproachStore(self.approach_offsets, **self.approaches)
+
+    def sidewalk_store(self):
+        """
+        this function return the sidewalks as a SidewalkStore
+        :return: SidewalkStore
+        """
+        return SidewalkStore(self.sidewalk_offsets, **self.sidewalks)
+
+    def blts_columns(self):
+        names = ('aadt', 'lanes_per_direction', 'bicycle_facility_width',
+                 'parking_lane_width', 'posted_speed', 'functional_class')
+        return dict((name, self.segments[name]) for name in names)
+
+    def plts_columns(self):
+        names = ('posted_speed', 'total_lanes', 'aadt', 'functional_class',
+                 'marked_center_lane')
+        return dict((name, self.segments[name]) for name in names)
+
+    def _objects(self, model, columns, offsets, limit):
+        stop = offsets[limit]
+        rows = [dict() for _ in range(stop)]
+        for name, values in columns.items():
+            # masked values become None
+            for row, value in zip(rows, values[:stop].tolist()):
+                row[name] = value
+        objects = [model(**row) for row in rows]
+        return [objects[offsets[i]:offsets[i + 1]] for i in range(limit)]
+
+    def objects(self, limit=None):
+        """
+        this function return the first limit segments as model objects for
+        the scalar scorers
+        :param limit: number of segments, all by default
+        :return: tuple of (list of Segment, list of lists of Approach,
+            list of lists of Sidewalk)
+        """
+        limit = self.size if limit is None else min(limit, self.size)
+        segments = [s[0] for s in self._objects(
+            Segment, self.segments, np.arange(limit + 1), limit)]
+        approaches = self._objects(
+            Approach, self.approaches, self.approach_offsets, limit)
+        sidewalks = self._objects(
+            Sidewalk, self.sidewalks, self.sidewalk_offsets, limit)
+        return segments, approaches, sidewalks
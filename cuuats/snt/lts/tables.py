@@ -0,0 +1,219 @@
+## score tables of the LTS criteria, from config or a compiled criteria file
+import marshal
+import os
+
+# environment variable naming a criteria file to load instead of config
+ENVIRON = 'LTS_CRITERIA'
+
+# bumped whenever the layout of the compiled artifact changes
+FORMAT = 1
+
+# score table and the criteria table giving its axes, by module
+TABLE_CRITERIA = (
+    ('MIXED_TRAF_TABLE', 'blts_postgis', 'MIXED_TRAF_CRITERIA'),
+    ('BL_ADJ_PK_TABLE_ONE_LANE', 'blts_postgis',
+     'BL_ADJ_PK_CRITERIA_ONE_LANE'),
+    ('BL_ADJ_PK_TABLE_TWO_LANES', 'blts_postgis',
+     'BL_ADJ_PK_CRITERIA_TWO_LANES'),
+    ('BL_NO_ADJ_PK_TABLE_ONE_LANE', 'blts_postgis',
+     'BL_NO_ADJ_PK_CRITERIA_ONE_LANE'),
+    ('BL_NO_ADJ_PK_TABLE_TWO_LANES', 'blts_postgis',
+     'BL_NO_ADJ_PK_CRITERIA_TWO_LANES'),
+    ('RTL_CRIT_TABLE', 'blts_postgis', 'RTL_CRITERIA'),
+    ('LTL_DUAL_SHARED_TABLE', 'blts_postgis', 'LTL_DUAL_SHARED_CRITERIA'),
+    ('LTL_CRIT_TABLE', 'blts_postgis', 'LTL_CRITERIA'),
+    ('CROSSING_NO_MED_TABLE', 'blts_postgis', 'CROSSING_NO_MED_CRITERIA'),
+    ('CROSSING_HAS_MED_TABLE', 'blts_postgis', 'CROSSING_HAS_MED_CRITERIA'),
+    ('SW_COND_TABLE', 'plts_postgis', 'SW_COND_CRITERIA'),
+    ('BUFFER_TYPE_TABLE', 'plts_postgis', 'BUFFER_TYPE_CRITERIA'),
+    ('BUFFER_WIDTH_TABLE', 'plts_postgis', 'BUFFER_WIDTH_CRITERIA'),
+    ('COLLECTOR_CROSSING_TABLE', 'plts_postgis',
+     'COLLECTOR_CROSSING_CRITERIA'),
+    ('ARTERIAL_CROSSING_TWO_LANES_TABLE', 'plts_postgis',
+     'ARTERIAL_CROSSING_CRITERIA_TWO_LANES'),
+    ('ARTERIAL_CROSSING_THREE_LANES_TABLE', 'plts_postgis',
+     'ARTERIAL_CROSSING_CRITERIA_THREE_LANES'),
+)
+
+TABLE_NAMES = tuple(name for name, module, criteria in TABLE_CRITERIA)
+
+
+def _check(name, scores, criteria, depth=0):
+    if depth == len(criteria):
+        if type(scores) is not int or scores < 0:
+            raise ValueError('%s: scores must be non-negative integers'
+                             % name)
+        return scores
+    if not isinstance(scores, list) or \
+            len(scores) != len(criteria.criteria[depth]):
+        raise ValueError('%s: axis %d must have %d rows'
+                         % (name, depth, len(criteria.criteria[depth])))
+    return [_check(name, s, criteria, depth + 1) for s in scores]
+
+
+def validate(document):
+    """
+    this function checks a criteria document against the criteria tables,
+    every score table must be present with one row per condition on every
+    axis
+    :param document: dictionary with a version and a dictionary of tables
+    :return: dictionary of version and tables
+    """
+    from importlib import import_module
+    if not isinstance(document, dict) or \
+            not isinstance(document.get('tables'), dict):
+        raise ValueError('criteria file must have a tables object')
+    if 'version' not in document:
+        raise ValueError('criteria file must have a version')
+    tables = document['tables']
+    unknown = set(tables) - set(TABLE_NAMES)
+    if unknown:
+        raise ValueError('unknown tables: %s' % ', '.join(sorted(unknown)))
+    checked = {}
+    for name, module, criteria in TABLE_CRITERIA:
+        if name not in tables:
+            raise ValueError('missing table: %s' % name)
+        criteria = getattr(import_module('cuuats.snt.lts.' + module),
+                           criteria)
+        checked[name] = _check(name, tables[name], criteria)
+    return {'version': document['version'], 'tables': checked}
+
+
+def compile_tables(path, cache_dir=None):
+    """
+    this function return the tables of a criteria file, the file is parsed
+    and validated once and kept as a marshal artifact named after the hash
+    of its content, later calls load the artifact
+    :param path: path of the JSON criteria file
+    :param cache_dir: directory of the artifacts, __pycache__ next to the
+        file by default
+    :return: dictionary of version, hash and tables
+    """
+    import hashlib
+    with open(path, 'rb') as f:
+        data = f.read()
+    key = hashlib.sha256(b'%d:' % FORMAT + data).hexdigest()[:16]
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)),
+                                 '__pycache__')
+    prefix = os.path.basename(path) + '.'
+    artifact = os.path.join(cache_dir, prefix + key + '.marshal')
+    try:
+        with open(artifact, 'rb') as f:
+            return marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    import json
+    compiled = validate(json.loads(data.decode('utf-8')))
+    compiled['hash'] = key
+    # the artifact is written to a temporary file and renamed, so that
+    # processes starting together never read half of it, a directory that
+    # cannot be written only costs the next process a compile
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary = '%s.%d.tmp' % (artifact, os.getpid())
+        with open(temporary, 'wb') as f:
+            marshal.dump(compiled, f)
+        os.replace(temporary, artifact)
+        for name in os.listdir(cache_dir):
+            if name.startswith(prefix) and name.endswith('.marshal') and \
+                    name != prefix + key + '.marshal':
+                os.remove(os.path.join(cache_dir, name))
+    except OSError:
+        pass
+    return compiled
+
+
+def export_tables(path, version, source=None):
+    """
+    this function writes the score tables to a criteria file, one row per
+    line
+    :param path: path of the JSON criteria file
+    :param version: version of the criteria, e.g. '2017.1'
+    :param source: module or dictionary of the tables, the loaded tables by
+        default
+    """
+    import json
+    if source is None:
+        source = dict(TABLES.items())
+    elif not isinstance(source, dict):
+        source = dict((name, getattr(source, name)) for name in TABLE_NAMES)
+    lines = []
+    for name in TABLE_NAMES:
+        scores = source[name]
+        if scores and isinstance(scores[0], list):
+            body = '[\n%s\n    ]' % ',\n'.join(
+                '      ' + json.dumps(row) for row in scores)
+        else:
+            body = json.dumps(scores)
+        lines.append('    %s: %s' % (json.dumps(name), body))
+    with open(path, 'w') as f:
+        f.write('{\n  "version": %s,\n  "tables": {\n%s\n  }\n}\n'
+                % (json.dumps(version), ',\n'.join(lines)))
+
+
+class _Compiled(object):
+    def __init__(self, tables):
+        self.__dict__.update(tables)
+
+
+class Tables(object):
+    """
+    score tables read by the scorers, loaded on first use from the criteria
+    file named by LTS_CRITERIA or else from the config module, the config
+    module is read on every access so that changes to it are seen
+    """
+    def __init__(self):
+        self._source = None
+        self.path = None
+        self.version = None
+        self.hash = None
+
+    def load(self, path=None, cache_dir=None):
+        """
+        this function loads the tables of a criteria file, or of the config
+        module when path is None
+        :param path: path of the JSON criteria file
+        :param cache_dir: directory of the compiled artifacts
+        """
+        if path is None:
+            from importlib import import_module
+            self._source = import_module('cuuats.snt.lts.config')
+            self.path = self.version = self.hash = None
+            return
+        compiled = compile_tables(path, cache_dir)
+        self._source = _Compiled(compiled['tables'])
+        self.path = path
+        self.version = compiled['version']
+        self.hash = compiled['hash']
+
+    def reset(self):
+        """
+        this function forgets the loaded tables, the next access loads them
+        again
+        """
+        self._source = None
+        self.path = self.version = self.hash = None
+
+    def _loaded(self):
+        if self._source is None:
+            self.load(os.environ.get(ENVIRON) or None)
+        return self._source
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._loaded(), name)
+
+    def items(self):
+        """
+        this function return the loaded tables
+        :return: list of (name, scores) by name
+        """
+        source = self._loaded()
+        return [(name, getattr(source, name)) for name in sorted(vars(source))
+                if name.isupper()]
+
+
+TABLES = Tables()
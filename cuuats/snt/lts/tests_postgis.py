@@ -1,7 +1,54 @@
+import importlib.util
+import os
+import tempfile
 import unittest
 from blts_postgis import Blts
 from cuuats.snt.lts.model.Segment import Segment
 from cuuats.snt.lts.model.Approach import Approach
+from cuuats.snt.lts.plts_postgis import Plts
+from cuuats.snt.lts.blts_batch import BltsBatch
+from cuuats.snt.lts.plts_batch import PltsBatch
+from cuuats.snt.lts.model.Sidewalk import Sidewalk
+from cuuats.snt.lts.io_postgis import PostgisReader, PostgisWriter
+from cuuats.snt.lts.parallel import ParallelScorer, BLTS_SCORES, PLTS_SCORES
+from cuuats.snt.lts.model.RecordStore import RecordStore
+from cuuats.snt.lts.model.LaneCodec import LANES
+from cuuats.snt.lts.synthetic import SyntheticNetwork
+from cuuats.snt.lts.benchmark import run_case
+from cuuats.snt.lts import instrument
+from cuuats.snt.lts.lts_postgis import Lts
+from cuuats.snt.lts.cache import ScoreCache
+from cuuats.snt.lts.cube import BltsCube, PltsCube, get_cube
+from cuuats.snt.lts.scenario import ScenarioSweep, grid
+from cuuats.snt.lts.io_arrow import ArrowReader, ArrowWriter, batch_scores
+from cuuats.snt.lts.score_store import ScoreStore
+from cuuats.snt.lts.pipeline import AsyncScorer
+from cuuats.snt.lts.multi_batch import MultiBatch
+from cuuats.snt.lts.connectivity import LowStressNetwork
+from cuuats.snt.lts.model.Intersection import Intersection
+from cuuats.snt.lts.routing import StressGraph
+from cuuats.snt.lts.assembly import SegmentIndex
+from cuuats.snt.lts.sql import blts_query, criterion_sql, plts_query
+from cuuats.snt.lts.tables import TABLES, compile_tables, export_tables
+from cuuats.snt.lts.runner import BatchRunner, SyntheticSource
+from cuuats.snt.lts.service import ScoringService, SEGMENT_FIELDS, \
+    APPROACH_FIELDS, SIDEWALK_FIELDS
+from cuuats.snt.lts.criteria import ANY, Bins, Members, Predicates, \
+    CriteriaTable
+
+
+def _has_tables():
+    try:
+        TABLES.items()
+    except ImportError:
+        return False
+    return True
+
+
+# the criteria values come from the config module, which is kept out of the
+# repository, or from the criteria file named by LTS_CRITERIA
+needs_tables = unittest.skipUnless(
+    _has_tables(), 'needs the config module or LTS_CRITERIA')
 
 class SegmentTest(unittest.TestCase):
     segment = Segment()
@@ -43,6 +90,85 @@ class ApproachTest(unittest.TestCase):
         self.assertEqual(self.approach._calculate_lanes_crossed('XXXXLLTR'), 3)
         self.assertEqual(self.approach._calculate_lanes_crossed('XXXLLTTR'), 4)
 
+class LaneCodecTest(unittest.TestCase):
+    def test_encode(self):
+        code = LANES.encode('XXLTTR')
+        self.assertEqual(LANES.encode('XXLTTR'), code)
+        self.assertEqual(LANES.decode(code), 'XXLTTR')
+        self.assertEqual(LANES.encode(None), 0)
+        features = LANES.features[code]
+        self.assertEqual(features.lanes_crossed, 3)
+        self.assertEqual(features.max_lane, 4)
+        self.assertEqual(features.total_lanes, 6)
+        self.assertTrue(features.has_right)
+        self.assertTrue(features.has_left)
+        self.assertFalse(features.has_dual_left)
+
+    def test_approach(self):
+        approach = Approach(lane_configuration='XXTT')
+        self.assertEqual(approach.lanes_crossed, 1)
+        self.assertFalse(approach.has_right_turn_lane())
+        approach.lane_configuration = 'XXLTQ'
+        self.assertEqual(approach.lane_code, LANES.encode('XXLTQ'))
+        self.assertEqual(approach.lanes_crossed, 2)
+        self.assertTrue(approach.has_right_turn_lane())
+        self.assertFalse(approach.has_right)
+
+
+class CriteriaTest(unittest.TestCase):
+    segment = Segment()
+
+    def test_bins(self):
+        bins = Bins('aadt', [('<=', 1000), ('<=', 3000), ('==', 5000)])
+        aadt = [0, 1000, 1001, 3000, 4999, 5000, 5001]
+        indices = []
+        for a in aadt:
+            self.segment.aadt = a
+            indices.append(bins.index(self.segment))
+        self.assertEqual(indices, [0, 0, 1, 1, None, 2, None])
+
+    def test_bins_none(self):
+        self.segment.lanes_per_direction = None
+        bins = Bins('lanes_per_direction', [('in', (0, None)), ('>=', 1)])
+        self.assertEqual(bins.index(self.segment), 0)
+        bins = Bins('lanes_per_direction', [('>=', 1), ANY])
+        self.assertRaises(TypeError, bins.index, self.segment)
+
+    def test_members(self):
+        members = Members('marked_center_lane', ['Yes', ('No', None), ANY])
+        values = ['Yes', 'No', None, 'Maybe']
+        indices = []
+        for v in values:
+            self.segment.marked_center_lane = v
+            indices.append(members.index(self.segment))
+        self.assertEqual(indices, [0, 1, 1, 2])
+
+    def test_predicates(self):
+        predicates = Predicates([
+            [('functional_class', '<', 4), ('posted_speed', '>=', 35)],
+            [('functional_class', '<', 4)],
+            ANY])
+        self.segment.functional_class = 3
+        self.segment.posted_speed = 40
+        self.assertEqual(predicates.index(self.segment), 0)
+        self.segment.posted_speed = 30
+        self.assertEqual(predicates.index(self.segment), 1)
+        self.segment.functional_class = 5
+        self.assertEqual(predicates.index(self.segment), 2)
+
+    def test_lookup(self):
+        score_matrix = [[1, 2], [3, 4]]
+        table = CriteriaTable(
+            Bins(('bicycle_facility_width', 'parking_lane_width'),
+                [('>=', 15), ANY]),
+            Bins('aadt', [('<', 3000), ANY]))
+        self.segment.bicycle_facility_width = 6
+        self.segment.parking_lane_width = 9
+        self.segment.aadt = 3000
+        self.assertEqual(table.lookup(score_matrix, self.segment), 2)
+        self.segment.parking_lane_width = 8
+        self.assertEqual(table.lookup(score_matrix, self.segment), 4)
+
 class BltsTest(unittest.TestCase):
     segment = Segment()
     approaches = [Approach()]
@@ -295,6 +421,1121 @@ class BltsTest(unittest.TestCase):
             inner_list = []
         self.assertEqual(outer_list, score_matrix)
 
+class UpdateTest(unittest.TestCase):
+    def test_changed_since(self):
+        segment = Segment(aadt=500)
+        version = segment.version
+        segment.aadt = 500
+        self.assertEqual(segment.changed_since(version), [])
+        segment.posted_speed = 30
+        self.assertEqual(segment.changed_since(version), ['posted_speed'])
+
+    @needs_tables
+    def test_update_blts(self):
+        segment = Segment(aadt=12000, lanes_per_direction=2,
+                          functional_class=3, posted_speed=25)
+        approaches = [Approach(lane_configuration="XXTT"),
+                      Approach(lane_configuration="XXLTTR",
+                               right_turn_lane_length=100,
+                               bike_lane_approach="Straight")]
+        blts = Blts(segment, approaches)
+        blts.calculate_blts()
+        segment.posted_speed = 35
+        approaches[0].median_present = True
+        score = blts.update_blts()
+
+        expected = Blts(segment, approaches)
+        self.assertEqual(score, expected.calculate_blts())
+        self.assertEqual(blts.crossing_with_median_score,
+                         expected.crossing_with_median_score)
+        self.assertEqual(blts.left_turn_lane_score,
+                         expected.left_turn_lane_score)
+
+    @needs_tables
+    def test_update_plts(self):
+        segment = Segment(posted_speed=30, total_lanes=3,
+                          functional_class=2, marked_center_lane='Yes')
+        sidewalks = [Sidewalk(sidewalk_width=5, buffer_type='No Buffer',
+                              buffer_width=0, sidewalk_score=80)]
+        approaches = [Approach(lane_configuration="XXTT")]
+        plts = Plts(segment, sidewalks, approaches)
+        plts.calculate_plts()
+        sidewalks[0].buffer_width = 12
+        segment.posted_speed = 25
+        score = plts.update_plts()
+
+        expected = Plts(segment, sidewalks, approaches)
+        self.assertEqual(score, expected.calculate_plts())
+        self.assertEqual(plts.arterial_crossing_score,
+                         expected.arterial_crossing_score)
+
+    @needs_tables
+    def test_update_lane_features(self):
+        # the lane features are plain attributes that can be assigned
+        # without changing the lane configuration
+        segment = Segment(aadt=3000, posted_speed=30, functional_class=2,
+                          total_lanes=3, marked_center_lane='Yes')
+        sidewalks = [Sidewalk(sidewalk_width=5, buffer_type='No Buffer',
+                              buffer_width=0, sidewalk_score=80)]
+        approaches = [Approach(lane_configuration='XT')]
+        plts = Plts(segment, sidewalks, approaches)
+        plts.calculate_plts()
+        approaches[0].total_lanes = 6
+        plts.update_plts()
+        expected = Plts(segment, sidewalks, approaches)
+        expected.calculate_plts()
+        for name in PLTS_SCORES:
+            self.assertEqual(getattr(plts, name), getattr(expected, name))
+
+        segment = Segment(aadt=12000, lanes_per_direction=2, posted_speed=30,
+                          functional_class=2)
+        approaches = [Approach(lane_configuration='XT', median_present=True),
+                      Approach(lane_configuration='XXT'),
+                      Approach(lane_configuration='XT',
+                               right_turn_lane_length=100,
+                               bike_lane_approach='Straight')]
+        blts = Blts(segment, approaches)
+        blts.calculate_blts()
+        approaches[0].max_lane = 4
+        approaches[1].total_lanes = 6
+        approaches[1].lanes_crossed = 2
+        approaches[2].lane_code = LANES.encode('XTR')
+        blts.update_blts()
+        expected = Blts(segment, approaches)
+        expected.calculate_blts()
+        for name in BLTS_SCORES:
+            self.assertEqual(getattr(blts, name), getattr(expected, name))
+
+
+class RecordStoreTest(unittest.TestCase):
+    def test_views(self):
+        segments = [Segment(aadt=500, lanes_per_direction=1),
+                    Segment(posted_speed=30, marked_center_lane='Yes')]
+        store = RecordStore.from_records(segments)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store[0].aadt, 500)
+        self.assertEqual(store[1].aadt, 0)
+        self.assertIsNone(store[0].posted_speed)
+        self.assertEqual(store[1].marked_center_lane, 'Yes')
+        store[1].posted_speed = 35
+        self.assertEqual(store.get('posted_speed', 1), 35)
+        # fractions of int fields are not truncated
+        store[1].lanes_per_direction = 2.0
+        self.assertEqual(store[1].lanes_per_direction, 2)
+        with self.assertRaises(ValueError):
+            store[1].lanes_per_direction = 1.5
+        with self.assertRaises(ValueError):
+            RecordStore.from_records([Segment(lanes_per_direction=1.5)])
+
+    def test_derived(self):
+        store = RecordStore.from_columns(
+            Approach, {'lane_configuration': ['XXLTTR', None]})
+        self.assertEqual(store[0].lanes_crossed, 3)
+        self.assertEqual(store[0].max_lane, 4)
+        self.assertEqual(store[0].total_lanes, 6)
+        self.assertEqual(store[1].max_lane, 1)
+        self.assertIsNone(store[1].total_lanes)
+
+
+@needs_tables
+class BltsBatchTest(unittest.TestCase):
+    aadt = [500, 3000, 30001, None, 1500]
+    lanes_per_direction = [None, 1, 2, 3, 0]
+    bicycle_facility_width = [6, 7, None, 4, 5.5]
+    parking_lane_width = [8, None, 7, 4, None]
+
+    def test_segment_score(self):
+        batch = BltsBatch(self.aadt, self.lanes_per_direction,
+                          self.bicycle_facility_width, self.parking_lane_width)
+        batch.calculate_segment_score()
+        for i in range(len(self.aadt)):
+            blts = Blts(Segment(aadt=self.aadt[i],
+                lanes_per_direction=self.lanes_per_direction[i],
+                bicycle_facility_width=self.bicycle_facility_width[i],
+                parking_lane_width=self.parking_lane_width[i]), [])
+            blts.calculate_blts()
+            self.assertEqual(batch.bike_lane_with_adj_parking_score[i],
+                             blts.bike_lane_with_adj_parking_score)
+            self.assertEqual(batch.bike_lane_without_adj_parking_score[i],
+                             blts.bike_lane_without_adj_parking_score)
+            self.assertEqual(batch.mix_traffic_score[i],
+                             blts.mix_traffic_score)
+            self.assertEqual(batch.segment_score[i], blts.segment_score)
+        self.assertFalse(batch.invalid.any())
+
+    def test_blts_score(self):
+        segments = [Segment(aadt=12000, lanes_per_direction=2,
+                            functional_class=3, posted_speed=30),
+                    Segment(aadt=500, lanes_per_direction=1,
+                            functional_class=5, posted_speed=25),
+                    Segment(aadt=20000, lanes_per_direction=2,
+                            bicycle_facility_width=6, functional_class=1,
+                            posted_speed=35)]
+        approach_lists = [
+            [Approach(lane_configuration="XXLTTR",
+                      right_turn_lane_length=151,
+                      bike_lane_approach="Straight"),
+             Approach(lane_configuration="XXTT", median_present=True)],
+            [],
+            [Approach(lane_configuration="XXXTR",
+                      right_turn_lane_length=100,
+                      bike_lane_approach="Straight",
+                      control_type="signalized", median_present=True)]]
+        batch = BltsBatch.from_objects(segments, approach_lists)
+        batch.calculate_blts()
+        for i, segment in enumerate(segments):
+            blts = Blts(segment, approach_lists[i])
+            blts.calculate_blts()
+            self.assertEqual(batch.right_turn_lane_score[i],
+                             blts.right_turn_lane_score)
+            self.assertEqual(batch.left_turn_lane_score[i],
+                             blts.left_turn_lane_score)
+            self.assertEqual(batch.crossing_with_median_score[i],
+                             blts.crossing_with_median_score)
+            self.assertEqual(batch.crossing_without_median_score[i],
+                             blts.crossing_without_median_score)
+            self.assertEqual(batch.blts_score[i], blts.blts_score)
+        self.assertFalse(batch.invalid.any())
+
+    def test_parallel_scorer(self):
+        columns = {'aadt': self.aadt,
+                   'lanes_per_direction': self.lanes_per_direction,
+                   'bicycle_facility_width': self.bicycle_facility_width,
+                   'parking_lane_width': self.parking_lane_width}
+        batch = BltsBatch(**columns)
+        batch.calculate_blts()
+        segment_ids = [50, 40, 30, 20, 10]
+        result = ParallelScorer('blts', workers=2, chunk_size=2).score(
+            segment_ids, columns)
+        self.assertEqual(list(result.segment_ids), [10, 20, 30, 40, 50])
+        self.assertEqual(list(result.scores['blts_score']),
+                         list(batch.blts_score[::-1]))
+
+@needs_tables
+class PltsBatchTest(unittest.TestCase):
+    def test_plts_score(self):
+        segments = [Segment(posted_speed=30, total_lanes=3, aadt=6000,
+                            functional_class=2, marked_center_lane='Yes'),
+                    Segment(posted_speed=25, total_lanes=2,
+                            functional_class=5, marked_center_lane='No')]
+        sidewalk_lists = [
+            [Sidewalk(sidewalk_width=4, buffer_type='No Buffer',
+                      buffer_width=0, sidewalk_score=60),
+             Sidewalk(sidewalk_width=6, buffer_type='Landscaped',
+                      buffer_width=12, sidewalk_score=80)],
+            [Sidewalk(sidewalk_width=5, buffer_type='Solid Buffer',
+                      buffer_width=6, sidewalk_score=65)]]
+        approach_lists = [[Approach(lane_configuration="XXXTT"),
+                           Approach()],
+                          [Approach()]]
+        batch = PltsBatch.from_objects(segments, sidewalk_lists,
+                                       approach_lists)
+        batch.calculate_plts()
+        for i, segment in enumerate(segments):
+            plts = Plts(segment, sidewalk_lists[i], approach_lists[i])
+            plts.calculate_plts()
+            self.assertEqual(batch.condition_score[i], plts.condition_score)
+            self.assertEqual(batch.physical_buffer_score[i],
+                             plts.physical_buffer_score)
+            self.assertEqual(batch.buffer_width_score[i],
+                             plts.buffer_width_score)
+            self.assertEqual(batch.collector_crossing_score[i],
+                             plts.collector_crossing_score)
+            self.assertEqual(batch.arterial_crossing_score[i],
+                             plts.arterial_crossing_score)
+            self.assertEqual(batch.plts_score[i], plts.plts_score)
+        self.assertFalse(batch.invalid.any())
+
+
+@needs_tables
+class InstrumentTest(unittest.TestCase):
+    def test_profiling(self):
+        calculate_score = Lts._calculate_score
+        segment = Segment(aadt=500, lanes_per_direction=1, posted_speed=25,
+                          bicycle_facility_width=6)
+        with instrument.profiling() as profiler:
+            self.assertIsNot(Lts._calculate_score, calculate_score)
+            Blts(segment, [Approach(lane_configuration="XXT")]).calculate_blts()
+        self.assertIs(Lts._calculate_score, calculate_score)
+
+        self.assertEqual(profiler.stages['blts.calculate'].count, 1)
+        self.assertEqual(profiler.stages['blts.approach'].count, 1)
+        mix_traffic = profiler.tables['blts.MIXED_TRAF_CRITERIA']
+        self.assertEqual(mix_traffic.count, 1)
+        self.assertEqual(dict(mix_traffic.cells), {(0, 1): 1})
+        self.assertIn('blts.MIXED_TRAF_CRITERIA', profiler.report())
+
+    def test_batch_profiling(self):
+        segments = [Segment(aadt=500, lanes_per_direction=1),
+                    Segment(aadt=2000, lanes_per_direction=2)]
+        with instrument.profiling() as profiler:
+            BltsBatch.from_objects(segments).calculate_blts()
+        mix_traffic = profiler.tables['blts.MIXED_TRAF_CRITERIA']
+        self.assertEqual(dict(mix_traffic.cells), {(0, 1): 1, (1, 2): 1})
+        self.assertEqual(profiler.stages['blts_batch.calculate'].count, 1)
+
+
+class BenchmarkTest(unittest.TestCase):
+    def test_synthetic_network(self):
+        network = SyntheticNetwork(100, seed=1)
+        again = SyntheticNetwork(100, seed=1)
+        self.assertEqual(network.approaches['lane_configuration'].tolist(),
+                         again.approaches['lane_configuration'].tolist())
+        segments, approaches, sidewalks = network.objects(10)
+        self.assertEqual(len(segments), 10)
+        self.assertEqual(sum(len(a) for a in approaches),
+                         network.approach_offsets[10])
+
+    @needs_tables
+    def test_run_case(self):
+        result = run_case('blts_batch', 500, chunk_size=200)
+        self.assertEqual(result['segments'], 500)
+        self.assertIn('turn_lanes', result['stages'])
+        result = run_case('plts', 500, scalar_limit=100)
+        self.assertEqual(result['segments'], 100)
+
+
+class ScoreCacheTest(unittest.TestCase):
+    @needs_tables
+    def test_score_blts(self):
+        segment = Segment(aadt=500, lanes_per_direction=1, posted_speed=25)
+        approaches = [Approach(lane_configuration="XXT")]
+        with ScoreCache(':memory:', version='1') as cache:
+            scores = cache.score_blts(segment, approaches)
+            self.assertEqual(cache.misses, 1)
+            self.assertEqual(cache.score_blts(segment, approaches), scores)
+            self.assertEqual(cache.hits, 1)
+            blts = Blts(segment, approaches)
+            blts.calculate_blts()
+            self.assertEqual(scores['blts_score'], blts.blts_score)
+
+            segment.aadt = 5000
+            cache.score_blts(segment, approaches)
+            self.assertEqual(cache.misses, 2)
+            self.assertEqual(len(cache), 2)
+
+    def test_errors(self):
+        segment = Segment(aadt=500)
+        with ScoreCache(':memory:', version='1') as cache:
+            for i in range(2):
+                with self.assertRaises(ValueError):
+                    cache.score_plts(segment, [], [])
+            self.assertEqual(cache.hits, 1)
+
+    def test_key(self):
+        import numpy as np
+        from decimal import Decimal
+        cache = ScoreCache(':memory:', version='1')
+        segment = Segment(aadt=Decimal('5000'),
+                          lanes_per_direction=np.int64(1),
+                          posted_speed=np.float64(25))
+        self.assertEqual(cache.key('blts', segment, []),
+                         cache.key('blts', Segment(aadt=5000.0,
+                                                   lanes_per_direction=1,
+                                                   posted_speed=25.0), []))
+        approach = Approach(lane_configuration='XT')
+        key = cache.key('blts', segment, [approach])
+        approach.total_lanes = 6
+        self.assertNotEqual(cache.key('blts', segment, [approach]), key)
+        cache.close()
+
+    def test_flush_used(self):
+        path = os.path.join(tempfile.mkdtemp(), 'scores.sqlite')
+        with ScoreCache(path, version='1') as cache:
+            for key in (b'a', b'b', b'c'):
+                cache.put(key, {'blts_score': 1})
+        cache = ScoreCache(path, version='1', flush_size=2)
+        cache.get(b'a')
+        cache.get(b'b')
+        # the hits are written without waiting for close
+        self.assertEqual(cache._used, [])
+        used = dict(cache.connection.execute('SELECT key, used FROM scores'))
+        self.assertEqual(used, {b'a': cache.run, b'b': cache.run,
+                                b'c': cache.run - 1})
+        cache.close()
+
+    @needs_tables
+    def test_version_and_evict(self):
+        path = os.path.join(tempfile.mkdtemp(), 'scores.sqlite')
+        with ScoreCache(path, version='1', max_entries=2) as cache:
+            for aadt in (100, 200, 300):
+                cache.score_blts(Segment(aadt=aadt, lanes_per_direction=1),
+                                 [])
+            self.assertEqual(cache.evict(), 1)
+            self.assertEqual(len(cache), 2)
+        with ScoreCache(path, version='1') as cache:
+            self.assertEqual(len(cache), 2)
+        with ScoreCache(path, version='2') as cache:
+            self.assertEqual(len(cache), 0)
+
+
+@needs_tables
+class CubeTest(unittest.TestCase):
+    def test_blts(self):
+        network = SyntheticNetwork(2000, seed=3)
+        batch = BltsBatch(approaches=network.approach_store(),
+                          **network.blts_columns())
+        cube = BltsBatch(approaches=network.approach_store(),
+                         **network.blts_columns())
+        self.assertEqual(BltsCube().calculate_blts(cube).tolist(),
+                         batch.calculate_blts().tolist())
+        self.assertEqual(cube.invalid.tolist(), batch.invalid.tolist())
+        self.assertEqual(cube.segment_score.tolist(),
+                         batch.segment_score.tolist())
+
+    def test_plts(self):
+        network = SyntheticNetwork(2000, seed=3)
+        kwargs = dict(sidewalks=network.sidewalk_store(),
+                      approaches=network.approach_store(),
+                      **network.plts_columns())
+        batch = PltsBatch(**kwargs)
+        cube = PltsBatch(**kwargs)
+        self.assertEqual(PltsCube().calculate_plts(cube).tolist(),
+                         batch.calculate_plts().tolist())
+        self.assertEqual(cube.invalid.tolist(), batch.invalid.tolist())
+
+    def test_new_lane_class(self):
+        cube = BltsCube()
+        size = cube.parts['turn_lanes'].lanes.size
+        segments = [Segment(aadt=20000, lanes_per_direction=3,
+                            posted_speed=40, functional_class=2)]
+        approaches = [[Approach(lane_configuration="XXLKTRQ",
+                                 bike_lane_approach="Straight",
+                                 right_turn_lane_length=100)]]
+        batch = BltsBatch.from_objects(segments, approaches)
+        self.assertEqual(
+            cube.calculate_blts(BltsBatch.from_objects(segments,
+                                                       approaches)).tolist(),
+            batch.calculate_blts().tolist())
+        self.assertGreater(cube.parts['turn_lanes'].lanes.size, size)
+
+    def test_rebuild(self):
+        cube = get_cube(BltsCube, 10000)
+        self.assertIs(get_cube(BltsCube, 10000), cube)
+        tables = dict(TABLES.items())
+        tables['MIXED_TRAF_TABLE'] = [[4] * len(row)
+                                      for row in TABLES.MIXED_TRAF_TABLE]
+        with tempfile.TemporaryDirectory() as path:
+            criteria = os.path.join(path, 'criteria.json')
+            export_tables(criteria, 'test', tables)
+            try:
+                TABLES.load(criteria)
+                self.assertIsNot(get_cube(BltsCube, 10000), cube)
+            finally:
+                TABLES.reset()
+
+
+class ScenarioTest(unittest.TestCase):
+    def test_grid(self):
+        scenarios = grid(posted_speed=[25, 30], parking_lane_width=[None])
+        self.assertEqual(scenarios, [
+            {'parking_lane_width': None, 'posted_speed': 25},
+            {'parking_lane_width': None, 'posted_speed': 30}])
+
+    @needs_tables
+    def test_sweep(self):
+        network = SyntheticNetwork(1000, seed=5)
+        batch = BltsBatch(approaches=network.approach_store(),
+                          **network.blts_columns())
+        scenarios = grid(bicycle_facility_width=[5, 8],
+                         parking_lane_width=[None, 8])
+        scenarios.append({'posted_speed': lambda speed: speed - 5})
+        result = ScenarioSweep(batch).run(scenarios)
+        self.assertEqual(result.scores.shape, (5, 1000))
+        self.assertEqual(result.baseline.tolist(),
+                         batch.calculate_blts().tolist())
+
+        for i, scenario in enumerate(scenarios):
+            columns = network.blts_columns()
+            for name, value in scenario.items():
+                columns[name] = value(columns[name]) if callable(value) \
+                    else [value] * 1000
+            expected = BltsBatch(approaches=network.approach_store(),
+                                 **columns)
+            self.assertEqual(result.scores[i].tolist(),
+                             expected.calculate_blts().tolist())
+            self.assertEqual(result.invalid[i].tolist(),
+                             expected.invalid.tolist())
+        self.assertEqual(len(result.summary()), 5)
+
+    @needs_tables
+    def test_lane_configuration(self):
+        network = SyntheticNetwork(10)
+        batch = BltsBatch(approaches=network.approach_store(),
+                          **network.blts_columns())
+        with self.assertRaises(ValueError):
+            ScenarioSweep(batch).run([{'approach.lanes_crossed': 1}])
+
+
+class MultiBatchTest(unittest.TestCase):
+    @needs_tables
+    def test_modes(self):
+        network = SyntheticNetwork(400, seed=9)
+        segments, approach_lists, sidewalk_lists = network.objects()
+        batch = MultiBatch.from_objects(segments, approach_lists,
+                                        sidewalk_lists)
+        scores = batch.calculate()
+        blts = BltsBatch.from_objects(segments, approach_lists)
+        plts = PltsBatch.from_objects(segments, sidewalk_lists,
+                                      approach_lists)
+        self.assertEqual(scores['blts'].tolist(),
+                         blts.calculate_blts().tolist())
+        self.assertEqual(scores['plts'].tolist(),
+                         plts.calculate_plts().tolist())
+        self.assertEqual(batch.blts.invalid.tolist(), blts.invalid.tolist())
+        self.assertEqual(batch.plts.invalid.tolist(), plts.invalid.tolist())
+        # the modes share the converted segment columns
+        self.assertIs(batch.blts.columns, batch.plts.columns)
+
+    def test_alts(self):
+        with self.assertRaises(ValueError):
+            MultiBatch(modes=('alts',), aadt=[1000])
+
+
+class ConnectivityTest(unittest.TestCase):
+    def setUp(self):
+        # a square 10-20-30-40 with a tail 40-50
+        self.network = LowStressNetwork(
+            [1, 2, 3, 4, 5], [10, 20, 30, 40, 40], [20, 30, 40, 10, 50],
+            [1, 2, 3, 2, 0],
+            intersections=[Intersection(intersection_id=60)])
+
+    def test_components(self):
+        network = self.network
+        self.assertEqual(network.components(1).tolist(),
+                         [10, 10, 30, 40, 50, 60])
+        self.assertEqual(network.components(2).tolist(),
+                         [10, 10, 10, 10, 50, 60])
+        self.assertEqual(network.segment_components(1).tolist(),
+                         [10, None, None, None, None])
+        ids, nodes, segments = network.islands(3)
+        self.assertEqual(ids.tolist(), [10, 60, 50])
+        self.assertEqual(nodes.tolist(), [4, 1, 1])
+        self.assertEqual(segments.tolist(), [4, 0, 0])
+
+    def test_update(self):
+        network = self.network
+        network.update([5], [1])
+        self.assertTrue(network.connected(10, 50, 2))
+        self.assertFalse(network.connected(10, 50, 1))
+        # the square stays joined without one of its sides
+        network.update([1], [4])
+        self.assertTrue(network.connected(10, 20, 3))
+        network.update([2, 4], [4, 4])
+        self.assertFalse(network.connected(10, 20, 3))
+        self.assertFalse(network.connected(20, 30, 3))
+        self.assertTrue(network.connected(30, 50, 3))
+        self.assertTrue(network.connected(10, 50, 4))
+        network.update([3], [0])
+        self.assertEqual(network.islands(4)[1].tolist(), [5, 1])
+        self.assertFalse(network.connected(30, 40, 3))
+
+
+class RoutingTest(unittest.TestCase):
+    def setUp(self):
+        # a square 10-20-30-40 of 100 long sides with an unscored tail 40-50
+        self.graph = StressGraph(
+            [1, 2, 3, 4, 5], [10, 20, 30, 40, 40], [20, 30, 40, 10, 50],
+            [100, 100, 100, 100, 50], [1, 2, 3, 2, 0])
+
+    def test_isochrone(self):
+        ids, costs, origins = self.graph.isochrone(10, 150, 2)
+        self.assertEqual(ids.tolist(), [10, 20, 40])
+        self.assertEqual(costs.tolist(), [0, 100, 100])
+        self.assertEqual(origins.tolist(), [10, 10, 10])
+        ids, costs, origins = self.graph.isochrone(10, 250, 1)
+        self.assertEqual(ids.tolist(), [10, 20])
+        ids, costs, origins = self.graph.isochrone(
+            10, 200, 2, stress_weights={2: 1.5})
+        self.assertEqual(ids.tolist(), [10, 20, 40])
+        self.assertEqual(costs.tolist(), [0, 100, 150])
+        ids, costs, origins = self.graph.isochrone([10, 30], 100, 3)
+        self.assertEqual(origins.tolist(), [10, 30, 10, 10])
+
+    def test_accessibility(self):
+        destinations, reached = self.graph.accessibility(
+            [10, 30], 200, 2, destinations={20: 2, 30: 1}, workers=1)
+        self.assertEqual(destinations.tolist(), [3, 3])
+        self.assertEqual(reached.tolist(), [4, 3])
+        parallel = self.graph.accessibility(
+            [10, 30, 50], 200, 2, workers=2, batch_size=1)
+        self.assertEqual(parallel[0].tolist(), [4, 3, 1])
+        with self.assertRaises(KeyError):
+            self.graph.accessibility([70], 200, 2)
+
+class AssemblyTest(unittest.TestCase):
+    def setUp(self):
+        # a street east of the origin with a bend and a street north of it
+        self.index = SegmentIndex.from_polylines(
+            [[(0, 0), (100, 0), (200, 10)], [(0, 0), (0, 100)]])
+
+    def test_match(self):
+        rows, distances = self.index.match(
+            [(50, 8), (150, -3), (-2, 60), (5, 5), (5, 5), (300, 300)], 10)
+        self.assertEqual(rows.tolist(), [0, 0, 1, 0, 0, -1])
+        self.assertEqual(distances[0], 8)
+        # at the intersection the bearing picks the street
+        rows, distances = self.index.match(
+            [(5, 5), (5, 5)], 10, bearings=[-90, 180], tolerance=20)
+        self.assertEqual(rows.tolist(), [1, 0])
+
+    def test_cell_size(self):
+        # densified lines, the cells follow the match distance
+        line = [(x / 2.0, 0) for x in range(401)]
+        index = SegmentIndex.from_polylines([line, [(0, 50), (0, 50)]])
+        self.assertEqual(index.cell_size, 0.5)
+        rows, distances = index.match([(100, 20), (100, 40), (3, 45)], 30)
+        self.assertEqual(rows.tolist(), [0, -1, 1])
+        # pieces of zero length are left out of the default cell size
+        index = SegmentIndex([(0, 0), (1, 1), (1, 1)], [(0, 0), (1, 1), (4, 1)])
+        self.assertEqual(index.cell_size, 3)
+        self.assertEqual(index.match([(2, 2)], 2)[0].tolist(), [2])
+
+    def test_stores(self):
+        sidewalks = self.index.sidewalks(
+            [(10, 6), (10, -6), (6, 10), (40, 40)],
+            [(90, 6), (90, -6), (6, 90), (60, 60)],
+            {'sidewalk_width': [5, 4, 6, 3]}, distance=10, tolerance=20)
+        self.assertEqual(sidewalks.offsets.tolist(), [0, 2, 3])
+        width, null = sidewalks.columns['sidewalk.sidewalk_width']
+        self.assertEqual(width.tolist(), [5, 4, 6])
+        approaches = self.index.approaches(
+            [(3, 15), (190, 9)], {'lane_configuration': ['XT', 'XTR']},
+            distance=5, bearings=[-90, 5], tolerance=20)
+        self.assertEqual(approaches.offsets.tolist(), [0, 1, 2])
+        self.assertEqual(self.index.lists([1, -1, 0], ['a', 'b', 'c']),
+                         [['c'], ['a']])
+
+class SqlTest(unittest.TestCase):
+    def test_criterion_sql(self):
+        self.assertEqual(
+            criterion_sql(Bins('segment.aadt', [('<=', 1000), ANY]), {}),
+            'CASE WHEN segment.aadt IS NULL THEN NULL '
+            'WHEN segment.aadt <= 1000 THEN 0 ELSE 1 END')
+        self.assertEqual(
+            criterion_sql(Members('sidewalk.buffer_type',
+                                  [('No Buffer', None), "Tree's"]), {}),
+            "CASE WHEN sidewalk.buffer_type IS NULL THEN 0 "
+            "WHEN sidewalk.buffer_type IN ('No Buffer') THEN 0 "
+            "WHEN sidewalk.buffer_type IN ('Tree''s') THEN 1 ELSE NULL END")
+        self.assertEqual(
+            criterion_sql(Predicates([[('approach.has_right', '==', True),
+                                       ('approach.length', '>', 150)]]),
+                          {'approach.has_right': 'approach.lts_has_right'}),
+            'CASE WHEN approach.lts_has_right = TRUE AND approach.length '
+            'IS NULL THEN NULL WHEN approach.lts_has_right = TRUE AND '
+            'approach.length > 150 THEN 0 ELSE NULL END')
+
+@needs_tables
+class TablesTest(unittest.TestCase):
+    def tearDown(self):
+        TABLES.reset()
+
+    def test_compile(self):
+        with tempfile.TemporaryDirectory() as path:
+            criteria = os.path.join(path, 'criteria.json')
+            export_tables(criteria, '2017.1')
+            compiled = compile_tables(criteria)
+            self.assertEqual(compiled['version'], '2017.1')
+            self.assertEqual(compiled['tables']['MIXED_TRAF_TABLE'],
+                             TABLES.MIXED_TRAF_TABLE)
+            cached = os.listdir(os.path.join(path, '__pycache__'))
+            self.assertEqual(cached, ['criteria.json.%s.marshal'
+                                      % compiled['hash']])
+            self.assertEqual(compile_tables(criteria), compiled)
+
+            with open(criteria) as f:
+                text = f.read()
+            with open(criteria, 'w') as f:
+                f.write(text.replace('2017.1', '2017.2'))
+            self.assertEqual(compile_tables(criteria)['version'], '2017.2')
+            self.assertEqual(len(os.listdir(os.path.join(path,
+                                                         '__pycache__'))), 1)
+
+    def test_load(self):
+        segment = Segment(aadt=500, lanes_per_direction=1, posted_speed=25,
+                          functional_class=5)
+        score = Blts(segment, [])._calculate_mix_traffic()
+        with tempfile.TemporaryDirectory() as path:
+            criteria = os.path.join(path, 'criteria.json')
+            tables = dict(TABLES.items())
+            tables['MIXED_TRAF_TABLE'] = [[4] * len(row)
+                                          for row in TABLES.MIXED_TRAF_TABLE]
+            export_tables(criteria, 'test', tables)
+            TABLES.load(criteria)
+            self.assertEqual(TABLES.version, 'test')
+            self.assertEqual(Blts(segment, [])._calculate_mix_traffic(), 4)
+        TABLES.reset()
+        self.assertEqual(Blts(segment, [])._calculate_mix_traffic(), score)
+        self.assertNotEqual(score, 4)
+
+    def test_invalid(self):
+        with tempfile.TemporaryDirectory() as path:
+            criteria = os.path.join(path, 'criteria.json')
+            tables = dict(TABLES.items())
+            tables['MIXED_TRAF_TABLE'] = TABLES.MIXED_TRAF_TABLE[1:]
+            export_tables(criteria, 'test', tables)
+            with self.assertRaises(ValueError):
+                compile_tables(criteria)
+            self.assertFalse(os.path.exists(os.path.join(path,
+                                                         '__pycache__')))
+
+
+@needs_tables
+class RunnerTest(unittest.TestCase):
+    def test_resume(self):
+        import numpy as np
+        lines = []
+
+        def stop(line):
+            lines.append(line)
+            if len(lines) == 2:
+                raise KeyboardInterrupt
+
+        with tempfile.TemporaryDirectory() as path:
+            source = SyntheticSource(2500, chunk_size=1000, seed=4)
+            runner = BatchRunner(source, os.path.join(path, 'a'),
+                                 progress=stop)
+            with self.assertRaises(KeyboardInterrupt):
+                runner.run()
+            self.assertEqual(runner.checkpoint.state['chunks'], 2)
+            self.assertIn('(80.0%)', lines[1])
+
+            runner = BatchRunner(source, os.path.join(path, 'a'))
+            result = runner.run()
+            self.assertEqual((result.chunks, result.rows), (3, 2500))
+            self.assertEqual(result.resumed_rows, 2000)
+            ids, scores, invalid = runner.checkpoint.results()
+
+            whole = BatchRunner(source, os.path.join(path, 'b'))
+            whole.run()
+            expected = whole.checkpoint.results()
+            self.assertEqual(ids.tolist(), expected[0].tolist())
+            self.assertEqual(scores['blts_score'].tolist(),
+                             expected[1]['blts_score'].tolist())
+            self.assertEqual(invalid.tolist(), expected[2].tolist())
+
+            store = os.path.join(path, 'scores.lts')
+            self.assertEqual(runner.write(store), 2500)
+            with ScoreStore(store) as scores:
+                self.assertEqual(len(scores), 2500)
+                self.assertEqual(
+                    scores.column('blts_score').filled(0).tolist(),
+                    np.where(invalid, 0,
+                             expected[1]['blts_score']).tolist())
+
+            with self.assertRaises(ValueError):
+                BatchRunner(SyntheticSource(2500, chunk_size=500, seed=4),
+                            os.path.join(path, 'a'))
+            runner = BatchRunner(SyntheticSource(2500, chunk_size=500,
+                                                 seed=4),
+                                 os.path.join(path, 'a'), restart=True)
+            self.assertEqual(runner.checkpoint.state['chunks'], 0)
+
+
+@needs_tables
+class ServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.service = ScoringService(port=0, window=0.05)
+        self.service.start()
+
+    def tearDown(self):
+        self.service.shutdown()
+
+    def _post(self, path, body):
+        import json
+        from urllib.error import HTTPError
+        from urllib.request import urlopen
+        url = 'http://%s:%d%s' % (self.service.address + (path,))
+        try:
+            with urlopen(url, json.dumps(body).encode()) as response:
+                return response.status, json.loads(response.read())
+        except HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def _payloads(self, size):
+        network = SyntheticNetwork(size, seed=5)
+        segments, approach_lists, sidewalk_lists = network.objects()
+        payloads = []
+        for i, segment in enumerate(segments):
+            payloads.append({
+                'segment': dict((n, getattr(segment, n))
+                                for n in SEGMENT_FIELDS),
+                'approaches': [dict((n, getattr(a, n))
+                                    for n in APPROACH_FIELDS)
+                               for a in approach_lists[i]],
+                'sidewalks': [dict((n, getattr(s, n))
+                                   for n in SIDEWALK_FIELDS)
+                              for s in sidewalk_lists[i]]})
+        return segments, approach_lists, sidewalk_lists, payloads
+
+    def test_scores(self):
+        segments, approach_lists, sidewalk_lists, payloads = \
+            self._payloads(50)
+        status, body = self._post('/score/batch', payloads)
+        self.assertEqual(status, 200)
+        blts = BltsBatch.from_objects(segments, approach_lists)
+        plts = PltsBatch.from_objects(segments, sidewalk_lists,
+                                      approach_lists)
+        self.assertEqual([r['blts']['blts_score'] for r in body['results']],
+                         blts.calculate_blts().tolist())
+        self.assertEqual([r['plts']['plts_score'] for r in body['results']],
+                         plts.calculate_plts().tolist())
+        self.assertEqual([r['plts']['invalid'] for r in body['results']],
+                         plts.invalid.tolist())
+
+        status, body = self._post('/score?modes=blts', payloads[0])
+        self.assertEqual(status, 200)
+        self.assertEqual(list(body), ['blts'])
+        self.assertEqual(body['blts']['blts_score'], blts.blts_score[0])
+
+        status, body = self._post('/score', {'segment': {'speed': 30}})
+        self.assertEqual(status, 400)
+
+    def test_coalesce(self):
+        from concurrent.futures import ThreadPoolExecutor
+        payloads = self._payloads(20)[3]
+        with ThreadPoolExecutor(20) as executor:
+            results = list(executor.map(
+                lambda p: self._post('/score', p), payloads))
+        self.assertEqual([status for status, body in results], [200] * 20)
+        stats = self.service.stats()
+        self.assertEqual(stats['endpoints']['/score']['requests'], 20)
+        self.assertLess(stats['batches'], 20)
+        self.assertIsNotNone(stats['endpoints']['/score']['latency_ms']['p99'])
+
+
+class ScoreStoreTest(unittest.TestCase):
+    @needs_tables
+    def test_lookup(self):
+        network = SyntheticNetwork(300, seed=6)
+        batch = BltsBatch(approaches=network.approach_store(),
+                          **network.blts_columns())
+        batch.calculate_blts()
+        scores = batch_scores(batch)
+        ids = [(i * 7919) % 300 * 2 for i in range(300)]
+        with tempfile.TemporaryDirectory() as path:
+            store = ScoreStore.write(os.path.join(path, 'scores.lts'), ids,
+                                     scores, batch.invalid)
+            self.assertEqual(len(store), 300)
+            self.assertEqual(store.records.dtype.itemsize, 4)
+            for row in (0, 17, 299):
+                expected = dict(
+                    (name, None if batch.invalid[row] else
+                     int(values[row])) for name, values in scores.items())
+                self.assertEqual(store.get(ids[row]), expected)
+            self.assertIsNone(store.get(1))
+            self.assertNotIn(601, store)
+
+            found = store.lookup([ids[5], 3, ids[9]])
+            self.assertEqual(found['blts_score'].mask[1], True)
+            self.assertEqual(found['mix_traffic_score'][2],
+                             scores['mix_traffic_score'][9])
+            store.close()
+
+    def test_range(self):
+        with self.assertRaises(ValueError):
+            ScoreStore.write(os.devnull, [1, 2], {'blts_score': [1, 9]})
+        with self.assertRaises(ValueError):
+            ScoreStore.write(os.devnull, [1, 1], {'blts_score': [1, 2]})
+
+    def test_empty(self):
+        import numpy as np
+        with tempfile.TemporaryDirectory() as path:
+            store = ScoreStore.write(os.path.join(path, 'scores'),
+                                     np.zeros(0, dtype=np.int64),
+                                     {'blts_score': []})
+            self.assertEqual(len(store), 0)
+            self.assertNotIn(1, store)
+            self.assertIsNone(store.get(1))
+            found = store.lookup([1, 2])
+            self.assertEqual(found['blts_score'].mask.tolist(), [True, True])
+            store.close()
+
+
+@needs_tables
+@unittest.skipUnless(importlib.util.find_spec('pyarrow'),
+                     'pyarrow is not installed')
+class ArrowIOTest(unittest.TestCase):
+    def _table(self, columns, ids):
+        import pyarrow as pa
+        import numpy as np
+
+        arrays = {'segment_id': pa.array(ids)}
+        for name, values in columns.items():
+            if isinstance(values, np.ma.MaskedArray):
+                arrays[name] = pa.array(values.data,
+                                        mask=np.ma.getmaskarray(values))
+            else:
+                arrays[name] = pa.array(list(values))
+        return pa.table(arrays)
+
+    def test_round_trip(self):
+        import numpy as np
+        import pyarrow.parquet as pq
+
+        network = SyntheticNetwork(500, seed=4)
+        counts = np.diff(network.approach_offsets)
+        approaches = self._table(network.approaches,
+                                 np.repeat(network.segment_ids, counts))
+        # rows of a table need not be grouped by segment
+        approaches = approaches.take(np.arange(approaches.num_rows)[::-1])
+        with tempfile.TemporaryDirectory() as path:
+            segments = os.path.join(path, 'segments.parquet')
+            pq.write_table(self._table(network.segments,
+                                       network.segment_ids), segments)
+            reader = ArrowReader(segments, approaches, chunk_size=200)
+            output = os.path.join(path, 'scores.parquet')
+            expected = BltsBatch(approaches=network.approach_store(),
+                                 **network.blts_columns())
+            expected.calculate_blts()
+            start = 0
+            with ArrowWriter(output) as writer:
+                for columns, store, sidewalks in reader.iter_segment_chunks():
+                    self.assertIsNone(sidewalks)
+                    batch = BltsBatch(approaches=store, **dict(
+                        (name, columns[name])
+                        for name in network.blts_columns()))
+                    stop = start + len(columns['segment_id'])
+                    self.assertEqual(batch.calculate_blts().tolist(),
+                                     expected.blts_score[start:stop].tolist())
+                    writer.write_scores(columns['segment_id'],
+                                        batch_scores(batch), batch.invalid)
+                    start = stop
+            self.assertEqual(start, 500)
+            table = pq.read_table(output)
+            self.assertEqual(table.num_rows, 500)
+            score = table.column('blts_score').to_pylist()
+            self.assertEqual(score, [
+                None if invalid else int(value) for value, invalid in
+                zip(expected.blts_score, expected.invalid)])
+
+
+@unittest.skipUnless(os.environ.get('LTS_TEST_DSN'),
+                     'set LTS_TEST_DSN to a local PostgreSQL database')
+class PostgisIOTest(unittest.TestCase):
+    def setUp(self):
+        import psycopg2
+        self.connection = psycopg2.connect(os.environ['LTS_TEST_DSN'])
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE lts_segment (segment_id bigint, '
+                'aadt integer, lanes_per_direction integer, '
+                'blts smallint)')
+            cursor.execute(
+                'CREATE TEMP TABLE lts_approach (segment_id bigint, '
+                'lane_configuration text)')
+            cursor.execute(
+                'INSERT INTO lts_segment (segment_id, aadt, '
+                'lanes_per_direction) '
+                'SELECT i, i * 100, i % 4 FROM generate_series(1, 25) i')
+            cursor.execute(
+                "INSERT INTO lts_approach VALUES (3, 'XXTT'), (1, 'XXT'), "
+                "(3, 'XXLTTR')")
+
+    def tearDown(self):
+        self.connection.rollback()
+        self.connection.close()
+
+    def test_read_and_write(self):
+        reader = PostgisReader(self.connection, chunk_size=10)
+        chunks = list(reader.iter_segment_chunks(
+            'SELECT segment_id, aadt, lanes_per_direction FROM lts_segment '
+            'ORDER BY segment_id',
+            'SELECT segment_id, lane_configuration FROM lts_approach '
+            'WHERE segment_id = ANY(%s)'))
+        self.assertEqual([len(c[0]['segment_id']) for c in chunks],
+                         [10, 10, 5])
+        columns, approaches, sidewalks = chunks[0]
+        self.assertEqual(list(approaches.offsets[:4]), [0, 1, 1, 3])
+
+        writer = PostgisWriter(self.connection)
+        ids = columns['segment_id']
+        count = writer.write_scores('lts_segment', 'segment_id', ids,
+                                    {'blts': [2] * len(ids)})
+        self.assertEqual(count, len(ids))
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM lts_segment WHERE blts = 2')
+            self.assertEqual(cursor.fetchone()[0], len(ids))
+
+        invalid = ids % 2 == 0
+        writer.write_scores('lts_segment', 'segment_id', ids,
+                            {'blts': [3] * len(ids)}, invalid=invalid)
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM lts_segment WHERE blts = 3')
+            self.assertEqual(cursor.fetchone()[0], len(ids) - invalid.sum())
+            cursor.execute('SELECT count(*) FROM lts_segment '
+                           'WHERE blts IS NULL AND segment_id <= 10')
+            self.assertEqual(cursor.fetchone()[0], invalid.sum())
+
+    def test_write_failure(self):
+        import psycopg2
+        connection = psycopg2.connect(os.environ['LTS_TEST_DSN'])
+        connection.autocommit = True
+        try:
+            writer = PostgisWriter(connection)
+            self.assertEqual(writer.write_scores('lts_missing', 'segment_id',
+                                                 [1, 2], {}), 0)
+            # the staging table of a failed write is dropped
+            with self.assertRaises(psycopg2.Error):
+                writer.write_scores('lts_missing', 'segment_id', [1, 2],
+                                    {'blts': [1, 2]})
+            with connection.cursor() as cursor:
+                cursor.execute('CREATE TEMP TABLE lts_written '
+                               '(segment_id bigint, blts smallint)')
+                cursor.execute('INSERT INTO lts_written VALUES (1), (2)')
+            self.assertEqual(writer.write_scores('lts_written', 'segment_id',
+                                                 [1, 2], {'blts': [1, 2]}), 2)
+        finally:
+            connection.close()
+
+
+@needs_tables
+@unittest.skipUnless(os.environ.get('LTS_TEST_DSN'),
+                     'set LTS_TEST_DSN to a local PostgreSQL database')
+class AsyncScorerTest(unittest.TestCase):
+    # the pipeline connects more than once, so the tables are not temporary
+    def connect(self):
+        import psycopg2
+        return psycopg2.connect(os.environ['LTS_TEST_DSN'])
+
+    def setUp(self):
+        connection = self.connect()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE lts_pipeline_segment (segment_id bigint, '
+                'aadt integer, lanes_per_direction integer, '
+                'bicycle_facility_width real, parking_lane_width real, '
+                'posted_speed integer, blts_score smallint)')
+            cursor.execute(
+                'CREATE TABLE lts_pipeline_approach (segment_id bigint, '
+                'lane_configuration text)')
+            cursor.execute(
+                'INSERT INTO lts_pipeline_segment (segment_id, aadt, '
+                'lanes_per_direction, bicycle_facility_width, '
+                'parking_lane_width, posted_speed) '
+                'SELECT i, i * 500, 1 + i % 3, NULL, NULL, 20 + 5 * (i % 4) '
+                'FROM generate_series(1, 95) i')
+            cursor.execute(
+                "INSERT INTO lts_pipeline_approach "
+                "SELECT i, 'XXLTR' FROM generate_series(1, 95, 2) i")
+        connection.commit()
+        connection.close()
+
+    def tearDown(self):
+        connection = self.connect()
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE lts_pipeline_segment, '
+                           'lts_pipeline_approach')
+        connection.commit()
+        connection.close()
+
+    def test_score(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(2) as executor:
+            scorer = AsyncScorer(self.connect, pool_size=2, workers=2,
+                                 chunk_size=10, depth=1, executor=executor)
+            result = scorer.run(
+                'SELECT segment_id, aadt, lanes_per_direction, '
+                'bicycle_facility_width, parking_lane_width, posted_speed '
+                'FROM lts_pipeline_segment',
+                'SELECT segment_id, lane_configuration '
+                'FROM lts_pipeline_approach WHERE segment_id = ANY(%s)',
+                table='lts_pipeline_segment',
+                columns={'blts_score': 'blts_score'})
+        self.assertEqual((result.rows, result.chunks), (95, 10))
+
+        connection = self.connect()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM lts_pipeline_segment '
+                           'WHERE blts_score IS NULL')
+            self.assertEqual(cursor.fetchone()[0], 0)
+        connection.close()
+
+
+@needs_tables
+@unittest.skipUnless(os.environ.get('LTS_TEST_DSN'),
+                     'set LTS_TEST_DSN to a local PostgreSQL database')
+class SqlParityTest(unittest.TestCase):
+    TYPES = {
+        'aadt': 'integer', 'lanes_per_direction': 'integer',
+        'bicycle_facility_width': 'real', 'parking_lane_width': 'real',
+        'posted_speed': 'real', 'functional_class': 'integer',
+        'total_lanes': 'integer', 'marked_center_lane': 'text',
+        'lane_configuration': 'text', 'right_turn_lane_length': 'real',
+        'bike_lane_approach': 'text', 'median_present': 'boolean',
+        'control_type': 'text', 'sidewalk_width': 'real',
+        'buffer_type': 'text', 'buffer_width': 'real',
+        'sidewalk_score': 'real', 'overall_landuse': 'real',
+    }
+
+    def setUp(self):
+        import numpy as np
+        import psycopg2
+        self.connection = psycopg2.connect(os.environ['LTS_TEST_DSN'])
+        self.network = SyntheticNetwork(500, seed=4)
+        network = self.network
+        self._load('lts_sql_segment', network.segment_ids, network.segments)
+        self._load('lts_sql_approach', np.repeat(
+            network.segment_ids, np.diff(network.approach_offsets)),
+            network.approaches)
+        self._load('lts_sql_sidewalk', np.repeat(
+            network.segment_ids, np.diff(network.sidewalk_offsets)),
+            network.sidewalks)
+
+    def _load(self, table, ids, columns):
+        import numpy as np
+        names = list(columns)
+        rows = [[int(i)] for i in ids]
+        for name in names:
+            values = columns[name]
+            if not isinstance(values, np.ma.MaskedArray):
+                values = np.ma.array(values, dtype=object)
+            for row, value in zip(rows, values.tolist()):
+                row.append(value)
+        with self.connection.cursor() as cursor:
+            cursor.execute('CREATE TEMP TABLE %s (segment_id bigint, %s)' % (
+                table, ', '.join('%s %s' % (n, self.TYPES[n])
+                                 for n in names)))
+            cursor.executemany('INSERT INTO %s VALUES (%s)' % (
+                table, ', '.join(['%s'] * (len(names) + 1))), rows)
+
+    def tearDown(self):
+        self.connection.rollback()
+        self.connection.close()
+
+    def _assert_parity(self, query, batch, names):
+        with self.connection.cursor() as cursor:
+            cursor.execute(query + ' ORDER BY segment_id')
+            rows = cursor.fetchall()
+        self.assertEqual([r[0] for r in rows],
+                         self.network.segment_ids.tolist())
+        for i, name in enumerate(names + ['invalid']):
+            expected = batch.invalid if name == 'invalid' \
+                else getattr(batch, name)
+            self.assertEqual([r[i + 1] for r in rows], expected.tolist(),
+                             name)
+
+    def test_blts(self):
+        network = self.network
+        batch = BltsBatch(approaches=network.approach_store(),
+                          **network.blts_columns())
+        batch.calculate_blts()
+        self._assert_parity(
+            blts_query('lts_sql_segment', 'lts_sql_approach'), batch,
+            BLTS_SCORES)
+
+    def test_plts(self):
+        network = self.network
+        batch = PltsBatch(sidewalks=network.sidewalk_store(),
+                          approaches=network.approach_store(),
+                          **network.plts_columns())
+        batch.calculate_plts()
+        self._assert_parity(
+            plts_query('lts_sql_segment', 'lts_sql_sidewalk',
+                       'lts_sql_approach'), batch, PLTS_SCORES)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -26,5 +26,10 @@ setup(name='cuuats.snt.lts',
       author_email='klai@ccrpc.org',
       url='https://cuuats.org/',
       packages=find_packages(exclude=['ez_setup']),
-      namespace_packages=['cuuats', 'cuuats.snt']
+      namespace_packages=['cuuats', 'cuuats.snt'],
+      extras_require={
+          'arrow': ['numpy', 'pyarrow'],
+          'batch': ['numpy'],
+          'postgis': ['numpy', 'psycopg2'],
+      }
       )